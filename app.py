@@ -1,30 +1,52 @@
+import time
+_import_started = time.perf_counter()
+
 import re
-from flask import Flask, request, jsonify, Response, redirect, url_for, render_template_string, session
+from flask import Flask, request, jsonify, Response, redirect, url_for, render_template, session, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
+import json
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import URLSafeSerializer, BadSignature
 import os.path
 import secrets
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-import pyodbc
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import contextlib
 from dotenv import load_dotenv
-import time
 import threading
 import queue
+import logging
+import logging.handlers
+import sys
+import uuid
+import atexit
+import collections
+import copy
+import select
+import multiprocessing
+import functools
+import hashlib
+import math
+import random
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import sqlite3
-import resend
-# from database_keepalive import *  # Disabled for Render - not needed with PostgreSQL
+import gzip
 
-# PostgreSQL support
+# Database drivers (pyodbc, psycopg2) and the resend client are imported where they're used,
+# so a worker only loads what its backend and email setting need
+
+# Brotli support (optional, gzip is used when it's missing)
 try:
-    import psycopg2
-    from psycopg2 import pool as pg_pool
-    POSTGRES_AVAILABLE = True
+    import brotli
+    BROTLI_AVAILABLE = True
 except ImportError:
-    POSTGRES_AVAILABLE = False
+    BROTLI_AVAILABLE = False
 
 # Load environment variables
 load_dotenv()
@@ -33,15 +55,505 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 app.config['SECRET_KEY'] = os.getenv('CORS_SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    # Sessions and signed links need a key; a random one only works within this process
+    app.config['SECRET_KEY'] = secrets.token_hex(32)
+    # Logged below once the logger exists
+    secret_key_generated = True
+else:
+    secret_key_generated = False
 app.config['VERIFICATION_TOKEN_EXPIRY'] = 24  # Hours
+# Accept unsigned links issued before tokens were signed; safe to turn off once those have expired
+app.config['LEGACY_TOKEN_FALLBACK'] = os.getenv('LEGACY_TOKEN_FALLBACK', 'true').lower() == 'true'
+app.config['QUERY_PROFILER'] = os.getenv('QUERY_PROFILER', 'false').lower() == 'true'  # Opt-in, adds X-Query-* headers
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', '10'))  # Statements per request before a request is flagged
+app.config['QUERY_REPEAT_THRESHOLD'] = int(os.getenv('QUERY_REPEAT_THRESHOLD', '3'))  # Same statement shape this often = likely N+1
+app.config['HEALTH_PROBE_INTERVAL'] = int(os.getenv('HEALTH_PROBE_INTERVAL', '15'))  # Seconds between background DB probes, 0 disables
+app.config['HEALTH_PROBE_MAX_AGE'] = int(os.getenv('HEALTH_PROBE_MAX_AGE', '60'))  # /readyz fails once the last good probe is older than this
+app.config['DB_KEEPALIVE'] = os.getenv('DB_KEEPALIVE', 'true').lower() == 'true'  # Keep pooled connections warm while the app is idle
+app.config['DB_AUTO_PAUSE_SECONDS'] = int(os.getenv('DB_AUTO_PAUSE_SECONDS', '0'))  # Backend's idle auto-pause window, 0 = per-backend default
+app.config['DB_CONN_VALIDATE_AFTER'] = int(os.getenv('DB_CONN_VALIDATE_AFTER', '30'))  # Seconds idle before a pooled SQL Server connection is re-checked, 0 = every checkout
+app.config['DB_CONN_MAX_LIFETIME'] = int(os.getenv('DB_CONN_MAX_LIFETIME', '1800'))  # Seconds before a SQL Server connection is recycled, 0 = never
+app.config['INIT_DB_ON_START'] = os.getenv('INIT_DB_ON_START', 'false').lower() == 'true'  # Otherwise run `flask --app app init-db`
+app.config['IMPORT_TIME_BUDGET_MS'] = int(os.getenv('IMPORT_TIME_BUDGET_MS', '500'))  # Warn when importing app.py takes longer
+app.config['SHUTDOWN_DRAIN_TIMEOUT'] = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '10'))  # Seconds to wait for in-flight work on shutdown
+app.config['CACHE_BUS_ENABLED'] = os.getenv('CACHE_BUS_ENABLED', 'true').lower() == 'true'  # Share cache invalidations between workers
+app.config['CACHE_BUS_POLL_INTERVAL'] = float(os.getenv('CACHE_BUS_POLL_INTERVAL', '1'))  # Seconds, SQLite/SQL Server polling
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', '60'))  # Seconds a logged-in user's row is reused, 0 disables
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_SAMPLE_RATE'] = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))  # Fraction of high-volume messages (login attempts, lookups) kept
+app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # Records beyond this are dropped rather than blocking a request
+app.config['EMAIL_BACKEND'] = os.getenv('EMAIL_BACKEND', 'resend')  # 'resend', or 'console' to only log links
+app.config['MAINTENANCE_INTERVAL'] = int(os.getenv('MAINTENANCE_INTERVAL', '3600'))  # Seconds, 0 disables
+app.config['CLASS_SERIES_HORIZON_DAYS'] = int(os.getenv('CLASS_SERIES_HORIZON_DAYS', '56'))  # How far ahead recurring classes are created
+app.config['BULK_CLASSES_MAX'] = int(os.getenv('BULK_CLASSES_MAX', '1000'))  # Classes accepted by one POST /classes/bulk
+app.config['CALENDAR_NAME'] = os.getenv('CALENDAR_NAME', 'Jantine van Wijlick Yoga')
+app.config['CALENDAR_TIMEZONE'] = os.getenv('CALENDAR_TIMEZONE', 'Europe/Amsterdam')  # Class times are stored in studio local time
+app.config['CALENDAR_MAX_AGE'] = int(os.getenv('CALENDAR_MAX_AGE', '300'))  # Seconds calendar clients may reuse a feed
+app.config['CALENDAR_CACHE_SIZE'] = int(os.getenv('CALENDAR_CACHE_SIZE', '2000'))  # Rendered feeds kept per worker
+app.config['ROLLUP_FLUSH_INTERVAL'] = int(os.getenv('ROLLUP_FLUSH_INTERVAL', '10'))  # Seconds between occupancy rollup updates, 0 = sweep only
+app.config['ROLLUP_SETTLE_DAYS'] = int(os.getenv('ROLLUP_SETTLE_DAYS', '1'))  # Classes older than this are final and leave the catch-up window
+app.config['UNVERIFIED_ACCOUNT_GRACE_DAYS'] = int(os.getenv('UNVERIFIED_ACCOUNT_GRACE_DAYS', '7'))
+app.config['UNVERIFIED_ACCOUNT_ACTION'] = os.getenv('UNVERIFIED_ACCOUNT_ACTION', 'delete')  # 'delete' or 'archive'
+app.config['MAINTENANCE_BATCH_SIZE'] = int(os.getenv('MAINTENANCE_BATCH_SIZE', '200'))
+app.config['MAINTENANCE_BATCH_PAUSE'] = float(os.getenv('MAINTENANCE_BATCH_PAUSE', '0.2'))  # Seconds between batches
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # Bytes
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', '6'))  # gzip 1-9, mapped onto brotli 0-11
+app.config['CATALOG_CACHE_TTL'] = int(os.getenv('CATALOG_CACHE_TTL', '30'))  # Seconds
+app.config['CATALOG_STALE_TTL'] = int(os.getenv('CATALOG_STALE_TTL', '300'))  # Seconds an expired catalog may be served while it refreshes
+app.config['SEAT_STREAM_KEEPALIVE'] = int(os.getenv('SEAT_STREAM_KEEPALIVE', '25'))  # Seconds between SSE heartbeats
+# Each stream served by the app itself holds a worker thread; keep at least half of them free for requests
+app.config['SEAT_STREAM_MAX_SUBSCRIBERS'] = int(os.getenv(
+    'SEAT_STREAM_MAX_SUBSCRIBERS', str(max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2))))
+# Base URL of seat_stream.py; when set, /classes/stream redirects there instead of holding a thread
+app.config['SEAT_STREAM_URL'] = os.getenv('SEAT_STREAM_URL', '')
+app.config['SEAT_STREAM_MAX_CLIENTS'] = int(os.getenv('SEAT_STREAM_MAX_CLIENTS', '10000'))  # Open streams per seat_stream.py process
+app.config['PASSWORD_HASH_ITERATIONS'] = int(os.getenv('PASSWORD_HASH_ITERATIONS', '1000000'))  # PBKDF2 work factor
+# Hashing processes per gunicorn worker (0 = hash inline); the CPUs are shared out between the WEB_CONCURRENCY workers
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv(
+    'PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // int(os.getenv('WEB_CONCURRENCY', '2'))))))
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', '16'))  # Max queued + running jobs
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', '2'))  # Seconds to wait for a slot
+app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # 'memory' or 'database'
+app.config['RATE_LIMIT_MAX_KEYS'] = int(os.getenv('RATE_LIMIT_MAX_KEYS', '10000'))
+# Limits per endpoint as (requests, seconds), keyed by client IP, submitted email, or both.
+# Login and password reset use email + IP so requests from elsewhere can't lock the account owner out.
+app.config['RATE_LIMITS'] = {
+    'login': {'ip': (30, 60), 'email_ip': (10, 300)},
+    'signup': {'ip': (10, 3600), 'email': (3, 3600)},
+    'resend_verification': {'ip': (10, 3600), 'email': (3, 3600)},
+    'password_reset': {'ip': (10, 3600), 'email_ip': (3, 3600)},
+}
+
+# Trust X-Forwarded-For/Proto from this many proxies (Render/Azure put one in front of the app)
+proxy_fix_hops = int(os.getenv('PROXY_FIX_HOPS', '0'))
+if proxy_fix_hops > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_fix_hops, x_proto=proxy_fix_hops)
+
+# --------------------------------------
+# Logging
+# --------------------------------------
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; anything passed through extra= becomes a field"""
+
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName', 'sample'}
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of records logged with extra={'sample': rate}"""
+
+    def filter(self, record):
+        rate = getattr(record, 'sample', None)
+        return rate is None or rate >= 1 or random.random() < rate
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request's correlation id, in the thread that logged them"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.path = request.path
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops them instead of waiting when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Requests only ever put records on a queue; a single listener thread does the formatting and writing
+log_queue = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+log_handler = NonBlockingQueueHandler(log_queue)
+log_handler.addFilter(SamplingFilter())
+log_handler.addFilter(RequestContextFilter())
+
+log_output = logging.StreamHandler(sys.stdout)
+log_output.setFormatter(JsonLogFormatter())
+log_listener = logging.handlers.QueueListener(log_queue, log_output)
+log_listener.start()
+_log_listener_pid = os.getpid()
+
+def ensure_log_listener():
+    """Start a log writer thread in a forked child; the parent's thread didn't come along"""
+    global log_queue, log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    # Fresh queue too: the parent's may have been forked with its mutex held
+    log_queue = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+    log_handler.queue = log_queue
+    log_listener = logging.handlers.QueueListener(log_queue, log_output)
+    log_listener.start()
+    _log_listener_pid = os.getpid()
+
+def stop_log_listener():
+    """Flush queued records and stop the writer thread (only the process that started it can)"""
+    global _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        _log_listener_pid = None
+        log_listener.stop()
+
+# Registered first so it runs last and flushes whatever shutdown logs
+atexit.register(stop_log_listener)
+
+logger = logging.getLogger('yoga_booking')
+logger.setLevel(app.config['LOG_LEVEL'])
+logger.handlers = [log_handler]
+logger.propagate = False
+
+if secret_key_generated:
+    logger.warning("CORS_SECRET_KEY is not set, using a random key (sessions and links won't survive a restart)")
+
+# --------------------------------------
+# Metrics
+# --------------------------------------
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus-style metrics.
+    Every thread records into its own shard, so observing a value never takes a lock;
+    shards are only summed when /metrics is scraped. Shards of finished threads are folded
+    into a retired total so short-lived threads don't pile up.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+        self._histograms = {}
+        self._counters = {}
+        self._gauge_collectors = []
+
+    def histogram(self, name, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        self._histograms[name] = (help_text, tuple(buckets))
+
+    def counter(self, name, help_text):
+        self._counters[name] = help_text
+
+    def gauge_collector(self, collector):
+        """Register a function returning [(name, help, labels, value), ...] evaluated at scrape time"""
+        self._gauge_collectors.append(collector)
+        return collector
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        buckets = self._histograms[name][1]
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        entry = shard.get(key)
+        if entry is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            entry = shard[key] = [0] * (len(buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(buckets, value)] += 1
+        entry[-1] += value
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        shard = self._shard()
+        shard[key] = shard.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(target, shard):
+        # A writer may add keys while we copy, so retry the snapshot
+        while True:
+            try:
+                items = list(shard.items())
+                break
+            except RuntimeError:
+                continue
+        for key, value in items:
+            if isinstance(value, list):
+                existing = target.get(key)
+                if existing is None:
+                    target[key] = list(value)
+                else:
+                    for i, v in enumerate(value):
+                        existing[i] += v
+            else:
+                target[key] = target.get(key, 0) + value
+
+    def collect(self):
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            merged = {}
+            self._merge(merged, self._retired)
+        for thread, shard in alive:
+            self._merge(merged, shard)
+        return merged
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def _labels(cls, labels, extra=None):
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{cls._escape(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        merged = self.collect()
+        lines = []
+
+        for name, (help_text, buckets) in sorted(self._histograms.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), entry in sorted(merged.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), entry[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {entry[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+
+        for name, help_text in sorted(self._counters.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(merged.items()):
+                if metric == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+
+        gauges = collections.OrderedDict()
+        for collector in self._gauge_collectors:
+            try:
+                for name, help_text, labels, value in collector():
+                    gauges.setdefault(name, (help_text, []))[1].append((labels, value))
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)[:80]}")
+        for name, (help_text, samples) in gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f"{name}{self._labels(sorted(labels.items()))} {float(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+metrics.histogram('http_request_duration_seconds', 'Request latency by route')
+metrics.histogram('http_request_stage_seconds', 'Time spent per request in pool wait, queries and JSON serialization')
+metrics.histogram('db_pool_wait_seconds', 'Time spent waiting for a database connection')
+metrics.histogram('db_query_seconds', 'Time spent executing statements and fetching rows')
+metrics.histogram('json_serialization_seconds', 'Time spent serializing JSON responses')
+metrics.histogram('email_send_seconds', 'Outbound email latency by kind and outcome')
+metrics.counter('email_send_total', 'Outbound emails by kind and outcome')
+
+STAGE_HISTOGRAMS = {
+    'pool_wait': 'db_pool_wait_seconds',
+    'query': 'db_query_seconds',
+    'serialization': 'json_serialization_seconds',
+}
+
+def record_stage(stage, duration):
+    """Record a request stage both globally and against the current request, if any"""
+    metrics.observe(STAGE_HISTOGRAMS[stage], duration)
+    if has_request_context():
+        stages = g.setdefault('stage_times', {})
+        stages[stage] = stages.get(stage, 0.0) + duration
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that records serialization time"""
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            record_stage('serialization', time.perf_counter() - start)
+
+app.json_provider_class = TimedJSONProvider
+app.json = TimedJSONProvider(app)
+
+def record_email(kind, outcome, duration):
+    metrics.observe('email_send_seconds', duration, kind=kind, outcome=outcome)
+    metrics.inc('email_send_total', kind=kind, outcome=outcome)
+
+# --------------------------------------
+# Query profiling
+# --------------------------------------
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Reduce a statement to its shape: literals become ?, IN lists collapse, whitespace is squeezed"""
+    shape = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    shape = re.sub(r'%s', '?', shape)
+    shape = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', shape)
+    return re.sub(r'\s+', ' ', shape).strip()
+
+class QueryProfiler:
+    """
+    Opt-in per-request statement profiler.
+    Counts statements and connection checkouts per request, keeps their normalized SQL and timings,
+    flags requests over the query budget or repeating one statement shape (the N+1 signature),
+    and aggregates a per-route summary for /debug/queries.
+    """
+
+    def __init__(self, enabled, budget, repeat_threshold):
+        self.enabled = enabled
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _profile(self):
+        if not self.enabled or not has_request_context():
+            return None
+        profile = g.get('query_profile')
+        if profile is None:
+            profile = g.query_profile = {'queries': [], 'connections': 0}
+        return profile
+
+    def record_query(self, sql, duration):
+        profile = self._profile()
+        if profile is not None:
+            profile['queries'].append((normalize_sql(sql), duration))
+
+    def record_connection(self):
+        profile = self._profile()
+        if profile is not None:
+            profile['connections'] += 1
+
+    def finish(self, response):
+        """Summarize the current request's statements into headers and the route report"""
+        profile = g.get('query_profile') or {'queries': [], 'connections': 0}
+        queries = profile['queries']
+        shapes = collections.Counter(shape for shape, duration in queries)
+        total_time = sum(duration for shape, duration in queries)
+
+        warnings = []
+        if len(queries) > self.budget:
+            warnings.append(f"over budget ({len(queries)}/{self.budget})")
+        for shape, count in shapes.most_common():
+            if count < self.repeat_threshold:
+                break
+            warnings.append(f"repeated {count}x: {shape[:80]}")
+
+        response.headers['X-Query-Count'] = str(len(queries))
+        response.headers['X-Query-Time-Ms'] = f"{total_time * 1000:.2f}"
+        response.headers['X-Query-Connections'] = str(profile['connections'])
+        if warnings:
+            response.headers['X-Query-Warnings'] = '; '.join(warnings)
+            logger.warning(f"Query profile warning for {request.method} {request.path}",
+                           extra={'query_count': len(queries), 'query_warnings': warnings})
+
+        route = f"{request.method} {request.url_rule.rule if request.url_rule else 'unmatched'}"
+        with self._lock:
+            summary = self._routes.setdefault(route, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'connections': 0,
+                'query_time': 0.0, 'flagged': 0, 'shapes': collections.Counter()
+            })
+            summary['requests'] += 1
+            summary['queries'] += len(queries)
+            summary['max_queries'] = max(summary['max_queries'], len(queries))
+            summary['connections'] += profile['connections']
+            summary['query_time'] += total_time
+            summary['flagged'] += 1 if warnings else 0
+            summary['shapes'].update(shapes)
+        return response
+
+    def report(self):
+        """Per-route summary, busiest routes first"""
+        with self._lock:
+            routes = {route: dict(summary, shapes=summary['shapes'].copy()) for route, summary in self._routes.items()}
+        report = []
+        for route, summary in routes.items():
+            requests_count = summary['requests']
+            report.append({
+                'route': route,
+                'requests': requests_count,
+                'avg_queries': round(summary['queries'] / requests_count, 2),
+                'max_queries': summary['max_queries'],
+                'avg_connections': round(summary['connections'] / requests_count, 2),
+                'avg_query_time_ms': round(summary['query_time'] / requests_count * 1000, 2),
+                'flagged_requests': summary['flagged'],
+                'top_statements': [{'sql': shape, 'count': count}
+                                   for shape, count in summary['shapes'].most_common(5)]
+            })
+        report.sort(key=lambda item: item['requests'] * item['avg_queries'], reverse=True)
+        return {'budget': self.budget, 'repeat_threshold': self.repeat_threshold, 'routes': report}
+
+query_profiler = QueryProfiler(
+    enabled=app.config['QUERY_PROFILER'],
+    budget=app.config['QUERY_BUDGET'],
+    repeat_threshold=app.config['QUERY_REPEAT_THRESHOLD']
+)
+
+@app.after_request
+def profile_queries(response):
+    if query_profiler.enabled:
+        return query_profiler.finish(response)
+    return response
 
 # Configure session handling
 @app.before_request
 def before_request():
     session.modified = True
+    g.request_start = time.perf_counter()
+    # Reuse the proxy's correlation id when it sends a sane one
+    incoming_id = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming_id if re.fullmatch(r'[\w.-]{1,64}', incoming_id) else uuid.uuid4().hex
+
+@app.after_request
+def attach_request_id(response):
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        method=request.method, route=route, status=response.status_code)
+        for stage, duration in g.get('stage_times', {}).items():
+            metrics.observe('http_request_stage_seconds', duration, route=route, stage=stage)
+    return response
 
 # Database configuration with environment detection
 def get_database_config():
@@ -108,7 +620,6 @@ def get_database_config():
 
 # Get database configuration
 DB_CONFIG = get_database_config()
-print(f"Using {DB_CONFIG['type']} database: {DB_CONFIG.get('database', DB_CONFIG.get('server'))}")
 
 def get_sql_queries():
     """Get SQL queries appropriate for the database type"""
@@ -149,6 +660,130 @@ def get_sql_queries():
                 FOREIGN KEY (class_id) REFERENCES YogaClasses(id)
             )
             """,
+            'create_archived_users_table': """
+            CREATE TABLE IF NOT EXISTS ArchivedUsers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                surname TEXT NOT NULL,
+                email TEXT NOT NULL,
+                archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_auth_tokens_table': """
+            CREATE TABLE IF NOT EXISTS AuthTokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                purpose TEXT NOT NULL,
+                token_hash TEXT NOT NULL UNIQUE,
+                expires_at DATETIME NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+            )
+            """,
+            'create_auth_tokens_indexes': [
+                'CREATE INDEX IF NOT EXISTS IX_AuthTokens_expires_at ON AuthTokens (expires_at)',
+                'CREATE INDEX IF NOT EXISTS IX_AuthTokens_user_purpose ON AuthTokens (user_id, purpose)'
+            ],
+            'consume_auth_token': """
+            DELETE FROM AuthTokens WHERE token_hash = ? AND purpose = ?
+            RETURNING user_id, expires_at
+            """,
+            'purge_auth_tokens_batch': """
+            DELETE FROM AuthTokens WHERE id IN (
+                SELECT id FROM AuthTokens WHERE expires_at < ? LIMIT ?
+            )
+            """,
+            'create_rate_limits_table': """
+            CREATE TABLE IF NOT EXISTS RateLimits (
+                bucket_key TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                window_end INTEGER NOT NULL
+            )
+            """,
+            'create_cache_invalidations_table': """
+            CREATE TABLE IF NOT EXISTS CacheInvalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                item_key TEXT NULL,
+                origin TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_class_series_table': """
+            CREATE TABLE IF NOT EXISTS ClassSeries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                instructor TEXT NOT NULL,
+                weekdays TEXT NOT NULL,
+                start_time TEXT NOT NULL,
+                duration INTEGER NOT NULL DEFAULT 75,
+                capacity INTEGER NOT NULL,
+                location TEXT NOT NULL,
+                starts_on TEXT NOT NULL,
+                until_on TEXT NULL,
+                interval_weeks INTEGER NOT NULL DEFAULT 1,
+                exceptions TEXT NOT NULL DEFAULT '',
+                status TEXT DEFAULT 'active',
+                materialized_until DATETIME NULL
+            )
+            """,
+            'create_series_occurrences_table': """
+            CREATE TABLE IF NOT EXISTS SeriesOccurrences (
+                series_id INTEGER NOT NULL,
+                occurs_at DATETIME NOT NULL,
+                class_id INTEGER NOT NULL,
+                PRIMARY KEY (series_id, occurs_at),
+                FOREIGN KEY (series_id) REFERENCES ClassSeries(id),
+                FOREIGN KEY (class_id) REFERENCES YogaClasses(id) ON DELETE CASCADE
+            )
+            """,
+            'create_bookings_indexes': [
+                'CREATE INDEX IF NOT EXISTS IX_Bookings_class_status ON Bookings (class_id, status)'
+            ],
+            'create_class_occupancy_table': """
+            CREATE TABLE IF NOT EXISTS ClassOccupancy (
+                class_id INTEGER PRIMARY KEY,
+                class_day TEXT NOT NULL,
+                instructor TEXT NOT NULL,
+                location TEXT NOT NULL,
+                capacity INTEGER NOT NULL,
+                class_status TEXT NOT NULL,
+                booked INTEGER NOT NULL,
+                cancelled INTEGER NOT NULL,
+                refreshed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_daily_occupancy_table': """
+            CREATE TABLE IF NOT EXISTS DailyOccupancy (
+                day TEXT NOT NULL,
+                instructor TEXT NOT NULL,
+                location TEXT NOT NULL,
+                classes INTEGER NOT NULL,
+                cancelled_classes INTEGER NOT NULL,
+                capacity INTEGER NOT NULL,
+                booked INTEGER NOT NULL,
+                cancelled INTEGER NOT NULL,
+                PRIMARY KEY (day, instructor, location)
+            )
+            """,
+            'create_rollup_watermarks_table': """
+            CREATE TABLE IF NOT EXISTS RollupWatermarks (
+                name TEXT PRIMARY KEY,
+                watermark DATETIME NOT NULL
+            )
+            """,
+            'create_calendar_keys_table': """
+            CREATE TABLE IF NOT EXISTS CalendarKeys (
+                user_id INTEGER PRIMARY KEY,
+                revision INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+            )
+            """,
+            'bump_calendar_revision': """
+            INSERT INTO CalendarKeys (user_id, revision) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET revision = CalendarKeys.revision + 1
+            """,
             'get_identity': 'SELECT last_insert_rowid()',
             'get_current_timestamp': 'CURRENT_TIMESTAMP',
             'get_date_now': 'datetime("now")'
@@ -190,6 +825,127 @@ def get_sql_queries():
                 FOREIGN KEY (class_id) REFERENCES YogaClasses(id) ON DELETE CASCADE
             )
             """,
+            'create_archived_users_table': """
+            CREATE TABLE IF NOT EXISTS ArchivedUsers (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name VARCHAR(100) NOT NULL,
+                surname VARCHAR(100) NOT NULL,
+                email VARCHAR(120) NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_auth_tokens_table': """
+            CREATE TABLE IF NOT EXISTS AuthTokens (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                purpose VARCHAR(20) NOT NULL,
+                token_hash CHAR(64) NOT NULL UNIQUE,
+                expires_at TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+            )
+            """,
+            'create_auth_tokens_indexes': [
+                'CREATE INDEX IF NOT EXISTS IX_AuthTokens_expires_at ON AuthTokens (expires_at)',
+                'CREATE INDEX IF NOT EXISTS IX_AuthTokens_user_purpose ON AuthTokens (user_id, purpose)'
+            ],
+            'consume_auth_token': """
+            DELETE FROM AuthTokens WHERE token_hash = %s AND purpose = %s
+            RETURNING user_id, expires_at
+            """,
+            'purge_auth_tokens_batch': """
+            DELETE FROM AuthTokens WHERE id IN (
+                SELECT id FROM AuthTokens WHERE expires_at < %s LIMIT %s
+            )
+            """,
+            'create_rate_limits_table': """
+            CREATE TABLE IF NOT EXISTS RateLimits (
+                bucket_key VARCHAR(100) PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                window_end BIGINT NOT NULL
+            )
+            """,
+            'create_cache_invalidations_table': """
+            CREATE TABLE IF NOT EXISTS CacheInvalidations (
+                id SERIAL PRIMARY KEY,
+                topic VARCHAR(50) NOT NULL,
+                item_key VARCHAR(100) NULL,
+                origin VARCHAR(64) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_class_series_table': """
+            CREATE TABLE IF NOT EXISTS ClassSeries (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                instructor VARCHAR(100) NOT NULL,
+                weekdays VARCHAR(20) NOT NULL,
+                start_time VARCHAR(5) NOT NULL,
+                duration INTEGER NOT NULL DEFAULT 75,
+                capacity INTEGER NOT NULL,
+                location VARCHAR(200) NOT NULL,
+                starts_on VARCHAR(10) NOT NULL,
+                until_on VARCHAR(10) NULL,
+                interval_weeks INTEGER NOT NULL DEFAULT 1,
+                exceptions TEXT NOT NULL DEFAULT '',
+                status VARCHAR(20) DEFAULT 'active',
+                materialized_until TIMESTAMP NULL
+            )
+            """,
+            'create_series_occurrences_table': """
+            CREATE TABLE IF NOT EXISTS SeriesOccurrences (
+                series_id INTEGER NOT NULL REFERENCES ClassSeries(id),
+                occurs_at TIMESTAMP NOT NULL,
+                class_id INTEGER NOT NULL REFERENCES YogaClasses(id) ON DELETE CASCADE,
+                PRIMARY KEY (series_id, occurs_at)
+            )
+            """,
+            'create_bookings_indexes': [
+                'CREATE INDEX IF NOT EXISTS IX_Bookings_class_status ON Bookings (class_id, status)'
+            ],
+            'create_class_occupancy_table': """
+            CREATE TABLE IF NOT EXISTS ClassOccupancy (
+                class_id INTEGER PRIMARY KEY,
+                class_day VARCHAR(10) NOT NULL,
+                instructor VARCHAR(100) NOT NULL,
+                location VARCHAR(200) NOT NULL,
+                capacity INTEGER NOT NULL,
+                class_status VARCHAR(20) NOT NULL,
+                booked INTEGER NOT NULL,
+                cancelled INTEGER NOT NULL,
+                refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            'create_daily_occupancy_table': """
+            CREATE TABLE IF NOT EXISTS DailyOccupancy (
+                day VARCHAR(10) NOT NULL,
+                instructor VARCHAR(100) NOT NULL,
+                location VARCHAR(200) NOT NULL,
+                classes INTEGER NOT NULL,
+                cancelled_classes INTEGER NOT NULL,
+                capacity INTEGER NOT NULL,
+                booked INTEGER NOT NULL,
+                cancelled INTEGER NOT NULL,
+                PRIMARY KEY (day, instructor, location)
+            )
+            """,
+            'create_rollup_watermarks_table': """
+            CREATE TABLE IF NOT EXISTS RollupWatermarks (
+                name VARCHAR(50) PRIMARY KEY,
+                watermark TIMESTAMP NOT NULL
+            )
+            """,
+            'create_calendar_keys_table': """
+            CREATE TABLE IF NOT EXISTS CalendarKeys (
+                user_id INTEGER PRIMARY KEY REFERENCES Users(id) ON DELETE CASCADE,
+                revision INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+            'bump_calendar_revision': """
+            INSERT INTO CalendarKeys (user_id, revision) VALUES (%s, 1)
+            ON CONFLICT (user_id) DO UPDATE SET revision = CalendarKeys.revision + 1
+            """,
             'get_identity': 'SELECT lastval()',
             'get_current_timestamp': 'CURRENT_TIMESTAMP',
             'get_date_now': 'CURRENT_TIMESTAMP'
@@ -240,6 +996,169 @@ def get_sql_queries():
                 )
             END
             """,
+            'create_archived_users_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ArchivedUsers')
+            BEGIN
+                CREATE TABLE ArchivedUsers (
+                    id INT PRIMARY KEY IDENTITY(1,1),
+                    user_id INT NOT NULL,
+                    name NVARCHAR(100) NOT NULL,
+                    surname NVARCHAR(100) NOT NULL,
+                    email NVARCHAR(120) NOT NULL,
+                    archived_at DATETIME DEFAULT GETDATE()
+                )
+            END
+            """,
+            'create_auth_tokens_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'AuthTokens')
+            BEGIN
+                CREATE TABLE AuthTokens (
+                    id INT PRIMARY KEY IDENTITY(1,1),
+                    user_id INT NOT NULL,
+                    purpose NVARCHAR(20) NOT NULL,
+                    token_hash CHAR(64) NOT NULL UNIQUE,
+                    expires_at DATETIME NOT NULL,
+                    created_at DATETIME DEFAULT GETDATE(),
+                    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+                )
+            END
+            """,
+            'create_auth_tokens_indexes': [
+                """
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AuthTokens_expires_at')
+                    CREATE INDEX IX_AuthTokens_expires_at ON AuthTokens (expires_at)
+                """,
+                """
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_AuthTokens_user_purpose')
+                    CREATE INDEX IX_AuthTokens_user_purpose ON AuthTokens (user_id, purpose)
+                """
+            ],
+            'consume_auth_token': """
+            DELETE FROM AuthTokens
+            OUTPUT DELETED.user_id, DELETED.expires_at
+            WHERE token_hash = ? AND purpose = ?
+            """,
+            'purge_auth_tokens_batch': """
+            DELETE TOP (?) FROM AuthTokens WHERE expires_at < ?
+            """,
+            'create_rate_limits_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'RateLimits')
+            BEGIN
+                CREATE TABLE RateLimits (
+                    bucket_key NVARCHAR(100) PRIMARY KEY,
+                    hits INT NOT NULL DEFAULT 0,
+                    window_end BIGINT NOT NULL
+                )
+            END
+            """,
+            'create_cache_invalidations_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'CacheInvalidations')
+            BEGIN
+                CREATE TABLE CacheInvalidations (
+                    id INT IDENTITY(1,1) PRIMARY KEY,
+                    topic NVARCHAR(50) NOT NULL,
+                    item_key NVARCHAR(100) NULL,
+                    origin NVARCHAR(64) NOT NULL,
+                    created_at DATETIME DEFAULT GETDATE()
+                )
+            END
+            """,
+            'create_class_series_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ClassSeries')
+            BEGIN
+                CREATE TABLE ClassSeries (
+                    id INT PRIMARY KEY IDENTITY(1,1),
+                    name NVARCHAR(100) NOT NULL,
+                    instructor NVARCHAR(100) NOT NULL,
+                    weekdays NVARCHAR(20) NOT NULL,
+                    start_time NVARCHAR(5) NOT NULL,
+                    duration INT NOT NULL DEFAULT 75,
+                    capacity INT NOT NULL,
+                    location NVARCHAR(200) NOT NULL,
+                    starts_on NVARCHAR(10) NOT NULL,
+                    until_on NVARCHAR(10) NULL,
+                    interval_weeks INT NOT NULL DEFAULT 1,
+                    exceptions NVARCHAR(MAX) NOT NULL DEFAULT '',
+                    status NVARCHAR(20) DEFAULT 'active',
+                    materialized_until DATETIME NULL
+                )
+            END
+            """,
+            'create_series_occurrences_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'SeriesOccurrences')
+            BEGIN
+                CREATE TABLE SeriesOccurrences (
+                    series_id INT NOT NULL,
+                    occurs_at DATETIME NOT NULL,
+                    class_id INT NOT NULL,
+                    PRIMARY KEY (series_id, occurs_at),
+                    FOREIGN KEY (series_id) REFERENCES ClassSeries(id),
+                    FOREIGN KEY (class_id) REFERENCES YogaClasses(id) ON DELETE CASCADE
+                )
+            END
+            """,
+            'create_bookings_indexes': [
+                """
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'IX_Bookings_class_status')
+                    CREATE INDEX IX_Bookings_class_status ON Bookings (class_id, status)
+                """
+            ],
+            'create_class_occupancy_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'ClassOccupancy')
+            BEGIN
+                CREATE TABLE ClassOccupancy (
+                    class_id INT PRIMARY KEY,
+                    class_day NVARCHAR(10) NOT NULL,
+                    instructor NVARCHAR(100) NOT NULL,
+                    location NVARCHAR(200) NOT NULL,
+                    capacity INT NOT NULL,
+                    class_status NVARCHAR(20) NOT NULL,
+                    booked INT NOT NULL,
+                    cancelled INT NOT NULL,
+                    refreshed_at DATETIME DEFAULT GETDATE()
+                )
+            END
+            """,
+            'create_daily_occupancy_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'DailyOccupancy')
+            BEGIN
+                CREATE TABLE DailyOccupancy (
+                    day NVARCHAR(10) NOT NULL,
+                    instructor NVARCHAR(100) NOT NULL,
+                    location NVARCHAR(200) NOT NULL,
+                    classes INT NOT NULL,
+                    cancelled_classes INT NOT NULL,
+                    capacity INT NOT NULL,
+                    booked INT NOT NULL,
+                    cancelled INT NOT NULL,
+                    PRIMARY KEY (day, instructor, location)
+                )
+            END
+            """,
+            'create_rollup_watermarks_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'RollupWatermarks')
+            BEGIN
+                CREATE TABLE RollupWatermarks (
+                    name NVARCHAR(50) PRIMARY KEY,
+                    watermark DATETIME NOT NULL
+                )
+            END
+            """,
+            'create_calendar_keys_table': """
+            IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'CalendarKeys')
+            BEGIN
+                CREATE TABLE CalendarKeys (
+                    user_id INT PRIMARY KEY,
+                    revision INT NOT NULL DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+                )
+            END
+            """,
+            'bump_calendar_revision': """
+            UPDATE CalendarKeys SET revision = revision + 1 WHERE user_id = ?;
+            IF @@ROWCOUNT = 0
+                INSERT INTO CalendarKeys (user_id, revision) VALUES (?, 1)
+            """,
             'get_identity': 'SELECT @@IDENTITY',
             'get_current_timestamp': 'GETDATE()',
             'get_date_now': 'GETDATE()'
@@ -295,6 +1214,7 @@ class SQLiteConnectionPool:
     def __init__(self, db_path):
         self.db_path = db_path
         self._lock = threading.Lock()
+        self._open_connections = 0
 
     def get_connection(self):
         """Get a SQLite connection with datetime conversion enabled"""
@@ -305,6 +1225,8 @@ class SQLiteConnectionPool:
         )
         # Enable foreign keys in SQLite
         conn.execute("PRAGMA foreign_keys = ON")
+        with self._lock:
+            self._open_connections += 1
         return conn
 
     def release_connection(self, conn):
@@ -314,17 +1236,28 @@ class SQLiteConnectionPool:
                 conn.close()
             except:
                 pass
+            with self._lock:
+                self._open_connections -= 1
+
+    def report_error(self, conn, error):
+        """Connections are closed on release anyway"""
+        pass
 
     def close_all(self):
         """No-op for SQLite"""
         pass
 
+    def keep_warm(self):
+        """A local file never pauses, nothing to keep warm"""
+        return 0
+
     def get_pool_stats(self):
-        """Return dummy stats for SQLite"""
+        """SQLite opens a connection per use, so only open connections are tracked"""
         return {
-            'pool_size': 1,
-            'created_connections': 1,
-            'max_pool_size': 1,
+            'pool_size': 0,
+            'created_connections': self._open_connections,
+            'in_use': self._open_connections,
+            'max_pool_size': None,
             'is_closed': False
         }
 
@@ -335,8 +1268,9 @@ class PostgreSQLConnectionPool:
         self.conn_string = conn_string
         self.max_pool_size = max_pool_size
         self.min_pool_size = min_pool_size
-        print(f"Initializing PostgreSQL connection pool (max: {max_pool_size}, min: {min_pool_size})...")
-        
+        logger.info(f"Initializing PostgreSQL connection pool (max: {max_pool_size}, min: {min_pool_size})...")
+        from psycopg2 import pool as pg_pool
+
         try:
             # Create connection pool
             self._pool = pg_pool.SimpleConnectionPool(
@@ -344,9 +1278,9 @@ class PostgreSQLConnectionPool:
                 max_pool_size,
                 conn_string
             )
-            print("✅ PostgreSQL connection pool initialized successfully!")
+            logger.info("✅ PostgreSQL connection pool initialized successfully!")
         except Exception as e:
-            print(f"❌ PostgreSQL connection pool initialization failed: {e}")
+            logger.error(f"❌ PostgreSQL connection pool initialization failed: {e}")
             raise
     
     def get_connection(self):
@@ -358,7 +1292,7 @@ class PostgreSQLConnectionPool:
             else:
                 raise Exception("Failed to get connection from pool")
         except Exception as e:
-            print(f"Error getting PostgreSQL connection: {e}")
+            logger.error(f"Error getting PostgreSQL connection: {e}")
             raise
     
     def release_connection(self, conn):
@@ -370,7 +1304,11 @@ class PostgreSQLConnectionPool:
                     conn.rollback()
                 self._pool.putconn(conn)
             except Exception as e:
-                print(f"Error releasing PostgreSQL connection: {e}")
+                logger.error(f"Error releasing PostgreSQL connection: {e}")
+
+    def report_error(self, conn, error):
+        """psycopg2 closes a connection whose link failed, and putconn drops closed connections"""
+        pass
     
     def close_all(self):
         """Close all connections in the pool"""
@@ -378,14 +1316,55 @@ class PostgreSQLConnectionPool:
             self._pool.closeall()
         except:
             pass
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def keep_warm(self):
+        """Check out min_pool_size connections, ping each and replace the broken ones; returns how many are warm"""
+        conns = []
+        try:
+            for _ in range(self.min_pool_size):
+                conns.append(self._pool.getconn())
+        except Exception:
+            # Pool exhausted or the server refused a new connection
+            pass
+        warm = 0
+        for conn in conns:
+            if self._ping(conn):
+                self._pool.putconn(conn)
+                warm += 1
+                continue
+            self._pool.putconn(conn, close=True)
+            try:
+                fresh = self._pool.getconn()
+                if self._ping(fresh):
+                    warm += 1
+                    self._pool.putconn(fresh)
+                else:
+                    self._pool.putconn(fresh, close=True)
+            except Exception as e:
+                logger.warning(f"Could not replace a broken PostgreSQL connection: {str(e)[:80]}")
+        return warm
     
     def get_pool_stats(self):
         """Get pool statistics"""
+        # SimpleConnectionPool keeps idle connections in _pool and borrowed ones in _used
+        idle = len(getattr(self._pool, '_pool', []))
+        in_use = len(getattr(self._pool, '_used', {}))
         return {
-            'pool_size': self.max_pool_size,
-            'created_connections': self.max_pool_size,
+            'pool_size': idle,
+            'created_connections': idle + in_use,
+            'in_use': in_use,
             'max_pool_size': self.max_pool_size,
-            'is_closed': False
+            'is_closed': bool(getattr(self._pool, 'closed', False))
         }
 
 class SQLServerConnectionPool:
@@ -393,65 +1372,91 @@ class SQLServerConnectionPool:
     Simplified and optimized SQL Server connection pool.
     Think of this as a smart restaurant manager who keeps tables ready
     and serves customers efficiently without overwhelming the kitchen.
+
+    Idle connections are queued with the time they were last known good. Checkout only probes
+    one that has sat idle longer than validate_after; while the pool is in use, a background
+    validator re-checks idle connections, retires those older than max_lifetime and tops the
+    pool back up to min_pool_size, so a busy request path costs no extra round-trips.
+    Once nothing has been checked out for idle_window the validator only retires old
+    connections, so it never keeps a serverless database awake; PoolKeepalive does that on purpose.
     """
 
-    def __init__(self, conn_string, max_pool_size=5, min_pool_size=2):
+    # SQLSTATE classes pyodbc reports when the link to the server is gone
+    DISCONNECT_STATES = ('08', 'HYT')
+
+    def __init__(self, conn_string, max_pool_size=5, min_pool_size=2, validate_after=30, max_lifetime=1800,
+                 idle_window=1800):
         self.conn_string = conn_string
         self.max_pool_size = max_pool_size
         self.min_pool_size = min_pool_size
+        self.validate_after = validate_after
+        self.max_lifetime = max_lifetime
+        self.idle_window = idle_window
+        self.last_checkout = time.monotonic()
         self._pool = queue.Queue(maxsize=max_pool_size)
         self._lock = threading.Lock()
         self._created_connections = 0
+        self._opened_at = {}
+        self._broken = set()
         self._closed = False
-        print(f"Initializing connection pool (max: {max_pool_size}, min: {min_pool_size})...")
+        self._stop_event = threading.Event()
+        self.validations = 0
+        self.recycled = 0
+        logger.info(f"Initializing connection pool (max: {max_pool_size}, min: {min_pool_size})...")
         self._fast_warmup()
+        if validate_after > 0:
+            threading.Thread(target=self._run_validator, name='sqlserver-pool-validator', daemon=True).start()
 
     def _fast_warmup(self):
         # Create exactly the minimum number of connections we specified
         target_connections = self.min_pool_size
-        successful = 0
 
         for i in range(target_connections):
             try:
-                print(f"Creating initial connection {i+1}/{target_connections}...")
+                logger.info(f"Creating initial connection {i+1}/{target_connections}...")
                 start_time = time.time()
 
                 # Create connection with optimized timeout
-                conn = pyodbc.connect(self.conn_string, autocommit=False, timeout=30)
+                conn = self._create_new_connection(timeout=30)
 
                 conn_time = time.time() - start_time
-                print(f"Connection {i+1} ready in {conn_time:.1f}s")
+                logger.info(f"Connection {i+1} ready in {conn_time:.1f}s")
 
-                self._pool.put(conn)
-                with self._lock:
-                    self._created_connections += 1
-                successful += 1
+                self._pool.put((conn, time.monotonic()))
 
             except Exception as e:
-                print(f"Initial connection {i+1} failed: {str(e)[:80]}...")
+                logger.warning(f"Initial connection {i+1} failed: {str(e)[:80]}...")
                 # For warmup, we continue but don't fail completely
                 continue
 
+    def _expired(self, conn, now):
+        opened = self._opened_at.get(id(conn))
+        return self.max_lifetime > 0 and opened is not None and now - opened > self.max_lifetime
+
     def get_connection(self):
         """Get a connection from the pool or create a new one"""
         if self._closed:
             raise Exception("Connection pool is closed")
+        self.last_checkout = time.monotonic()
 
         # Try to get from pool first (fast path)
-        try:
-            conn = self._pool.get_nowait()
-            if self._is_connection_valid(conn):
-                return conn
-            else:
-                # Connection is stale, create a new one
-                with self._lock:
-                    self._created_connections -= 1
+        while True:
+            try:
+                conn, checked_at = self._pool.get_nowait()
+            except queue.Empty:
+                # No connections available, create a new one
                 return self._create_new_connection()
-        except queue.Empty:
-            # No connections available, create a new one
-            return self._create_new_connection()
+            now = time.monotonic()
+            if self._expired(conn, now):
+                self.recycled += 1
+                self._discard(conn)
+                continue
+            # Recently used connections are trusted; only long-idle ones pay for a probe
+            if now - checked_at <= self.validate_after or self._is_connection_valid(conn):
+                return conn
+            self._discard(conn)
 
-    def _create_new_connection(self):
+    def _create_new_connection(self, timeout=60):
         """Create a new database connection with optimized settings"""
         with self._lock:
             if self._created_connections >= self.max_pool_size:
@@ -460,15 +1465,30 @@ class SQLServerConnectionPool:
 
         try:
             # Single attempt connection with proper timeout
-            conn = pyodbc.connect(self.conn_string, autocommit=False, timeout=60)
-            return conn
+            import pyodbc
+            conn = pyodbc.connect(self.conn_string, autocommit=False, timeout=timeout)
         except Exception as e:
             with self._lock:
                 self._created_connections -= 1
             raise e
+        with self._lock:
+            self._opened_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection and stop counting it"""
+        try:
+            conn.close()
+        except:
+            pass
+        with self._lock:
+            self._opened_at.pop(id(conn), None)
+            self._broken.discard(id(conn))
+            self._created_connections -= 1
 
     def _is_connection_valid(self, conn):
         """Quick connection validation"""
+        self.validations += 1
         try:
             # Simple, fast validation query
             cursor = conn.cursor()
@@ -479,82 +1499,403 @@ class SQLServerConnectionPool:
         except:
             return False
 
+    def report_error(self, conn, error):
+        """A query failed on this connection: evict it on release if the failure was the link itself"""
+        state = error.args[0] if getattr(error, 'args', None) else ''
+        if isinstance(state, str) and state.startswith(self.DISCONNECT_STATES):
+            with self._lock:
+                self._broken.add(id(conn))
+
     def release_connection(self, conn):
         """Return a connection to the pool"""
-        if self._closed or not conn:
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
+        if not conn:
+            return
+        if self._closed or id(conn) in self._broken or self._expired(conn, time.monotonic()):
+            self._discard(conn)
             return
 
         try:
             # Always rollback to clean state
             conn.rollback()
         except:
-            pass
+            # The server can't even end a transaction, so the link is gone
+            self._discard(conn)
+            return
 
-        if self._is_connection_valid(conn):
-            try:
-                self._pool.put_nowait(conn)
-            except queue.Full:
-                # Pool is full, close this connection
-                try:
-                    conn.close()
-                    with self._lock:
-                        self._created_connections -= 1
-                except:
-                    pass
-        else:
-            # Connection is invalid, close it
+        try:
+            self._pool.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            # Pool is full, close this connection
+            self._discard(conn)
+
+    def _sweep(self, validate_all=False):
+        """
+        Check every idle connection once: retire expired ones, probe those idle past validate_after
+        (or all of them), then open new ones up to min_pool_size. Returns how many idle connections are good.
+        Without validate_all, a pool with no checkout in idle_window is only pruned.
+        Only one connection is out of the queue at a time, so checkouts keep finding the others.
+        """
+        in_use = validate_all or time.monotonic() - self.last_checkout <= self.idle_window
+        good = 0
+        for _ in range(self._pool.qsize()):
             try:
-                conn.close()
-                with self._lock:
-                    self._created_connections -= 1
-            except:
-                pass
+                conn, checked_at = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            now = time.monotonic()
+            if self._expired(conn, now):
+                self.recycled += 1
+                self._discard(conn)
+                continue
+            if in_use and (validate_all or now - checked_at > self.validate_after):
+                if not self._is_connection_valid(conn):
+                    self._discard(conn)
+                    continue
+                checked_at = time.monotonic()
+            try:
+                self._pool.put_nowait((conn, checked_at))
+                good += 1
+            except queue.Full:
+                self._discard(conn)
+
+        while in_use and self._pool.qsize() < self.min_pool_size and not self._closed:
+            if self._created_connections >= self.max_pool_size:
+                # Everything is borrowed; releases refill the queue
+                break
+            try:
+                conn = self._create_new_connection()
+            except Exception as e:
+                logger.warning(f"Pool validator could not open a connection: {str(e)[:80]}")
+                break
+            try:
+                self._pool.put_nowait((conn, time.monotonic()))
+                good += 1
+            except queue.Full:
+                self._discard(conn)
+                break
+        return good
+
+    def _run_validator(self):
+        while not self._stop_event.wait(self.validate_after):
+            if self._closed:
+                return
+            try:
+                self._sweep()
+            except Exception as e:
+                logger.warning(f"Pool validation sweep failed: {str(e)[:80]}")
+
+    def keep_warm(self):
+        """Probe every idle connection and open new ones up to min_pool_size; returns how many are warm"""
+        if self._closed:
+            return 0
+        return self._sweep(validate_all=True)
 
     def close_all(self):
         """Close all connections in the pool"""
         self._closed = True
+        self._stop_event.set()
         while not self._pool.empty():
             try:
-                conn = self._pool.get_nowait()
+                conn, _ = self._pool.get_nowait()
                 conn.close()
             except:
                 pass
         with self._lock:
             self._created_connections = 0
+            self._opened_at.clear()
+            self._broken.clear()
 
     def get_pool_stats(self):
         """Get pool statistics"""
         return {
             'pool_size': self._pool.qsize(),
             'created_connections': self._created_connections,
+            'in_use': max(0, self._created_connections - self._pool.qsize()),
             'max_pool_size': self.max_pool_size,
-            'is_closed': self._closed
+            'is_closed': self._closed,
+            'validations': self.validations,
+            'recycled': self.recycled
         }
 
-# Initialize the appropriate connection pool based on database type
-if DB_CONFIG['type'] == 'sqlite':
-    connection_pool = SQLiteConnectionPool(DB_CONFIG['conn_string'])
-elif DB_CONFIG['type'] == 'postgresql':
-    pool_size = int(os.getenv('DB_POOL_SIZE', '10'))
-    min_pool_size = max(2, pool_size // 5)
-    connection_pool = PostgreSQLConnectionPool(
-        DB_CONFIG['conn_string'],
-        max_pool_size=pool_size,
-        min_pool_size=min_pool_size
-    )
-else:
-    pool_size = int(os.getenv('DB_POOL_SIZE', '5'))
-    min_pool_size = max(2, pool_size // 2)
-    connection_pool = SQLServerConnectionPool(
-        DB_CONFIG['conn_string'],
-        max_pool_size=pool_size,
-        min_pool_size=min_pool_size
-    )
+def create_connection_pool():
+    """Build the appropriate connection pool based on database type"""
+    logger.info(f"Using {DB_CONFIG['type']} database: {DB_CONFIG.get('database', DB_CONFIG.get('server'))}")
+    if DB_CONFIG['type'] == 'sqlite':
+        return SQLiteConnectionPool(DB_CONFIG['conn_string'])
+    elif DB_CONFIG['type'] == 'postgresql':
+        pool_size = int(os.getenv('DB_POOL_SIZE', '10'))
+        min_pool_size = max(2, pool_size // 5)
+        return PostgreSQLConnectionPool(
+            DB_CONFIG['conn_string'],
+            max_pool_size=pool_size,
+            min_pool_size=min_pool_size
+        )
+    else:
+        pool_size = int(os.getenv('DB_POOL_SIZE', '5'))
+        min_pool_size = max(2, pool_size // 2)
+        return SQLServerConnectionPool(
+            DB_CONFIG['conn_string'],
+            max_pool_size=pool_size,
+            min_pool_size=min_pool_size,
+            validate_after=app.config['DB_CONN_VALIDATE_AFTER'],
+            max_lifetime=app.config['DB_CONN_MAX_LIFETIME'],
+            # Same scale as PoolKeepalive's interval: past it, keeping the database warm is the keepalive's call
+            idle_window=(app.config['DB_AUTO_PAUSE_SECONDS'] or DEFAULT_AUTO_PAUSE_SECONDS['sqlserver']) / 2
+        )
+
+class LazyConnectionPool:
+    """
+    Stands in for the backend pool and builds it on the first connection request,
+    so importing the app (or booting a worker) never waits on the database.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._pool = None
+        self._pid = os.getpid()
+        self._inherited = []
+        self._lock = threading.Lock()
+        self._borrowed = 0
+        self._returned = threading.Condition()
+        self._failed = set()
+        # Monotonic times: any checkout, the last one that ended cleanly, the last one that didn't
+        self.last_used = time.monotonic()
+        self.last_success = None
+        self.last_failure = None
+        if hasattr(os, 'register_at_fork'):
+            # Another thread may have held the locks at fork time
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+        self._returned = threading.Condition()
+        self._borrowed = 0
+        self._failed = set()
+
+    def _discard_inherited(self):
+        """
+        Forget a pool built by the parent process (gunicorn --preload, os.fork).
+        Its sockets are shared with the parent, so they're never closed here - the pool is
+        kept referenced so garbage collection doesn't close them either.
+        """
+        if self._pool is not None:
+            self._inherited.append(self._pool)
+            logger.info(f"Discarding connection pool inherited from process {self._pid}")
+        self._pool = None
+        self._pid = os.getpid()
+
+    def _get_pool(self):
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._discard_inherited()
+                if self._pool is None:
+                    self._pool = self._factory()
+        return self._pool
+
+    @property
+    def initialized(self):
+        return self._pool is not None and self._pid == os.getpid()
+
+    def get_connection(self):
+        conn = self._get_pool().get_connection()
+        with self._returned:
+            self._borrowed += 1
+        self.last_used = time.monotonic()
+        return conn
+
+    def release_connection(self, conn):
+        self._get_pool().release_connection(conn)
+        with self._returned:
+            self._borrowed -= 1
+            self._returned.notify_all()
+        now = time.monotonic()
+        self.last_used = now
+        if id(conn) in self._failed:
+            self._failed.discard(id(conn))
+            self.last_failure = now
+        else:
+            self.last_success = now
+
+    @property
+    def borrowed(self):
+        return self._borrowed
+
+    def report_error(self, conn, error):
+        self._failed.add(id(conn))
+        self._get_pool().report_error(conn, error)
+
+    @contextlib.contextmanager
+    def _background_use(self):
+        """Borrow the pool for a background check without counting it as activity (last_used)"""
+        pool = self._get_pool()
+        # Counted as borrowed so a shutdown waits for an in-progress check
+        with self._returned:
+            self._borrowed += 1
+        try:
+            yield pool
+        except Exception:
+            self.last_failure = time.monotonic()
+            raise
+        finally:
+            with self._returned:
+                self._borrowed -= 1
+                self._returned.notify_all()
+
+    def keep_warm(self):
+        """Validate the backend's minimum set of connections, building the pool if needed"""
+        with self._background_use() as pool:
+            warm = pool.keep_warm()
+            if warm:
+                self.last_success = time.monotonic()
+            return warm
+
+    def check(self):
+        """
+        One SELECT 1 round-trip for the health probe.
+        Unlike a request it leaves last_used alone, so it never hides idle time from the keepalive.
+        """
+        with self._background_use() as pool:
+            conn = pool.get_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+                cursor.close()
+                conn.rollback()
+            except Exception as e:
+                pool.report_error(conn, e)
+                raise
+            finally:
+                pool.release_connection(conn)
+            self.last_success = time.monotonic()
+
+    def wait_until_idle(self, timeout):
+        """Wait for every borrowed connection to come back; False if some are still out at the deadline"""
+        with self._returned:
+            return self._returned.wait_for(lambda: self._borrowed <= 0, timeout)
+
+    def close_all(self):
+        if self.initialized:
+            self._pool.close_all()
+
+    def reset(self):
+        """Close this process's pool and build a fresh one on next use"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._discard_inherited()
+            elif self._pool is not None:
+                self._pool.close_all()
+                self._pool = None
+
+    def get_pool_stats(self):
+        """Stats of this process's pool; zeros until it has requested a connection"""
+        if not self.initialized:
+            return {
+                'pool_size': 0,
+                'created_connections': 0,
+                'in_use': 0,
+                'max_pool_size': None,
+                'is_closed': False,
+                'initialized': False,
+                'borrowed': 0
+            }
+        return dict(self._pool.get_pool_stats(), initialized=True, borrowed=self._borrowed)
+
+connection_pool = LazyConnectionPool(create_connection_pool)
+
+# Idle windows after which common backends pause or suspend a database
+DEFAULT_AUTO_PAUSE_SECONDS = {
+    'sqlserver': 3600,   # Azure SQL serverless: shortest auto-pause delay is one hour
+    'postgresql': 300,   # Serverless Postgres providers suspend compute after ~5 idle minutes
+    'sqlite': 0
+}
+
+class PoolKeepalive:
+    """
+    Keeps the database and the pool's minimum connections warm while the app gets no traffic.
+    Pings only once the pool has been idle for the current interval, so real requests keep it warm for free.
+    The interval starts at half the backend's auto-pause window; a slow ping means the database
+    had already gone cold, so the interval halves, and fast pings let it grow back.
+    This is the only background task that keeps the database warm: the health probe's checks
+    don't count as pool activity, so they neither delay these pings nor stand in for them.
+    """
+
+    MIN_INTERVAL = 30
+    COLD_LATENCY = 2.0  # Seconds; a ping slower than this found a paused database or dead connections
+
+    def __init__(self, pool, pause_window):
+        self.pool = pool
+        self.max_interval = max(self.MIN_INTERVAL, pause_window / 2)
+        self.interval = self.max_interval
+        self.enabled = pause_window > 0
+        self.last_ping = None
+        self.last_latency = None
+        self.last_warm = None
+        self.pings = 0
+        self.cold_pings = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def idle_for(self):
+        last_activity = self.pool.last_used
+        if self.last_ping is not None:
+            last_activity = max(last_activity, self.last_ping)
+        return time.monotonic() - last_activity
+
+    def ping(self):
+        """Validate the pool's minimum connections now and adapt the interval to how long that took"""
+        started = time.monotonic()
+        try:
+            self.last_warm = self.pool.keep_warm()
+        except Exception as e:
+            self.last_warm = 0
+            logger.warning(f"Database keepalive failed: {str(e)[:80]}")
+        self.last_latency = time.monotonic() - started
+        self.last_ping = time.monotonic()
+        self.pings += 1
+        if self.last_latency > self.COLD_LATENCY or not self.last_warm:
+            self.cold_pings += 1
+            self.interval = max(self.MIN_INTERVAL, self.interval / 2)
+            logger.info(f"Database keepalive found a cold database ({self.last_latency:.1f}s), "
+                        f"next check in {self.interval:.0f}s")
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        return self.last_warm
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._stop_event.clear()
+
+        def run():
+            # Warm up before the first real request needs a connection
+            self.ping()
+            while not self._stop_event.wait(max(1, self.interval - self.idle_for())):
+                if self.pool.borrowed == 0 and self.idle_for() >= self.interval:
+                    self.ping()
+
+        self._thread = threading.Thread(target=run, name='db-keepalive', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_stats(self):
+        return {
+            'enabled': self.enabled,
+            'interval': round(self.interval, 1),
+            'pings': self.pings,
+            'cold_pings': self.cold_pings,
+            'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            'warm_connections': self.last_warm
+        }
+
+pool_keepalive = PoolKeepalive(
+    connection_pool,
+    (app.config['DB_AUTO_PAUSE_SECONDS'] or DEFAULT_AUTO_PAUSE_SECONDS.get(DB_CONFIG['type'], 0))
+    if app.config['DB_KEEPALIVE'] else 0
+)
 
 @contextlib.contextmanager
 def db_connection():
@@ -563,14 +1904,17 @@ def db_connection():
         start_time = time.time()
         conn = connection_pool.get_connection()
         conn_time = time.time() - start_time
+        record_stage('pool_wait', conn_time)
+        query_profiler.record_connection()
 
         if conn_time > 5:  # Only log if connection takes more than 5 seconds
-            print(f"Slow connection: {conn_time:.1f}s")
+            logger.warning(f"Slow connection: {conn_time:.1f}s")
 
         yield conn
 
     except Exception as e:
         if conn:
+            connection_pool.report_error(conn, e)
             try:
                 conn.rollback()
             except:
@@ -592,13 +1936,13 @@ def db_connection_with_retry(max_retries=2, initial_delay=3):
             with db_connection() as conn:
                 conn_time = time.time() - start_time
                 if conn_time > 2:  # Log slow connections
-                    print(f"Slow connection: {conn_time:.1f}s")
+                    logger.warning(f"Slow connection: {conn_time:.1f}s")
                 yield conn
                 return
 
         except Exception as e:
             conn_time = time.time() - start_time
-            print(f"Connection failed after {conn_time:.1f}s: {str(e)[:50]}...")
+            logger.warning(f"Connection failed after {conn_time:.1f}s: {str(e)[:50]}...")
 
             # For SQLite and PostgreSQL, don't retry on errors (they handle connections differently)
             if DB_CONFIG['type'] in ['sqlite', 'postgresql']:
@@ -611,7 +1955,7 @@ def db_connection_with_retry(max_retries=2, initial_delay=3):
                 retries += 1
                 if retries < max_retries:
                     delay = initial_delay * retries  # 3s, 6s (faster than before)
-                    print(f"Retrying in {delay}s...")
+                    logger.info(f"Retrying in {delay}s...")
                     time.sleep(delay)
                     continue
 
@@ -633,7 +1977,7 @@ def db_connection_with_resume_retry(max_retries=3, resume_delay=10):
             with db_connection() as conn:
                 conn_time = time.time() - start_time
                 if conn_time > 2:
-                    print(f"Database connection took {conn_time:.1f}s (resume scenario)")
+                    logger.warning(f"Database connection took {conn_time:.1f}s (resume scenario)")
                 yield conn
                 return
 
@@ -648,14 +1992,14 @@ def db_connection_with_resume_retry(max_retries=3, resume_delay=10):
                 '40613',  # Specific Azure error code for database unavailable
                 'server is not currently available'
             ]):
-                print(f"Database appears to be resuming from auto-pause (attempt {retries + 1})")
+                logger.warning(f"Database appears to be resuming from auto-pause (attempt {retries + 1})")
                 last_exception = e
                 retries += 1
 
                 if retries < max_retries:
                     # Use longer delay for database resume scenarios
                     delay = resume_delay * retries  # 10s, 20s, 30s
-                    print(f"Waiting {delay}s for database to resume...")
+                    logger.info(f"Waiting {delay}s for database to resume...")
                     time.sleep(delay)
                     continue
 
@@ -669,7 +2013,7 @@ def db_connection_with_resume_retry(max_retries=3, resume_delay=10):
                 retries += 1
                 if retries < max_retries:
                     delay = 3 * retries  # Faster retry for regular timeouts
-                    print(f"Connection timeout, retrying in {delay}s...")
+                    logger.info(f"Connection timeout, retrying in {delay}s...")
                     time.sleep(delay)
                     continue
 
@@ -677,13 +2021,58 @@ def db_connection_with_resume_retry(max_retries=3, resume_delay=10):
 
     raise last_exception or Exception("Database connection failed after retries")
 
+class InstrumentedCursor:
+    """Thin cursor wrapper that records time spent executing statements and fetching rows"""
+
+    __slots__ = ('_cursor',)
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            record_stage('query', time.perf_counter() - start)
+
+    def _timed_statement(self, method, sql, *args):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            duration = time.perf_counter() - start
+            record_stage('query', duration)
+            query_profiler.record_query(sql, duration)
+
+    def execute(self, sql, *args):
+        return self._timed_statement(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed_statement(self._cursor.executemany, sql, *args)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
 @contextlib.contextmanager
 def db_cursor(connection):
     """Context manager for database cursors"""
     cursor = None
     try:
         cursor = connection.cursor()
-        yield cursor
+        yield InstrumentedCursor(cursor)
     finally:
         if cursor:
             try:
@@ -691,12 +2080,60 @@ def db_cursor(connection):
             except:
                 pass
 
+def hash_auth_token(token):
+    """Tokens are stored as SHA-256 digests so a database leak doesn't expose usable links"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def migrate_legacy_tokens(conn):
+    """
+    Move pending tokens from the old Users.verification_token column into AuthTokens.
+    Verified users can only have a password reset pending, everyone else a verification.
+    Unverified users whose old link already expired (or who never had one on file) get an
+    expired placeholder row, so the unverified-account grace period starts now rather than
+    the sweep deleting them on its first run.
+    """
+    with db_cursor(conn) as cursor:
+        is_verified_value = False if DB_CONFIG['type'] == 'postgresql' else 0
+        cursor.execute(convert_query("""
+        SELECT id, is_verified, verification_token, token_expiry
+        FROM Users
+        WHERE verification_token IS NOT NULL
+        UNION ALL
+        SELECT U.id, U.is_verified, NULL, NULL
+        FROM Users U
+        WHERE U.is_verified = ? AND U.verification_token IS NULL
+            AND NOT EXISTS (SELECT 1 FROM AuthTokens T WHERE T.user_id = U.id AND T.purpose = ?)
+        """), (is_verified_value, AuthToken.PURPOSE_VERIFY))
+        rows = cursor.fetchall()
+        if not rows:
+            return 0
+
+        now = datetime.utcnow()
+        migrated = 0
+        for user_id, is_verified, token, expiry in rows:
+            if not expiry or expiry < now:
+                if is_verified:
+                    continue
+                # Never usable (not a signed token), only marks when the grace period began
+                token, expiry = token or secrets.token_urlsafe(32), now
+            purpose = 'password_reset' if is_verified else 'verify'
+            cursor.execute(convert_query("""
+            INSERT INTO AuthTokens (user_id, purpose, token_hash, expires_at)
+            VALUES (?, ?, ?, ?)
+            """), (user_id, purpose, hash_auth_token(token), expiry))
+            migrated += 1
+
+        cursor.execute("UPDATE Users SET verification_token = NULL, token_expiry = NULL WHERE verification_token IS NOT NULL")
+        conn.commit()
+        logger.info(f"Migrated {migrated} pending tokens to AuthTokens")
+        return migrated
+
 def init_db():
     """
     Optimized database initialization with connection validation.
     """
     try:
-        print("Initializing database tables...")
+        logger.info("Initializing database tables...")
         init_start = time.time()
 
         with db_connection_with_resume_retry() as conn:
@@ -706,195 +2143,1077 @@ def init_db():
                     cursor.execute(SQL_QUERIES['create_users_table'])
                     cursor.execute(SQL_QUERIES['create_yoga_classes_table'])
                     cursor.execute(SQL_QUERIES['create_bookings_table'])
+                    cursor.execute(SQL_QUERIES['create_auth_tokens_table'])
+                    for index_query in SQL_QUERIES['create_auth_tokens_indexes']:
+                        cursor.execute(index_query)
+                    cursor.execute(SQL_QUERIES['create_rate_limits_table'])
+                    cursor.execute(SQL_QUERIES['create_cache_invalidations_table'])
+                    cursor.execute(SQL_QUERIES['create_archived_users_table'])
+                    cursor.execute(SQL_QUERIES['create_class_series_table'])
+                    cursor.execute(SQL_QUERIES['create_series_occurrences_table'])
+                    for index_query in SQL_QUERIES['create_bookings_indexes']:
+                        cursor.execute(index_query)
+                    cursor.execute(SQL_QUERIES['create_class_occupancy_table'])
+                    cursor.execute(SQL_QUERIES['create_daily_occupancy_table'])
+                    cursor.execute(SQL_QUERIES['create_rollup_watermarks_table'])
+                    cursor.execute(SQL_QUERIES['create_calendar_keys_table'])
                     conn.commit()
 
+                    migrate_legacy_tokens(conn)
+
                     init_time = time.time() - init_start
-                    print(f"Database initialized successfully in {init_time:.1f}s")
+                    logger.info(f"Database initialized successfully in {init_time:.1f}s")
+                    return True
 
                 except Exception as table_error:
-                    print(f"Table creation error: {table_error}")
+                    logger.error(f"Table creation error: {table_error}")
                     conn.rollback()
                     raise
 
     except Exception as e:
-        print(f"Database initialization failed: {str(e)}")
-        print("Application will continue but database operations may fail")
-
+        logger.error(f"Database initialization failed: {str(e)}")
+        logger.warning("Application will continue but database operations may fail")
+        return False
 
-# Initialize database on startup
-with app.app_context():
-    init_db()
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the schema (run once per deploy, before starting workers)"""
+    if not init_db():
+        sys.exit(1)
 
-# Flask-Login setup
-login_manager = LoginManager()
-login_manager.init_app(app)
+# --------------------------------------
+# Response compression and payload caching
+# --------------------------------------
 
-# User model for Flask-Login (keeping your existing User class with minor SQL adaptations)
-class User(UserMixin):
-    def __init__(self, id=None, name=None, surname=None, email=None, password_hash=None,
-                 is_verified=False, verification_token=None, token_expiry=None):
-        self.id = id
-        self.name = name
-        self.surname = surname
-        self.email = email
-        self.password_hash = password_hash
-        self.is_verified = is_verified
-        self.verification_token = verification_token
-        self.token_expiry = token_expiry
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+}
+
+def supported_encodings():
+    """Content encodings this server can produce, most preferred first"""
+    return ['br', 'gzip'] if BROTLI_AVAILABLE else ['gzip']
+
+def negotiate_encoding():
+    """Pick the best content encoding the client accepts, or None for identity"""
+    return request.accept_encodings.best_match(supported_encodings())
+
+def compress_bytes(data, encoding):
+    """Compress a payload with the configured compression level"""
+    level = app.config['COMPRESS_LEVEL']
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(11, max(0, round(level * 11 / 9))))
+    return gzip.compress(data, compresslevel=min(9, max(1, level)), mtime=0)
+
+class CachedPayload:
+    """
+    A response body that is reused across requests.
+    Compressed variants are built once on first demand and kept alongside the raw bytes.
+    """
 
-    def check_password(self, password):
-        """Check if the password matches the hash"""
-        return check_password_hash(self.password_hash, password)
+    def __init__(self, data, mimetype):
+        self.data = data
+        self.mimetype = mimetype
+        self._variants = {}
+
+    def variant(self, encoding):
+        """Get the body for an encoding, compressing it only the first time"""
+        if encoding is None or len(self.data) < app.config['COMPRESS_MIN_SIZE']:
+            return self.data, None
+        body = self._variants.get(encoding)
+        if body is None:
+            body = compress_bytes(self.data, encoding)
+            self._variants[encoding] = body
+        return body, encoding
+
+    def to_response(self):
+        """Build a response for the current request using the negotiated encoding"""
+        body, encoding = self.variant(negotiate_encoding())
+        response = Response(body, mimetype=self.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls within this process.
+    The first caller for a key runs the function; callers arriving while it runs wait and share its result or error.
+    """
 
-    def update_verification_status(self):
-        """Update the user's verification status"""
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                # Use TRUE for PostgreSQL, 1 for others
-                is_verified_value = True if DB_CONFIG['type'] == 'postgresql' else 1
-                cursor.execute(convert_query("""
-                UPDATE Users 
-                SET is_verified = ?, verification_token = NULL, token_expiry = NULL 
-                WHERE id = ?
-                """), (is_verified_value, self.id))
-                conn.commit()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
 
-        self.is_verified = True
-        self.verification_token = None
-        self.token_expiry = None
-        return True
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            metrics.inc('singleflight_shared_total', key=str(key[0] if isinstance(key, tuple) else key))
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
 
-    def update_verification_token(self):
-        """Generate a new verification token"""
-        token = secrets.token_urlsafe(32)
-        expiry = datetime.utcnow() + timedelta(hours=app.config['VERIFICATION_TOKEN_EXPIRY'])
+    def in_flight(self, key):
+        return key in self._flights
 
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                UPDATE Users 
-                SET verification_token = ?, token_expiry = ? 
-                WHERE id = ?
-                """), (token, expiry, self.id))
-                conn.commit()
+single_flight = SingleFlight()
+metrics.counter('singleflight_shared_total', 'Reads that waited on an identical in-flight call instead of querying')
 
-        self.verification_token = token
-        self.token_expiry = expiry
-        return token
+class CatalogCache:
+    """
+    Short-lived cache of the serialized GET /classes payload.
+    After the TTL the old payload is still served for up to stale_ttl seconds while one background thread rebuilds it.
+    An invalidation drops it outright: the data is known to have changed, so callers wait on a single shared rebuild.
+    """
 
-    @classmethod
-    def create_user(cls, name, surname, email, password):
-        """Create a new user with verification token"""
-        # queries = get_sql_queries()
+    def __init__(self, ttl, stale_ttl=0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.generation = 0
+        self._payload = None
+        self._expires_at = 0
+        self._stale_until = 0
+        self._lock = threading.Lock()
 
-        # Generate password hash
-        password_hash = generate_password_hash(password, method='pbkdf2:sha256')
+    def get(self):
+        """Return (payload, state) where state is 'fresh', 'stale' or 'miss'"""
+        payload = self._payload
+        if payload is None:
+            return None, 'miss'
+        now = time.monotonic()
+        if now < self._expires_at:
+            return payload, 'fresh'
+        if now < self._stale_until:
+            return payload, 'stale'
+        return None, 'miss'
+
+    def set(self, payload, generation=None):
+        """Store a payload unless it was built from data that has since been invalidated"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            now = time.monotonic()
+            self._payload = payload
+            self._expires_at = now + self.ttl
+            self._stale_until = self._expires_at + self.stale_ttl
+            return True
 
-        # Generate verification token
-        verification_token = secrets.token_urlsafe(32)
-        token_expiry = datetime.utcnow() + timedelta(hours=app.config['VERIFICATION_TOKEN_EXPIRY'])
+    def invalidate(self):
+        """Drop the cached catalog after a booking or class change"""
+        with self._lock:
+            self.generation += 1
+            self._payload = None
+            self._expires_at = 0
+            self._stale_until = 0
 
-        # Check email format
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
-            raise ValueError("Invalid email format")
+    def load(self, build):
+        """Build and store the payload, sharing one build between concurrent callers of the same generation"""
+        generation = self.generation
 
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                # Insert user into database
-                # Use FALSE for is_verified (works in PostgreSQL and SQL Server)
-                is_verified_value = False if DB_CONFIG['type'] == 'postgresql' else 0
-                cursor.execute(convert_query("""
-                INSERT INTO Users (name, surname, email, password_hash, is_verified, verification_token, token_expiry)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """), (name, surname, email, password_hash, is_verified_value, verification_token, token_expiry))
+        def run():
+            payload = build()
+            self.set(payload, generation)
+            return payload
 
-                cursor.execute(SQL_QUERIES['get_identity'])
-                user_id = cursor.fetchone()[0]
-                conn.commit()
+        return single_flight.do(('catalog', generation), run)
 
-        # Return user object
-        return cls(
-            id=user_id,
-            name=name,
-            surname=surname,
-            email=email,
-            password_hash=password_hash,
-            is_verified=False,
-            verification_token=verification_token,
-            token_expiry=token_expiry
-        )
+    def refresh_async(self, build):
+        """Rebuild in a background thread unless a rebuild is already running"""
+        if single_flight.in_flight(('catalog', self.generation)):
+            return
+        threading.Thread(target=self._refresh, args=(build,), daemon=True, name='catalog-refresh').start()
 
-    @classmethod
-    def get_user_by_token(cls, token):
-        """Get a user by verification token"""
+    def _refresh(self, build):
         try:
-            with db_connection_with_retry() as conn:
-                with db_cursor(conn) as cursor:
-                    cursor.execute(convert_query("""
-                        SELECT id, name, surname, email, password_hash, is_verified, verification_token, token_expiry
-                        FROM Users 
-                        WHERE verification_token = ?
-                        """), (token,))
-                    row = cursor.fetchone()
-
-                    if not row:
-                        return None
-
-                    return cls(
-                        id=row[0],
-                        name=row[1],
-                        surname=row[2],
-                        email=row[3],
-                        password_hash=row[4],
-                        is_verified=bool(row[5]),
-                        verification_token=row[6],
-                        token_expiry=row[7]  # Already converted to datetime
-                    )
+            with app.app_context():
+                self.load(build)
         except Exception as e:
-            print(f"Error in get_user_by_token: {str(e)}")
-        return None
+            logger.warning("Catalog refresh failed: %s", e)
+
+catalog_cache = CatalogCache(app.config['CATALOG_CACHE_TTL'], app.config['CATALOG_STALE_TTL'])
+
+# Static files keyed by path: (mtime, CachedPayload)
+static_asset_cache = {}
+
+@app.after_request
+def compress_response(response):
+    """Compress large text responses when the client supports it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300 or response.status_code == 204
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    encoding = negotiate_encoding()
+    if encoding:
+        response.set_data(compress_bytes(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+class UserCache:
+    """
+    Per-process cache of users loaded for authenticated requests, so Flask-Login doesn't
+    read the Users row on every request. Entries are copied in and out, never shared.
+    """
 
-    @classmethod
-    def get_user_by_email(cls, email):
-        """
-        Enhanced user lookup with database resume handling.
-        Like a smart librarian who waits patiently when the library is reopening.
-        """
-        try:
-            print(f"Looking up user: {email}")
-            total_start = time.time()
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
 
-            # Use the enhanced connection context manager
-            with db_connection_with_resume_retry() as conn:
-                query_start = time.time()
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(user_id)
+            return copy.copy(entry[1])
+
+    def set(self, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
-                with db_cursor(conn) as cursor:
-                    cursor.execute(convert_query("""
-                        SELECT id, name, surname, email, password_hash, is_verified, verification_token, token_expiry
-                        FROM Users 
-                        WHERE email = ?
-                        """), (email,))
+    def invalidate(self, user_id=None):
+        """Forget one user, or everybody when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
 
-                    row = cursor.fetchone()
+user_cache = UserCache(app.config['USER_CACHE_TTL'])
 
-                    query_time = time.time() - query_start
-                    total_time = time.time() - total_start
+# --------------------------------------
+# Cache invalidation bus
+# --------------------------------------
 
-                    # Log timing info for monitoring
-                    if total_time > 5:
-                        print(f"User lookup - Query: {query_time:.1f}s, Total: {total_time:.1f}s")
+class InvalidationBus:
+    """
+    Broadcasts cache invalidations ("catalog changed", "user N changed") to every worker process.
+    publish() applies the change to this process right away and then tells the others through
+    the database: LISTEN/NOTIFY on PostgreSQL, the CacheInvalidations table elsewhere (SQLite only
+    reads it when PRAGMA data_version says another connection committed; SQL Server polls it).
+    When messages may have been missed (listener reconnects), every cache is dropped instead.
+    """
 
-                    if not row:
-                        return None
+    CHANNEL = 'yoga_cache_invalidation'
 
-                    return cls(
-                        id=row[0], name=row[1], surname=row[2], email=row[3],
-                        password_hash=row[4], is_verified=bool(row[5]),
-                        verification_token=row[6], token_expiry=row[7]
-                    )
+    def __init__(self, enabled, poll_interval):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        self.origin = None
+        self._handlers = collections.defaultdict(list)
+        self._stop_event = threading.Event()
+        self._thread = None
 
-        except Exception as e:
-            print(f"get_user_by_email error: {str(e)}")
+    def subscribe(self, topic, handler):
+        """Register handler(key) for a topic; key is None when everything under the topic changed"""
+        self._handlers[topic].append(handler)
+
+    def _dispatch(self, topic, key):
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(key)
+            except Exception as e:
+                logger.warning(f"Cache invalidation handler for '{topic}' failed: {str(e)[:80]}")
+
+    def _resync(self):
+        """Drop every subscribed cache; used when messages from other workers may have been lost"""
+        for topic in list(self._handlers):
+            self._dispatch(topic, None)
+
+    def _receive(self, topic, key, origin):
+        # This process applied its own changes when it published them
+        if origin != self.origin:
+            self._dispatch(topic, int(key) if key is not None and str(key).isdigit() else key)
+
+    def publish(self, topic, key=None):
+        """Invalidate locally, then broadcast to the other workers (best effort)"""
+        self._dispatch(topic, key)
+        if not self.enabled or self.origin is None:
+            return
+        try:
+            with db_connection() as conn:
+                with db_cursor(conn) as cursor:
+                    if DB_CONFIG['type'] == 'postgresql':
+                        payload = json.dumps({'t': topic, 'k': key, 'o': self.origin})
+                        cursor.execute("SELECT pg_notify(%s, %s)", (self.CHANNEL, payload))
+                    else:
+                        cursor.execute(convert_query(
+                            "INSERT INTO CacheInvalidations (topic, item_key, origin) VALUES (?, ?, ?)"
+                        ), (topic, None if key is None else str(key), self.origin))
+                    conn.commit()
+        except Exception as e:
+            # Other workers fall back to their cache TTLs
+            logger.warning(f"Could not broadcast '{topic}' invalidation: {str(e)[:80]}")
+
+    def start(self):
+        """Start listening in this process (once per worker, after fork)"""
+        if not self.enabled:
+            return
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        self._stop_event = threading.Event()
+        target = self._listen_postgres if DB_CONFIG['type'] == 'postgresql' else self._poll_table
+        self._thread = threading.Thread(target=target, name='cache-invalidation', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _listen_postgres(self):
+        """Dedicated autocommit connection blocked in select() until a NOTIFY arrives"""
+        import psycopg2
+        delay = 1
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(DB_CONFIG['conn_string'])
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {self.CHANNEL}")
+                self._resync()
+                delay = 1
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        message = json.loads(conn.notifies.pop(0).payload)
+                        self._receive(message.get('t'), message.get('k'), message.get('o'))
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener lost its connection: {str(e)[:80]}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, 30)
+
+    def _open_poll_connection(self):
+        """Own connection outside the pool, so polling never takes a slot from requests"""
+        if DB_CONFIG['type'] == 'sqlite':
+            return sqlite3.connect(DB_CONFIG['conn_string'], check_same_thread=False)
+        import pyodbc
+        return pyodbc.connect(DB_CONFIG['conn_string'], autocommit=False, timeout=30)
+
+    def _poll_table(self):
+        """Read new CacheInvalidations rows on a dedicated connection"""
+        delay = 1
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._open_poll_connection()
+                cursor = conn.cursor()
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM CacheInvalidations")
+                last_id = cursor.fetchone()[0]
+                conn.commit()
+                data_version = None
+                self._resync()
+                delay = 1
+                while not self._stop_event.wait(self.poll_interval):
+                    if DB_CONFIG['type'] == 'sqlite':
+                        # Changes whenever another connection commits; otherwise there's nothing to read
+                        cursor.execute("PRAGMA data_version")
+                        current_version = cursor.fetchone()[0]
+                        if current_version == data_version:
+                            continue
+                        data_version = current_version
+                    cursor.execute(convert_query(
+                        "SELECT id, topic, item_key, origin FROM CacheInvalidations WHERE id > ? ORDER BY id"
+                    ), (last_id,))
+                    rows = cursor.fetchall()
+                    conn.commit()
+                    for row_id, topic, item_key, origin in rows:
+                        self._receive(topic, item_key, origin)
+                        last_id = row_id
+            except Exception as e:
+                logger.warning(f"Cache invalidation poller failed: {str(e)[:80]}")
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, 30)
+
+    def purge(self, older_than):
+        """Delete broadcast rows every worker has long since read"""
+        if DB_CONFIG['type'] == 'postgresql':
+            return 0
+        cutoff = datetime.utcnow() - older_than
+        with db_connection() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("DELETE FROM CacheInvalidations WHERE created_at < ?"), (cutoff,))
+                if DB_CONFIG['type'] == 'sqlserver':
+                    cursor.execute("SELECT @@ROWCOUNT")
+                    purged = cursor.fetchone()[0]
+                else:
+                    purged = cursor.rowcount
+                conn.commit()
+        return purged
+
+invalidation_bus = InvalidationBus(
+    enabled=app.config['CACHE_BUS_ENABLED'],
+    poll_interval=app.config['CACHE_BUS_POLL_INTERVAL']
+)
+invalidation_bus.subscribe('catalog', lambda key: catalog_cache.invalidate())
+invalidation_bus.subscribe('user', user_cache.invalidate)
+
+# --------------------------------------
+# Live seat availability (Server-Sent Events)
+# --------------------------------------
+
+class SeatEventHub:
+    """
+    Fan-out hub for seat availability deltas.
+    Every delta is formatted once into a shared ring buffer; subscribers only keep a cursor
+    into it and sleep on one condition, so idle connections cost no queue and no polling.
+    The hub is per worker: changes made in other workers arrive through the 'catalog' topic of
+    the invalidation bus (see publish_seat_change).
+    """
+
+    def __init__(self, history_size=512, max_subscribers=4):
+        self._events = collections.deque(maxlen=history_size)
+        self._last_id = 0
+        self._subscribers = 0
+        self._condition = threading.Condition()
+        self.max_subscribers = max_subscribers
+        self.closed = False
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def has_subscribers(self):
+        return self._subscribers > 0
+
+    def subscribe(self):
+        """Register a stream and return the current event id, or None when the worker is full"""
+        with self._condition:
+            if self._subscribers >= self.max_subscribers:
+                return None
+            self._subscribers += 1
+            return self._last_id
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def _append(self, event, data):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, f"id: {self._last_id}\nevent: {event}\ndata: {data}\n\n"))
+            self._condition.notify_all()
+
+    def publish(self, class_id, spots_left, status):
+        """Publish a compact delta for one class to all subscribers"""
+        self._append('seats', json.dumps({'class-id': class_id, 'spots left': spots_left, 'status': status},
+                                         separators=(',', ':')))
+
+    def resync(self):
+        """Tell every subscriber to re-fetch /classes (many classes changed at once)"""
+        self._append('resync', '{}')
+
+    def wait_for_events(self, last_id, timeout):
+        """
+        Block until there are events newer than last_id or the timeout passes.
+        Returns (events, missed) where missed means the cursor fell out of the buffer, or points
+        past the newest event (an id handed out by another worker or an earlier process).
+        """
+        with self._condition:
+            if last_id > self._last_id:
+                return [], True
+            if self._last_id <= last_id and not self.closed:
+                self._condition.wait(timeout)
+            if self._last_id <= last_id:
+                return [], False
+            missed = bool(self._events) and self._events[0][0] > last_id + 1
+            return [event for event in self._events if event[0] > last_id], missed
+
+    def close(self):
+        """Wake every subscriber so open streams end (shutdown); browsers reconnect elsewhere"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def get_stats(self):
+        return {
+            'subscribers': self._subscribers,
+            'last_event_id': self._last_id,
+            'buffered_events': len(self._events)
+        }
+
+seat_events = SeatEventHub(max_subscribers=app.config['SEAT_STREAM_MAX_SUBSCRIBERS'])
+
+def publish_seat_change(class_id):
+    """
+    'catalog' handler: push the current seat count of a changed class to this worker's streams.
+    Runs for changes made here and in other workers; class_id is None when many classes changed.
+    """
+    if not seat_events.has_subscribers():
+        return
+    if not isinstance(class_id, int):
+        seat_events.resync()
+        return
+    with db_connection() as conn:
+        with db_cursor(conn) as cursor:
+            cursor.execute(convert_query("""
+            SELECT YC.capacity, YC.status,
+                (SELECT COUNT(*) FROM Bookings B WHERE B.class_id = YC.id AND B.status = 'active')
+            FROM YogaClasses YC
+            WHERE YC.id = ?
+            """), (class_id,))
+            row = cursor.fetchone()
+    if row:
+        seat_events.publish(class_id, row[0] - row[2], row[1])
+
+invalidation_bus.subscribe('catalog', publish_seat_change)
+
+# --------------------------------------
+# Password hashing
+# --------------------------------------
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing pool is saturated"""
+    pass
+
+class PasswordHasher:
+    """
+    Runs PBKDF2 hashing and verification in a dedicated process pool.
+    A bounded number of slots limits queued work; when they're all taken callers get
+    PasswordHashingBusy instead of piling up CPU-bound work behind the request threads.
+    """
+
+    def __init__(self, iterations, max_workers, max_pending, queue_timeout):
+        self.iterations = iterations
+        self.method = f"pbkdf2:sha256:{iterations}"
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers, 1)
+        self.queue_timeout = queue_timeout
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'hashes': 0,
+            'verifications': 0,
+            'rehashes': 0,
+            'rejected': 0,
+            'errors': 0,
+            'in_flight': 0,
+            'total_time': 0.0,
+            'max_time': 0.0
+        }
+
+    def _get_executor(self):
+        """Create the process pool on first use (and again after a fork)"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    # Never fork: this process already runs threads (log writer, pools, keepalive)
+                    # and a forked child could inherit one of their locks held. The forkserver
+                    # starts children from a clean single-threaded process instead.
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                    else:
+                        context = multiprocessing.get_context('spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _record(self, kind, duration, failed=False):
+        with self._stats_lock:
+            self._stats[kind] += 1
+            self._stats['in_flight'] -= 1
+            self._stats['total_time'] += duration
+            self._stats['max_time'] = max(self._stats['max_time'], duration)
+            if failed:
+                self._stats['errors'] += 1
+
+    def _run(self, kind, func, *args):
+        """Run a hashing function in the pool, respecting the slot limit"""
+        if self.max_workers > 0:
+            if self.queue_timeout > 0:
+                acquired = self._slots.acquire(timeout=self.queue_timeout)
+            else:
+                acquired = self._slots.acquire(blocking=False)
+            if not acquired:
+                with self._stats_lock:
+                    self._stats['rejected'] += 1
+                metrics.inc('password_hash_rejected_total')
+                raise PasswordHashingBusy("Password hashing is at capacity")
+
+        with self._stats_lock:
+            self._stats['in_flight'] += 1
+        start_time = time.time()
+        failed = False
+        try:
+            if self.max_workers <= 0:
+                return func(*args)
+            try:
+                return self._get_executor().submit(func, *args).result()
+            except BrokenProcessPool:
+                # A worker died, start a fresh pool for the next caller
+                with self._executor_lock:
+                    self._executor = None
+                raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.max_workers > 0:
+                self._slots.release()
+            self._record(kind, time.time() - start_time, failed)
+
+    def hash(self, password):
+        """Hash a password with the configured work factor"""
+        return self._run('hashes', generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self._run('verifications', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when a stored hash uses another algorithm or a lower work factor than configured"""
+        if not password_hash:
+            return False
+        method = password_hash.split('$', 1)[0].split(':')
+        if method[:2] != ['pbkdf2', 'sha256']:
+            return True
+        try:
+            return int(method[2]) < self.iterations
+        except (IndexError, ValueError):
+            return True
+
+    def record_rehash(self):
+        with self._stats_lock:
+            self._stats['rehashes'] += 1
+
+    def close(self):
+        """Shut down the worker processes"""
+        with self._executor_lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_stats(self):
+        """Get hashing pool statistics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        completed = stats['hashes'] + stats['verifications']
+        stats['avg_time'] = stats['total_time'] / completed if completed else 0.0
+        stats['method'] = self.method
+        stats['max_workers'] = self.max_workers
+        stats['max_pending'] = self.max_pending
+        return stats
+
+password_hasher = PasswordHasher(
+    iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+    queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+)
+metrics.counter('password_hash_rejected_total', 'Hashing requests rejected because the pool was full')
+
+def password_hashing_busy_response():
+    """503 response used when the hashing pool has no free slots"""
+    response = jsonify({'error': 'The server is busy. Please try again in a moment.', 'retry_suggested': True})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
+# --------------------------------------
+# Rate limiting
+# --------------------------------------
+
+class MemoryRateLimitBackend:
+    """
+    Token buckets kept in this process.
+    Each key holds a (tokens, last_update, rate, limit) tuple; least recently used keys are evicted
+    past max_keys, and buckets that have refilled completely are swept since they're the same as a
+    missing key. Limits apply per process, so with N workers a client may get up to N times the limit.
+    """
+
+    def __init__(self, max_keys=10000, sweep_interval=60):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def hit(self, key, limit, period):
+        """Take one token; returns (allowed, retry_after_seconds)"""
+        rate = limit / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, last_update, _, _ = self._buckets.pop(key, (limit, now, rate, limit))
+            tokens = min(limit, tokens + (now - last_update) * rate)
+            if tokens >= 1:
+                allowed, retry_after = True, 0
+                tokens -= 1
+            else:
+                allowed, retry_after = False, (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, rate, limit)
+
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if now - self._last_sweep > self.sweep_interval:
+                self._sweep(now)
+        return allowed, retry_after
+
+    def _sweep(self, now):
+        # Keys have different periods, so idle time alone says nothing; drop only full buckets
+        self._last_sweep = now
+        full = [key for key, (tokens, last_update, rate, limit) in self._buckets.items()
+                if tokens + (now - last_update) * rate >= limit]
+        for key in full:
+            del self._buckets[key]
+
+    def get_stats(self):
+        return {'backend': 'memory', 'tracked_keys': len(self._buckets), 'max_keys': self.max_keys}
+
+class DatabaseRateLimitBackend:
+    """
+    Fixed-window counters in the RateLimits table, shared by every gunicorn worker.
+    Keys include the window number, so each window is its own row and old rows are purged periodically.
+    """
+
+    def __init__(self, purge_probability=0.01):
+        self.purge_probability = purge_probability
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        window_end = (window + 1) * period
+        bucket_key = hashlib.sha256(f"{key}:{window}".encode()).hexdigest()[:64]
+
+        try:
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("UPDATE RateLimits SET hits = hits + 1 WHERE bucket_key = ?"),
+                                   (bucket_key,))
+                    if DB_CONFIG['type'] == 'sqlserver':
+                        cursor.execute("SELECT @@ROWCOUNT")
+                        updated = cursor.fetchone()[0]
+                    else:
+                        updated = cursor.rowcount
+
+                    if not updated:
+                        try:
+                            cursor.execute(convert_query("""
+                            INSERT INTO RateLimits (bucket_key, hits, window_end) VALUES (?, 1, ?)
+                            """), (bucket_key, int(window_end)))
+                        except Exception:
+                            # Another worker created the row first
+                            conn.rollback()
+                            cursor.execute(convert_query("UPDATE RateLimits SET hits = hits + 1 WHERE bucket_key = ?"),
+                                           (bucket_key,))
+
+                    cursor.execute(convert_query("SELECT hits FROM RateLimits WHERE bucket_key = ?"), (bucket_key,))
+                    hits = cursor.fetchone()[0]
+
+                    if random.random() < self.purge_probability:
+                        cursor.execute(convert_query("DELETE FROM RateLimits WHERE window_end < ?"), (int(now),))
+                    conn.commit()
+        except Exception as e:
+            # Fail open, a database hiccup shouldn't lock everyone out
+            logger.warning(f"Rate limit check failed: {str(e)[:80]}")
+            return True, 0
+
+        if hits > limit:
+            return False, window_end - now
+        return True, 0
+
+    def get_stats(self):
+        return {'backend': 'database'}
+
+class RateLimiter:
+    """Applies the configured per-endpoint limits to the current request"""
+
+    def __init__(self, backend, rules, enabled=True):
+        self.backend = backend
+        self.rules = rules
+        self.enabled = enabled
+        self._rejected = collections.Counter()
+
+    def check(self, endpoint, email=None):
+        """Returns the number of seconds to wait, or 0 when the request may proceed"""
+        if not self.enabled:
+            return 0
+        identities = {'ip': request.remote_addr or 'unknown'}
+        if email:
+            identities['email'] = email.strip().lower()
+            identities['email_ip'] = f"{identities['email']}|{identities['ip']}"
+
+        retry_after = 0
+        for scope, (limit, period) in self.rules.get(endpoint, {}).items():
+            identity = identities.get(scope)
+            if identity is None:
+                continue
+            allowed, wait = self.backend.hit(f"{endpoint}:{scope}:{identity}", limit, period)
+            if not allowed:
+                self._rejected[f"{endpoint}:{scope}"] += 1
+                retry_after = max(retry_after, wait)
+        return retry_after
+
+    def get_stats(self):
+        stats = self.backend.get_stats()
+        stats['enabled'] = self.enabled
+        stats['rejected'] = dict(self._rejected)
+        return stats
+
+if app.config['RATE_LIMIT_BACKEND'] == 'database':
+    rate_limit_backend = DatabaseRateLimitBackend()
+else:
+    rate_limit_backend = MemoryRateLimitBackend(max_keys=app.config['RATE_LIMIT_MAX_KEYS'])
+
+rate_limiter = RateLimiter(rate_limit_backend, app.config['RATE_LIMITS'], enabled=app.config['RATE_LIMIT_ENABLED'])
+
+def rate_limited(endpoint):
+    """Reject the request with 429 when the client or the submitted email is over its limit"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            email = data.get('email') if isinstance(data, dict) else None
+            retry_after = rate_limiter.check(endpoint, email if isinstance(email, str) else None)
+            if retry_after > 0:
+                response = jsonify({'error': 'Too many requests. Please try again later.'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+# Flask-Login setup
+login_manager = LoginManager()
+login_manager.init_app(app)
+
+# User model for Flask-Login (keeping your existing User class with minor SQL adaptations)
+class User(UserMixin):
+    def __init__(self, id=None, name=None, surname=None, email=None, password_hash=None,
+                 is_verified=False, verification_token=None, token_expiry=None):
+        self.id = id
+        self.name = name
+        self.surname = surname
+        self.email = email
+        self.password_hash = password_hash
+        self.is_verified = is_verified
+        self.verification_token = verification_token
+        self.token_expiry = token_expiry
+
+    def check_password(self, password):
+        """Check if the password matches the hash"""
+        return password_hasher.verify(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password):
+        """Upgrade an outdated hash after a successful login (best effort)"""
+        if not password_hasher.needs_rehash(self.password_hash):
+            return False
+        try:
+            password_hash = password_hasher.hash(password)
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("UPDATE Users SET password_hash = ? WHERE id = ?"),
+                                   (password_hash, self.id))
+                    conn.commit()
+            self.password_hash = password_hash
+            invalidation_bus.publish('user', self.id)
+            password_hasher.record_rehash()
+            return True
+        except Exception as e:
+            logger.warning(f"Password rehash skipped for user {self.id}: {str(e)}")
+            return False
+
+    def update_verification_status(self):
+        """Update the user's verification status"""
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                # Use TRUE for PostgreSQL, 1 for others
+                is_verified_value = True if DB_CONFIG['type'] == 'postgresql' else 1
+                cursor.execute(convert_query("""
+                UPDATE Users 
+                SET is_verified = ?
+                WHERE id = ?
+                """), (is_verified_value, self.id))
+                AuthToken.revoke(cursor, self.id, AuthToken.PURPOSE_VERIFY)
+                conn.commit()
+        invalidation_bus.publish('user', self.id)
+
+        self.is_verified = True
+        self.verification_token = None
+        self.token_expiry = None
+        return True
+
+    def update_verification_token(self):
+        """Generate a new verification token, replacing any pending one"""
+        token, expiry = AuthToken.issue(self.id, AuthToken.PURPOSE_VERIFY,
+                                        timedelta(hours=app.config['VERIFICATION_TOKEN_EXPIRY']))
+
+        self.verification_token = token
+        self.token_expiry = expiry
+        return token
+
+    @classmethod
+    def create_user(cls, name, surname, email, password):
+        """Create a new user with verification token"""
+        # queries = get_sql_queries()
+
+        # Check email format before spending CPU on the hash
+        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+            raise ValueError("Invalid email format")
+
+        # Generate password hash
+        password_hash = password_hasher.hash(password)
+
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                # Insert user into database
+                # Use FALSE for is_verified (works in PostgreSQL and SQL Server)
+                is_verified_value = False if DB_CONFIG['type'] == 'postgresql' else 0
+                cursor.execute(convert_query("""
+                INSERT INTO Users (name, surname, email, password_hash, is_verified)
+                VALUES (?, ?, ?, ?, ?)
+                """), (name, surname, email, password_hash, is_verified_value))
+
+                cursor.execute(SQL_QUERIES['get_identity'])
+                user_id = cursor.fetchone()[0]
+
+                # Issue the verification token in the same transaction
+                verification_token, token_expiry = AuthToken.issue(
+                    user_id, AuthToken.PURPOSE_VERIFY,
+                    timedelta(hours=app.config['VERIFICATION_TOKEN_EXPIRY']),
+                    cursor=cursor
+                )
+                conn.commit()
+
+        # Return user object
+        return cls(
+            id=user_id,
+            name=name,
+            surname=surname,
+            email=email,
+            password_hash=password_hash,
+            is_verified=False,
+            verification_token=verification_token,
+            token_expiry=token_expiry
+        )
+
+    @classmethod
+    def get_user_by_token(cls, token):
+        """Get a user by a pending verification token (without consuming it)"""
+        if not AuthToken.resolve(token, AuthToken.PURPOSE_VERIFY):
+            return None
+        try:
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("""
+                        SELECT U.id, U.name, U.surname, U.email, U.password_hash, U.is_verified, T.expires_at
+                        FROM AuthTokens T
+                        JOIN Users U ON U.id = T.user_id
+                        WHERE T.token_hash = ? AND T.purpose = ?
+                        """), (hash_auth_token(token), AuthToken.PURPOSE_VERIFY))
+                    row = cursor.fetchone()
+
+                    if not row:
+                        return None
+
+                    return cls(
+                        id=row[0],
+                        name=row[1],
+                        surname=row[2],
+                        email=row[3],
+                        password_hash=row[4],
+                        is_verified=bool(row[5]),
+                        verification_token=token,
+                        token_expiry=row[6]  # Already converted to datetime
+                    )
+        except Exception as e:
+            logger.error(f"Error in get_user_by_token: {str(e)}")
+        return None
+
+    @classmethod
+    def get_user_by_email(cls, email):
+        """
+        Enhanced user lookup with database resume handling.
+        Like a smart librarian who waits patiently when the library is reopening.
+        """
+        try:
+            logger.info("Looking up user", extra={'email': email, 'sample': app.config['LOG_SAMPLE_RATE']})
+            total_start = time.time()
+
+            # Use the enhanced connection context manager
+            with db_connection_with_resume_retry() as conn:
+                query_start = time.time()
+
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("""
+                        SELECT id, name, surname, email, password_hash, is_verified, verification_token, token_expiry
+                        FROM Users 
+                        WHERE email = ?
+                        """), (email,))
+
+                    row = cursor.fetchone()
+
+                    query_time = time.time() - query_start
+                    total_time = time.time() - total_start
+
+                    # Log timing info for monitoring
+                    if total_time > 5:
+                        logger.warning(f"User lookup - Query: {query_time:.1f}s, Total: {total_time:.1f}s")
+
+                    if not row:
+                        return None
+
+                    return cls(
+                        id=row[0], name=row[1], surname=row[2], email=row[3],
+                        password_hash=row[4], is_verified=bool(row[5]),
+                        verification_token=row[6], token_expiry=row[7]
+                    )
+
+        except Exception as e:
+            logger.error(f"get_user_by_email error: {str(e)}")
             return None
 
     @classmethod
@@ -924,14 +3243,13 @@ class User(UserMixin):
                                 token_expiry=row[7]  # Already converted to datetime
                             )
                 except Exception as e:
-                    print(f"Error in get_user_by_id: {str(e)}")
+                    logger.error(f"Error in get_user_by_id: {str(e)}")
                     return None
 
     @staticmethod
     def get_user_count():
         """
         Get total count of users in the system.
-        This is a lightweight query perfect for database keepalive pings.
 
         Returns:
             int: Total number of users
@@ -943,10 +3261,152 @@ class User(UserMixin):
                     result = cursor.fetchone()
                     return result[0] if result else 0
         except Exception as e:
-            print(f"Error getting user count: {str(e)}")
+            logger.error(f"Error getting user count: {str(e)}")
             return 0
 
+class AuthToken:
+    """
+    Single-use verification and password reset tokens.
+    Tokens are signed with SECRET_KEY and carry the user id, purpose and expiry, so garbage,
+    tampered and expired links are rejected without touching the database.
+    Only the SHA-256 of a token is stored; consuming a token is a single DELETE ... RETURNING
+    (OUTPUT on SQL Server) that makes it single-use.
+    """
+
+    PURPOSE_VERIFY = 'verify'
+    PURPOSE_PASSWORD_RESET = 'password_reset'
+    # Links issued before tokens were signed were plain secrets.token_urlsafe(32) values
+    LEGACY_TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{43}')
+
+    @staticmethod
+    def _serializer():
+        return URLSafeSerializer(app.config['SECRET_KEY'], salt='auth-token')
+
+    @classmethod
+    def decode(cls, token, purpose):
+        """
+        Check a token's signature and purpose without any database work.
+        Returns (user_id, expires_at) or None; expiry is left for the caller to check.
+        """
+        try:
+            claims = cls._serializer().loads(token)
+        except BadSignature:
+            return None
+        if not isinstance(claims, dict) or claims.get('p') != purpose:
+            return None
+        try:
+            return int(claims['u']), datetime.utcfromtimestamp(int(claims['e']))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def resolve(cls, token, purpose):
+        """
+        Like decode(), but also accepts unsigned links that were issued before tokens were signed
+        and moved into AuthTokens by migrate_legacy_tokens. Only those cost a lookup.
+        """
+        claims = cls.decode(token, purpose)
+        if claims or not app.config['LEGACY_TOKEN_FALLBACK'] or not cls.LEGACY_TOKEN_RE.fullmatch(token):
+            return claims
+        try:
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("""
+                    SELECT user_id, expires_at FROM AuthTokens WHERE token_hash = ? AND purpose = ?
+                    """), (hash_auth_token(token), purpose))
+                    row = cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error looking up legacy token: {str(e)}")
+            return None
+        if not row:
+            return None
+        return row[0], cls._to_datetime(row[1])
+
+    @staticmethod
+    def _to_datetime(value):
+        # RETURNING columns don't carry a declared type, so SQLite hands back the stored string
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+
+    @classmethod
+    def issue(cls, user_id, purpose, lifetime, cursor=None):
+        """
+        Create a token for a user, replacing any pending token with the same purpose.
+        Pass a cursor to join the caller's transaction (the caller commits).
+        Returns (token, expires_at).
+        """
+        expires_ts = int(time.time() + lifetime.total_seconds())
+        expires_at = datetime.utcfromtimestamp(expires_ts)
+        # The nonce keeps every token unique even when issued twice in the same second
+        token = cls._serializer().dumps({
+            'u': user_id,
+            'p': purpose,
+            'e': expires_ts,
+            'n': secrets.token_urlsafe(8)
+        })
+
+        def write(cursor):
+            cls.revoke(cursor, user_id, purpose)
+            cursor.execute(convert_query("""
+            INSERT INTO AuthTokens (user_id, purpose, token_hash, expires_at)
+            VALUES (?, ?, ?, ?)
+            """), (user_id, purpose, hash_auth_token(token), expires_at))
+
+        if cursor is not None:
+            write(cursor)
+        else:
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    write(cursor)
+                    conn.commit()
+        return token, expires_at
+
+    @staticmethod
+    def revoke(cursor, user_id, purpose):
+        """Delete a user's pending tokens for a purpose (the caller commits)"""
+        cursor.execute(convert_query("DELETE FROM AuthTokens WHERE user_id = ? AND purpose = ?"),
+                       (user_id, purpose))
+
+    @classmethod
+    def consume(cls, cursor, token, purpose):
+        """
+        Delete a token and return (user_id, expires_at), or None if it doesn't exist.
+        Expired tokens are consumed too; the caller checks expires_at and commits.
+        """
+        cursor.execute(SQL_QUERIES['consume_auth_token'], (hash_auth_token(token), purpose))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return row[0], cls._to_datetime(row[1])
+
+    @staticmethod
+    def purge_expired(batch_size=500, pause=0.1, older_than=timedelta(0)):
+        """
+        Delete tokens that expired more than older_than ago, in small batches
+        so no single statement holds locks for long.
+        """
+        removed = 0
+        while True:
+            cutoff = datetime.utcnow() - older_than
+            with db_connection_with_retry() as conn:
+                with db_cursor(conn) as cursor:
+                    if DB_CONFIG['type'] == 'sqlserver':
+                        cursor.execute(SQL_QUERIES['purge_auth_tokens_batch'], (batch_size, cutoff))
+                        cursor.execute("SELECT @@ROWCOUNT")
+                        deleted = cursor.fetchone()[0]
+                    else:
+                        cursor.execute(SQL_QUERIES['purge_auth_tokens_batch'], (cutoff, batch_size))
+                        deleted = cursor.rowcount
+                    conn.commit()
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+            time.sleep(pause)
+
 class YogaClass:
+    STATUSES = ('active', 'cancelled')
+
     def __init__(self, id=None, name=None, instructor=None, date_time=None, duration=75,
                  capacity=None, status='active', location=None):
         self.id = id
@@ -966,6 +3426,7 @@ class YogaClass:
 
         # queries = get_sql_queries()
 
+        is_update = self.id is not None
         with db_connection_with_retry() as conn:
             with db_cursor(conn) as cursor:
                 if self.id is None:
@@ -987,6 +3448,9 @@ class YogaClass:
                           self.capacity, self.status, self.location, self.id))
 
                 conn.commit()
+        occupancy_rollup.mark(self.id)
+        invalidation_bus.publish('catalog', self.id if is_update else None)
+        invalidation_bus.publish('calendar')
         return self.id
 
     def cancel(self):
@@ -1009,6 +3473,9 @@ class YogaClass:
                     affected_bookings = cursor.rowcount
 
                 conn.commit()
+        occupancy_rollup.mark(self.id)
+        invalidation_bus.publish('catalog', self.id)
+        invalidation_bus.publish('calendar')
         return affected_bookings
 
     def get_booking_count(self):
@@ -1045,115 +3512,490 @@ class YogaClass:
             # Combine them
             formatted_date_time = f"{start_str}-{end_str}"
 
-        # Create Google Maps URL
-        google_maps_url = None
-        if self.location:
-            # URL encode the location for Google Maps
-            encoded_location = self.location.replace(' ', '+')
-            google_maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
+        # Create Google Maps URL
+        google_maps_url = None
+        if self.location:
+            # URL encode the location for Google Maps
+            encoded_location = self.location.replace(' ', '+')
+            google_maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
+
+        # Calculate spots left
+        spots_left = self.capacity
+        if self.id:
+            if booking_count is not None:
+                spots_left = self.capacity - booking_count
+            else:
+                spots_left = self.spots_left()
+
+        return {
+            'class-id': self.id,
+            'name': self.name,
+            'teacher': self.instructor,
+            'date and time': formatted_date_time,
+            'duration': self.duration,
+            'spots total': self.capacity,
+            'spots left': spots_left,
+            'status': self.status,
+            'location': self.location,
+            'location_url': google_maps_url
+        }
+
+    @classmethod
+    def get_by_id(cls, class_id):
+        """Get a yoga class by ID"""
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("""
+                SELECT id, name, instructor, date_time, duration, capacity, status, location 
+                FROM YogaClasses 
+                WHERE id = ?
+                """), (class_id,))
+                row = cursor.fetchone()
+
+        if row:
+            return cls(
+                id=row[0],
+                name=row[1],
+                instructor=row[2],
+                date_time=row[3],  # Already converted to datetime by SQLite configuration
+                duration=row[4],
+                capacity=row[5],
+                status=row[6],
+                location=row[7]
+            )
+        return None
+
+    @staticmethod
+    def get_future_active_rows():
+        """Future active classes as (id, name, instructor, date_time, duration, capacity, status, location, booking_count)"""
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                # Build database-specific query
+                if DB_CONFIG['type'] == 'sqlite':
+                    query = """
+                    SELECT 
+                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
+                        YC.capacity, YC.status, YC.location,
+                        COUNT(CASE WHEN B.status = 'active' THEN 1 ELSE NULL END) as booking_count
+                    FROM YogaClasses YC
+                    LEFT JOIN Bookings B ON YC.id = B.class_id
+                    WHERE YC.date_time > datetime('now') AND YC.status = 'active'
+                    GROUP BY 
+                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
+                        YC.capacity, YC.status, YC.location
+                    ORDER BY YC.date_time
+                    """
+                else:
+                    query = """
+                    SELECT 
+                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
+                        YC.capacity, YC.status, YC.location,
+                        COUNT(CASE WHEN B.status = 'active' THEN 1 ELSE NULL END) as booking_count
+                    FROM YogaClasses YC
+                    LEFT JOIN Bookings B ON YC.id = B.class_id
+                    WHERE YC.date_time > CURRENT_TIMESTAMP AND YC.status = 'active'
+                    GROUP BY 
+                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
+                        YC.capacity, YC.status, YC.location
+                    ORDER BY YC.date_time
+                    """
+
+                cursor.execute(query)
+                return cursor.fetchall()
+
+    @classmethod
+    def get_future_active_classes(cls):
+        """Get all future active classes with booking counts"""
+        rows = cls.get_future_active_rows()
+
+        classes = []
+        for row in rows:
+            yoga_class = cls(
+                id=row[0],
+                name=row[1],
+                instructor=row[2],
+                date_time=row[3],
+                duration=row[4],
+                capacity=row[5],
+                status=row[6],
+                location=row[7]
+            )
+
+            booking_count = row[8]
+            class_dict = yoga_class.to_dict(booking_count=booking_count)
+            classes.append(class_dict)
+
+        return classes
+
+    INSERT_BATCH_SIZE = 100  # 7 parameters per row stays well under SQL Server's 2100 limit
+
+    @staticmethod
+    def insert_rows(cursor, rows):
+        """
+        Insert (name, instructor, date_time, duration, capacity, status, location) rows with multi-row
+        VALUES statements on the caller's transaction. Returns the new ids in row order.
+        """
+        ids = []
+        columns = "(name, instructor, date_time, duration, capacity, status, location)"
+        for start in range(0, len(rows), YogaClass.INSERT_BATCH_SIZE):
+            batch = rows[start:start + YogaClass.INSERT_BATCH_SIZE]
+            values = ', '.join(['(?, ?, ?, ?, ?, ?, ?)'] * len(batch))
+            params = [value for row in batch for value in row]
+            if DB_CONFIG['type'] == 'sqlserver':
+                # SQL Server doesn't promise identities in VALUES order, so MERGE reports each row's ordinal
+                values = ', '.join(f"(?, ?, ?, ?, ?, ?, ?, {ordinal})" for ordinal in range(len(batch)))
+                cursor.execute(f"""
+                MERGE INTO YogaClasses AS T
+                USING (VALUES {values})
+                    AS S (name, instructor, date_time, duration, capacity, status, location, ordinal)
+                ON 1 = 0
+                WHEN NOT MATCHED THEN
+                    INSERT {columns}
+                    VALUES (S.name, S.instructor, S.date_time, S.duration, S.capacity, S.status, S.location)
+                OUTPUT S.ordinal, INSERTED.id;
+                """, params)
+                ids.extend(class_id for _, class_id in sorted(cursor.fetchall()))
+            else:
+                cursor.execute(convert_query(f"INSERT INTO YogaClasses {columns} VALUES {values} RETURNING id"), params)
+                # Ids come from a sequence taken in VALUES order; RETURNING row order isn't guaranteed
+                ids.extend(sorted(row[0] for row in cursor.fetchall()))
+        return ids
+
+    @staticmethod
+    def _active_booking_counts(cursor, class_ids):
+        """Active booking count per existing class id; ids that don't exist are left out"""
+        counts = {}
+        ids = sorted(set(class_ids))
+        for start in range(0, len(ids), YogaClass.INSERT_BATCH_SIZE):
+            batch = ids[start:start + YogaClass.INSERT_BATCH_SIZE]
+            cursor.execute(convert_query(f"""
+            SELECT YC.id, (SELECT COUNT(*) FROM Bookings B WHERE B.class_id = YC.id AND B.status = 'active')
+            FROM YogaClasses YC
+            WHERE YC.id IN ({', '.join(['?'] * len(batch))})
+            """), batch)
+            counts.update((row[0], row[1]) for row in cursor.fetchall())
+        return counts
+
+    @staticmethod
+    def save_many(classes):
+        """
+        Insert the new classes and update the existing ones in a single transaction.
+        Updates without a status keep the stored one; cancelling a class cancels its bookings.
+        Raises LookupError if an id to update doesn't exist and ValueError if a capacity would drop
+        below the class's active bookings; either way nothing changes. Returns ids in input order.
+        """
+        if any(yoga_class.date_time < datetime.now() for yoga_class in classes):
+            raise ValueError("Cannot create a class in the past")
+        updates = [yoga_class for yoga_class in classes if yoga_class.id is not None]
+        inserts = [yoga_class for yoga_class in classes if yoga_class.id is None]
+
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                counts = YogaClass._active_booking_counts(cursor, [c.id for c in updates])
+                missing = {c.id for c in updates} - set(counts)
+                overbooked = sorted(c.id for c in updates
+                                    if c.id in counts and c.status != 'cancelled' and int(c.capacity) < counts[c.id])
+                if not missing and not overbooked:
+                    if updates:
+                        cursor.executemany(convert_query("""
+                        UPDATE YogaClasses
+                        SET name = ?, instructor = ?, date_time = ?, duration = ?, capacity = ?,
+                            status = COALESCE(?, status), location = ?
+                        WHERE id = ?
+                        """), [(c.name, c.instructor, c.date_time, c.duration, c.capacity, c.status, c.location, c.id)
+                              for c in updates])
+                        cancelled = [(c.id,) for c in updates if c.status == 'cancelled']
+                        if cancelled:
+                            cursor.executemany(convert_query(
+                                "UPDATE Bookings SET status = 'cancelled' WHERE class_id = ? AND status = 'active'"
+                            ), cancelled)
+                    new_ids = YogaClass.insert_rows(cursor, [
+                        (c.name, c.instructor, c.date_time, c.duration, c.capacity, c.status or 'active', c.location)
+                        for c in inserts
+                    ])
+                    for yoga_class, class_id in zip(inserts, new_ids):
+                        yoga_class.id = class_id
+                    conn.commit()
+        if missing:
+            raise LookupError(f"Classes not found: {sorted(missing)}")
+        if overbooked:
+            raise ValueError(f"Capacity below the number of active bookings for classes: {overbooked}")
+        occupancy_rollup.mark(*(yoga_class.id for yoga_class in classes))
+        # One changed class gets a seat delta; more than that makes open seat streams resync
+        invalidation_bus.publish('catalog', classes[0].id if len(classes) == 1 else None)
+        invalidation_bus.publish('calendar')
+        return [yoga_class.id for yoga_class in classes]
+
+WEEKDAY_CODES = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+class ClassSeries:
+    """
+    A recurring weekly class (an RRULE FREQ=WEEKLY;BYDAY=...;INTERVAL=... with EXDATEs).
+    Concrete YogaClasses rows are created ahead of time by materialize(), so bookings
+    and the catalog keep working on plain classes.
+    """
+
+    DATE_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, id=None, name=None, instructor=None, weekdays=None, start_time=None, duration=75,
+                 capacity=None, location=None, starts_on=None, until_on=None, interval_weeks=1,
+                 exceptions=None, status='active', materialized_until=None):
+        self.id = id
+        self.name = name
+        self.instructor = instructor
+        self.weekdays = weekdays or []
+        self.start_time = start_time
+        self.duration = duration
+        self.capacity = capacity
+        self.location = location
+        self.starts_on = starts_on
+        self.until_on = until_on
+        self.interval_weeks = interval_weeks
+        self.exceptions = set(exceptions or ())
+        self.status = status
+        self.materialized_until = materialized_until
+
+    SELECT_COLUMNS = """
+    SELECT id, name, instructor, weekdays, start_time, duration, capacity, location,
+           starts_on, until_on, interval_weeks, exceptions, status, materialized_until
+    FROM ClassSeries
+    """
+
+    @classmethod
+    def _from_row(cls, row):
+        def to_date(value):
+            return datetime.strptime(value, cls.DATE_FORMAT).date() if value else None
+        return cls(
+            id=row[0], name=row[1], instructor=row[2],
+            weekdays=[code for code in row[3].split(',') if code],
+            start_time=row[4], duration=row[5], capacity=row[6], location=row[7],
+            starts_on=to_date(row[8]), until_on=to_date(row[9]), interval_weeks=row[10],
+            exceptions={to_date(value) for value in row[11].split(',') if value},
+            status=row[12], materialized_until=row[13]
+        )
+
+    def validate(self):
+        """Raise ValueError when the pattern can't produce classes"""
+        if not self.weekdays or any(code not in WEEKDAY_CODES for code in self.weekdays):
+            raise ValueError(f"weekdays must be a list of {', '.join(WEEKDAY_CODES)}")
+        datetime.strptime(self.start_time or '', '%H:%M')
+        if self.interval_weeks < 1:
+            raise ValueError("interval_weeks must be at least 1")
+        if self.until_on and self.until_on < self.starts_on:
+            raise ValueError("until_on is before starts_on")
+        if not self.capacity or self.capacity < 1:
+            raise ValueError("capacity must be positive")
+
+    def _params(self):
+        return (self.name, self.instructor, ','.join(self.weekdays), self.start_time, self.duration,
+                self.capacity, self.location, self.starts_on.strftime(self.DATE_FORMAT),
+                self.until_on.strftime(self.DATE_FORMAT) if self.until_on else None, self.interval_weeks,
+                ','.join(sorted(day.strftime(self.DATE_FORMAT) for day in self.exceptions)), self.status)
+
+    def save(self):
+        """Create the series; editing a pattern means ending it and starting a new one"""
+        self.validate()
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("""
+                INSERT INTO ClassSeries (name, instructor, weekdays, start_time, duration, capacity, location,
+                                         starts_on, until_on, interval_weeks, exceptions, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """), self._params())
+                cursor.execute(SQL_QUERIES['get_identity'])
+                self.id = cursor.fetchone()[0]
+                conn.commit()
+        return self.id
+
+    def occurrences(self, start, end):
+        """Start datetimes of the series in (start, end], skipping exception dates"""
+        hour, minute = map(int, self.start_time.split(':'))
+        wanted = {WEEKDAY_CODES.index(code) for code in self.weekdays}
+        # Weeks are counted from the Monday of the first week so INTERVAL=2 means every other week
+        anchor = self.starts_on - timedelta(days=self.starts_on.weekday())
+        day = max(self.starts_on, start.date())
+        last_day = end.date() if self.until_on is None else min(end.date(), self.until_on)
+        while day <= last_day:
+            if (day.weekday() in wanted and day not in self.exceptions
+                    and ((day - anchor).days // 7) % self.interval_weeks == 0):
+                occurs_at = datetime(day.year, day.month, day.day, hour, minute)
+                if start < occurs_at <= end:
+                    yield occurs_at
+            day += timedelta(days=1)
+
+    def materialize(self, horizon):
+        """
+        Create the classes of this series up to now + horizon in one transaction.
+        Safe to run concurrently and repeatedly: SeriesOccurrences' key stops a second copy,
+        and a losing worker just rolls back. Returns how many classes were created.
+        """
+        now = datetime.now()
+        end = now + horizon
+        start = max(now, self.materialized_until or now)
+        if self.status != 'active' or start >= end:
+            return 0
 
-        # Calculate spots left
-        spots_left = self.capacity
-        if self.id:
-            if booking_count is not None:
-                spots_left = self.capacity - booking_count
-            else:
-                spots_left = self.spots_left()
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query(
+                    "SELECT occurs_at FROM SeriesOccurrences WHERE series_id = ? AND occurs_at > ?"
+                ), (self.id, start))
+                existing = {row[0] for row in cursor.fetchall()}
+                pending = [occurs_at for occurs_at in self.occurrences(start, end) if occurs_at not in existing]
+
+                if pending:
+                    class_ids = YogaClass.insert_rows(cursor, [
+                        (self.name, self.instructor, occurs_at, self.duration, self.capacity, 'active', self.location)
+                        for occurs_at in pending
+                    ])
+                    cursor.executemany(convert_query(
+                        "INSERT INTO SeriesOccurrences (series_id, occurs_at, class_id) VALUES (?, ?, ?)"
+                    ), [(self.id, occurs_at, class_id) for occurs_at, class_id in zip(pending, class_ids)])
+                    occupancy_rollup.mark(*class_ids)
+                cursor.execute(convert_query("UPDATE ClassSeries SET materialized_until = ? WHERE id = ?"),
+                               (end, self.id))
+                conn.commit()
+        self.materialized_until = end
+        if pending:
+            invalidation_bus.publish('catalog')
+            invalidation_bus.publish('calendar')
+        return len(pending)
+
+    def _cancel_classes(self, cursor, where_clause, params):
+        """Cancel this series' materialized classes matching where_clause, with their bookings"""
+        cursor.execute(convert_query(f"""
+        SELECT SO.class_id, YC.capacity
+        FROM SeriesOccurrences SO
+        JOIN YogaClasses YC ON YC.id = SO.class_id
+        WHERE SO.series_id = ? AND YC.status = 'active' AND {where_clause}
+        """), (self.id, *params))
+        classes = cursor.fetchall()
+        for class_id, _ in classes:
+            cursor.execute(convert_query("UPDATE YogaClasses SET status = 'cancelled' WHERE id = ?"), (class_id,))
+            cursor.execute(convert_query(
+                "UPDATE Bookings SET status = 'cancelled' WHERE class_id = ? AND status = 'active'"
+            ), (class_id,))
+        return classes
+
+    def add_exception(self, day):
+        """Skip one date, cancelling its class if it was already created. Returns the cancelled class count"""
+        self.exceptions.add(day)
+        start = datetime(day.year, day.month, day.day)
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("UPDATE ClassSeries SET exceptions = ? WHERE id = ?"),
+                               (self._params()[10], self.id))
+                cancelled = self._cancel_classes(cursor, "SO.occurs_at >= ? AND SO.occurs_at < ?",
+                                                 (start, start + timedelta(days=1)))
+                conn.commit()
+        self._publish_cancelled(cancelled)
+        return len(cancelled)
+
+    def end(self):
+        """Stop the series and cancel its future classes. Returns the cancelled class count"""
+        self.status = 'ended'
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("UPDATE ClassSeries SET status = 'ended' WHERE id = ?"), (self.id,))
+                cancelled = self._cancel_classes(cursor, "SO.occurs_at > ?", (datetime.now(),))
+                conn.commit()
+        self._publish_cancelled(cancelled)
+        return len(cancelled)
+
+    @staticmethod
+    def _publish_cancelled(cancelled):
+        if not cancelled:
+            return
+        occupancy_rollup.mark(*(class_id for class_id, _ in cancelled))
+        invalidation_bus.publish('catalog', cancelled[0][0] if len(cancelled) == 1 else None)
+        invalidation_bus.publish('calendar')
 
+    def to_dict(self):
         return {
-            'class-id': self.id,
+            'series-id': self.id,
             'name': self.name,
             'teacher': self.instructor,
-            'date and time': formatted_date_time,
+            'weekdays': self.weekdays,
+            'start_time': self.start_time,
             'duration': self.duration,
-            'spots total': self.capacity,
-            'spots left': spots_left,
-            'status': self.status,
+            'capacity': self.capacity,
             'location': self.location,
-            'location_url': google_maps_url
+            'starts_on': self.starts_on.strftime('%d/%m/%Y'),
+            'until_on': self.until_on.strftime('%d/%m/%Y') if self.until_on else None,
+            'interval_weeks': self.interval_weeks,
+            'exceptions': sorted(day.strftime('%d/%m/%Y') for day in self.exceptions),
+            'status': self.status,
+            'materialized_until': self.materialized_until.strftime('%d/%m/%Y %H:%M') if self.materialized_until else None
         }
 
     @classmethod
-    def get_by_id(cls, class_id):
-        """Get a yoga class by ID"""
+    def get_by_id(cls, series_id):
         with db_connection_with_retry() as conn:
             with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                SELECT id, name, instructor, date_time, duration, capacity, status, location 
-                FROM YogaClasses 
-                WHERE id = ?
-                """), (class_id,))
+                cursor.execute(convert_query(cls.SELECT_COLUMNS + " WHERE id = ?"), (series_id,))
                 row = cursor.fetchone()
-
-        if row:
-            return cls(
-                id=row[0],
-                name=row[1],
-                instructor=row[2],
-                date_time=row[3],  # Already converted to datetime by SQLite configuration
-                duration=row[4],
-                capacity=row[5],
-                status=row[6],
-                location=row[7]
-            )
-        return None
+        return cls._from_row(row) if row else None
 
     @classmethod
-    def get_future_active_classes(cls):
-        """Get all future active classes with booking counts"""
+    def get_all(cls, status=None):
         with db_connection_with_retry() as conn:
             with db_cursor(conn) as cursor:
-                # Build database-specific query
-                if DB_CONFIG['type'] == 'sqlite':
-                    query = """
-                    SELECT 
-                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
-                        YC.capacity, YC.status, YC.location,
-                        COUNT(CASE WHEN B.status = 'active' THEN 1 ELSE NULL END) as booking_count
-                    FROM YogaClasses YC
-                    LEFT JOIN Bookings B ON YC.id = B.class_id
-                    WHERE YC.date_time > datetime('now') AND YC.status = 'active'
-                    GROUP BY 
-                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
-                        YC.capacity, YC.status, YC.location
-                    ORDER BY YC.date_time
-                    """
+                if status:
+                    cursor.execute(convert_query(cls.SELECT_COLUMNS + " WHERE status = ? ORDER BY id"), (status,))
                 else:
-                    query = """
-                    SELECT 
-                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
-                        YC.capacity, YC.status, YC.location,
-                        COUNT(CASE WHEN B.status = 'active' THEN 1 ELSE NULL END) as booking_count
-                    FROM YogaClasses YC
-                    LEFT JOIN Bookings B ON YC.id = B.class_id
-                    WHERE YC.date_time > CURRENT_TIMESTAMP AND YC.status = 'active'
-                    GROUP BY 
-                        YC.id, YC.name, YC.instructor, YC.date_time, YC.duration, 
-                        YC.capacity, YC.status, YC.location
-                    ORDER BY YC.date_time
-                    """
-
-                cursor.execute(query)
+                    cursor.execute(cls.SELECT_COLUMNS + " ORDER BY id")
                 rows = cursor.fetchall()
+        return [cls._from_row(row) for row in rows]
 
-            classes = []
-            for row in rows:
-                yoga_class = cls(
-                    id=row[0],
-                    name=row[1],
-                    instructor=row[2],
-                    date_time=row[3],
-                    duration=row[4],
-                    capacity=row[5],
-                    status=row[6],
-                    location=row[7]
-                )
+def acquire_lease(name, seconds):
+    """
+    Take a named lease row in RollupWatermarks unless another process holds an unexpired one.
+    Keeps a maintenance job that every worker schedules to one process at a time.
+    """
+    now = datetime.now()
+    with db_connection() as conn:
+        with db_cursor(conn) as cursor:
+            cursor.execute(convert_query("DELETE FROM RollupWatermarks WHERE name = ? AND watermark < ?"),
+                           (name, now))
+            try:
+                cursor.execute(convert_query("INSERT INTO RollupWatermarks (name, watermark) VALUES (?, ?)"),
+                               (name, now + timedelta(seconds=seconds)))
+            except Exception:
+                # Primary key taken: someone else holds it
+                conn.rollback()
+                return False
+            conn.commit()
+            return True
+
+def release_lease(name):
+    with db_connection() as conn:
+        with db_cursor(conn) as cursor:
+            cursor.execute(convert_query("DELETE FROM RollupWatermarks WHERE name = ?"), (name,))
+            conn.commit()
 
-                booking_count = row[8]
-                class_dict = yoga_class.to_dict(booking_count=booking_count)
-                classes.append(class_dict)
+SERIES_LEASE = 'series-lease'
+SERIES_LEASE_SECONDS = 900  # A process that dies mid-run blocks the next one for at most this long
 
-            return classes
+def materialize_class_series(horizon_days=None):
+    """
+    Create upcoming classes for every active series; returns how many were created.
+    Every worker's maintenance sweep calls this, so it runs under a lease and returns 0 while
+    another process holds it.
+    """
+    if not acquire_lease(SERIES_LEASE, SERIES_LEASE_SECONDS):
+        return 0
+    try:
+        horizon = timedelta(days=horizon_days or app.config['CLASS_SERIES_HORIZON_DAYS'])
+        created = 0
+        for series in ClassSeries.get_all(status='active'):
+            try:
+                created += series.materialize(horizon)
+            except Exception as e:
+                # Usually an admin creating the same series' first classes at the same moment
+                logger.warning(f"Materializing series {series.id} failed: {str(e)[:80]}")
+        return created
+    finally:
+        release_lease(SERIES_LEASE)
 
 class Booking:
     def __init__(self, id=None, user_id=None, class_id=None, booking_date=None, status='active'):
@@ -1234,6 +4076,9 @@ class Booking:
 
                 conn.commit()
 
+        occupancy_rollup.mark(self.class_id)
+        invalidation_bus.publish('catalog', self.class_id)
+        invalidation_bus.publish('calendar', self.user_id)
         return self.id
 
     def cancel(self):
@@ -1242,7 +4087,11 @@ class Booking:
             with db_cursor(conn) as cursor:
                 self.status = 'cancelled'
                 cursor.execute(convert_query("UPDATE Bookings SET status = 'cancelled' WHERE id = ?"), (self.id,))
+
                 conn.commit()
+        occupancy_rollup.mark(self.class_id)
+        invalidation_bus.publish('catalog', self.class_id)
+        invalidation_bus.publish('calendar', self.user_id)
         return True
 
     def to_dict(self):
@@ -1272,124 +4121,769 @@ class Booking:
                 encoded_location = location.replace(' ', '+')
                 google_maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
 
-        return {
-            'booking-id': self.id,
-            'class-id': self.class_id,
-            'class': class_name,
-            'teacher': instructor,
-            'date and time': formatted_date_time,
-            'booking-status': self.status,
-            'location': location,
-            'location_url': google_maps_url
-        }
+        return {
+            'booking-id': self.id,
+            'class-id': self.class_id,
+            'class': class_name,
+            'teacher': instructor,
+            'date and time': formatted_date_time,
+            'booking-status': self.status,
+            'location': location,
+            'location_url': google_maps_url
+        }
+
+    @classmethod
+    def get_by_id(cls, booking_id):
+        """Get a booking by ID"""
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("""
+                SELECT id, user_id, class_id, booking_date, status 
+                FROM Bookings 
+                WHERE id = ?
+                """), (booking_id,))
+                row = cursor.fetchone()
+
+        if row:
+            return cls(
+                id=row[0],
+                user_id=row[1],
+                class_id=row[2],
+                booking_date=row[3],  # Already converted to datetime
+                status=row[4]
+            )
+        return None
+
+    @staticmethod
+    def get_user_active_booking_rows(user_id):
+        """
+        Upcoming active bookings of a user as (id, user_id, class_id, booking_date, status,
+        class name, instructor, date_time, duration, location)
+        """
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                # Build database-specific query
+                if DB_CONFIG['type'] == 'sqlite':
+                    query = """
+                    SELECT 
+                        B.id, B.user_id, B.class_id, B.booking_date, B.status,
+                        YC.name, YC.instructor, YC.date_time, YC.duration, YC.location
+                    FROM Bookings B
+                    JOIN YogaClasses YC ON B.class_id = YC.id
+                    WHERE B.user_id = ? AND B.status = 'active' AND YC.date_time > datetime('now')
+                    ORDER BY YC.date_time
+                    """
+                else:
+                    query = """
+                    SELECT 
+                        B.id, B.user_id, B.class_id, B.booking_date, B.status,
+                        YC.name, YC.instructor, YC.date_time, YC.duration, YC.location
+                    FROM Bookings B
+                    JOIN YogaClasses YC ON B.class_id = YC.id
+                    WHERE B.user_id = ? AND B.status = 'active' AND YC.date_time > CURRENT_TIMESTAMP
+                    ORDER BY YC.date_time
+                    """
+
+                cursor.execute(convert_query(query), (user_id,))
+                return cursor.fetchall()
+
+    @classmethod
+    def get_user_active_bookings(cls, user_id):
+        """Get all active bookings for a user"""
+        try:
+            rows = cls.get_user_active_booking_rows(user_id)
+        except Exception as e:
+            logger.error(f"Error in get_user_active_bookings: {str(e)}")
+            return []
+
+        bookings = []
+        for row in rows:
+            # No datetime conversion needed - already datetime objects!
+            date_time = row[7]  # YC.date_time
+            duration = row[8]   # YC.duration
+
+            formatted_date_time = None
+            if date_time:
+                end_time = date_time + timedelta(minutes=duration)
+                start_str = date_time.strftime('%d/%m/%Y %H:%M')
+                end_str = end_time.strftime('%H:%M')
+                formatted_date_time = f"{start_str}-{end_str}"
+
+            # Google Maps URL
+            location = row[9]  # YC.location
+            google_maps_url = None
+            if location:
+                encoded_location = location.replace(' ', '+')
+                google_maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
+
+            booking_dict = {
+                'booking-id': row[0],     # B.id
+                'class-id': row[2],       # B.class_id
+                'class': row[5],          # YC.name
+                'teacher': row[6],        # YC.instructor
+                'date and time': formatted_date_time,
+                'booking-status': row[4], # B.status
+                'location': location,
+                'location_url': google_maps_url
+            }
+            bookings.append(booking_dict)
+
+        return bookings
+
+    @classmethod
+    def create_booking(cls, user_id, class_id):
+        """Create a new booking"""
+        booking = cls(
+            user_id=user_id,
+            class_id=class_id,
+            status='active'
+        )
+
+        booking_id = booking.save()
+        return booking_id
+
+# --------------------------------------
+# Maintenance
+# --------------------------------------
+
+def _select_ids_batch(cursor, where_clause, params, batch_size):
+    """Fetch up to batch_size ids from Users matching a condition"""
+    if DB_CONFIG['type'] == 'sqlserver':
+        query = f"SELECT TOP ({int(batch_size)}) U.id FROM Users U WHERE {where_clause}"
+    else:
+        query = f"SELECT U.id FROM Users U WHERE {where_clause} LIMIT {int(batch_size)}"
+    cursor.execute(convert_query(query), params)
+    return [row[0] for row in cursor.fetchall()]
+
+def clear_expired_legacy_tokens(batch_size, pause):
+    """Null out expired Users.verification_token/token_expiry values left from the old token scheme"""
+    cleared = 0
+    while True:
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                ids = _select_ids_batch(cursor, "U.token_expiry < ?", (datetime.utcnow(),), batch_size)
+                if ids:
+                    placeholders = ', '.join('?' for _ in ids)
+                    cursor.execute(convert_query(f"""
+                    UPDATE Users SET verification_token = NULL, token_expiry = NULL
+                    WHERE id IN ({placeholders})
+                    """), ids)
+                conn.commit()
+        cleared += len(ids)
+        if len(ids) < batch_size:
+            return cleared
+        time.sleep(pause)
+
+def remove_stale_unverified_users(grace, action, batch_size, pause):
+    """
+    Delete (or archive, then delete) unverified accounts whose last verification link
+    expired more than `grace` ago. Accounts with bookings are never touched.
+    """
+    is_verified_value = False if DB_CONFIG['type'] == 'postgresql' else 0
+    where_clause = """
+        U.is_verified = ?
+        AND NOT EXISTS (
+            SELECT 1 FROM AuthTokens T
+            WHERE T.user_id = U.id AND T.purpose = ? AND T.expires_at > ?
+        )
+        AND NOT EXISTS (SELECT 1 FROM Bookings B WHERE B.user_id = U.id)
+    """
+    removed = 0
+    while True:
+        cutoff = datetime.utcnow() - grace
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                ids = _select_ids_batch(cursor, where_clause,
+                                        (is_verified_value, AuthToken.PURPOSE_VERIFY, cutoff), batch_size)
+                deleted = 0
+                if ids:
+                    # The predicate is checked again: a user may have verified, booked or asked for a new
+                    # link since the SELECT. Their tokens go with them (ON DELETE CASCADE).
+                    placeholders = ', '.join('?' for _ in ids)
+                    matching = f"U.id IN ({placeholders}) AND {where_clause}"
+                    params = (*ids, is_verified_value, AuthToken.PURPOSE_VERIFY, cutoff)
+                    if action == 'archive' and DB_CONFIG['type'] == 'postgresql':
+                        cursor.execute(convert_query(f"""
+                        WITH removed AS (
+                            DELETE FROM Users U WHERE {matching}
+                            RETURNING U.id, U.name, U.surname, U.email
+                        )
+                        INSERT INTO ArchivedUsers (user_id, name, surname, email)
+                        SELECT id, name, surname, email FROM removed
+                        """), params)
+                        deleted = cursor.rowcount
+                    elif action == 'archive' and DB_CONFIG['type'] == 'sqlserver':
+                        cursor.execute(f"""
+                        DELETE U
+                        OUTPUT deleted.id, deleted.name, deleted.surname, deleted.email
+                        INTO ArchivedUsers (user_id, name, surname, email)
+                        FROM Users U WHERE {matching}
+                        """, params)
+                        cursor.execute("SELECT @@ROWCOUNT")
+                        deleted = cursor.fetchone()[0]
+                    else:
+                        if action == 'archive':
+                            # SQLite: this INSERT takes the write lock, so the rows can't change before the DELETE
+                            cursor.execute(f"""
+                            INSERT INTO ArchivedUsers (user_id, name, surname, email)
+                            SELECT U.id, U.name, U.surname, U.email FROM Users U WHERE {matching}
+                            """, params)
+                        cursor.execute(convert_query(f"""
+                        DELETE FROM Users WHERE id IN (SELECT U.id FROM Users U WHERE {matching})
+                        """), params)
+                        if DB_CONFIG['type'] == 'sqlserver':
+                            cursor.execute("SELECT @@ROWCOUNT")
+                            deleted = cursor.fetchone()[0]
+                        else:
+                            deleted = cursor.rowcount
+                conn.commit()
+        removed += deleted
+        if len(ids) < batch_size:
+            return removed
+        time.sleep(pause)
+
+def run_maintenance(action=None):
+    """
+    Sweep expired tokens and stale unverified accounts in small batches with pauses in between,
+    then create the next classes of recurring series. Returns a report of what was done.
+    """
+    start_time = time.time()
+    batch_size = app.config['MAINTENANCE_BATCH_SIZE']
+    pause = app.config['MAINTENANCE_BATCH_PAUSE']
+    grace = timedelta(days=app.config['UNVERIFIED_ACCOUNT_GRACE_DAYS'])
+    action = action or app.config['UNVERIFIED_ACCOUNT_ACTION']
+
+    report = {'unverified_users_action': action}
+    # Users go first: their grace period is measured against verification tokens that are still on file
+    report['unverified_users_removed'] = remove_stale_unverified_users(grace, action, batch_size, pause)
+    if report['unverified_users_removed']:
+        invalidation_bus.publish('user')
+    report['expired_tokens_purged'] = AuthToken.purge_expired(batch_size=batch_size, pause=pause, older_than=grace)
+    report['legacy_tokens_cleared'] = clear_expired_legacy_tokens(batch_size, pause)
+    report['cache_invalidations_purged'] = invalidation_bus.purge(timedelta(hours=1))
+    report['series_classes_created'] = materialize_class_series()
+    report['occupancy_classes_refreshed'] = occupancy_rollup.catch_up(batch_size, pause)
+    report['duration'] = round(time.time() - start_time, 2)
+    return report
+
+# --------------------------------------
+# Health checks
+# --------------------------------------
+
+class DatabaseHealthProbe:
+    """
+    Probes the database from a background thread and caches the outcome,
+    so /readyz answers from memory no matter how often the load balancer asks
+    or how long a paused database takes to wake up.
+    Requests and keepalive pings that reached the database count as successful probes. A real
+    SELECT 1 is only sent when that evidence is missing or bad, so an idle serverless database
+    can still auto-pause.
+    """
+
+    def __init__(self, pool, interval, max_age):
+        self.pool = pool
+        self.interval = interval
+        self.max_age = max_age
+        self.last_success = None
+        self.last_attempt = None
+        self.last_latency = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.in_progress_since = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _pool_is_healthy(self):
+        """True when the pool's own traffic already shows the database answering"""
+        success, failure = self.pool.last_success, self.pool.last_failure
+        if success is None or (failure is not None and failure >= success):
+            return False
+        # A recent good checkout, or nothing has touched the pool since its last good one
+        return success >= self.pool.last_used or time.monotonic() - success < self.interval
+
+    def probe(self):
+        """Reuse the pool's latest outcome, or run one constant-cost round-trip and record the result"""
+        if self._pool_is_healthy():
+            self.last_success = time.time()
+            self.last_error = None
+            self.consecutive_failures = 0
+            return
+        started = time.time()
+        self.in_progress_since = started
+        try:
+            connection_pool.check()
+            self.last_latency = time.time() - started
+            self.last_success = time.time()
+            self.last_error = None
+            self.consecutive_failures = 0
+        except Exception as e:
+            self.last_error = str(e)[:200]
+            self.consecutive_failures += 1
+            logger.warning(f"Database health probe failed ({self.consecutive_failures} in a row): {str(e)[:80]}")
+        finally:
+            self.last_attempt = started
+            self.in_progress_since = None
+
+    def start(self):
+        def run():
+            self.probe()
+            while not self._stop_event.wait(self.interval):
+                self.probe()
+
+        self._thread = threading.Thread(target=run, name='db-health-probe', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_status(self):
+        """Readiness verdict from cached state only - never touches the database"""
+        now = time.time()
+        age = now - self.last_success if self.last_success is not None else None
+        return {
+            'database_ok': age is not None and age <= self.max_age,
+            'last_success_age': round(age, 1) if age is not None else None,
+            'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            'last_error': self.last_error,
+            'consecutive_failures': self.consecutive_failures,
+            'probe_running_for': round(now - self.in_progress_since, 1) if self.in_progress_since else None
+        }
+
+health_probe = DatabaseHealthProbe(
+    connection_pool,
+    interval=app.config['HEALTH_PROBE_INTERVAL'],
+    max_age=app.config['HEALTH_PROBE_MAX_AGE']
+)
+
+# --------------------------------------
+# iCalendar feeds
+# --------------------------------------
+
+def ics_escape(text):
+    """Escape a TEXT value (RFC 5545 3.3.11)"""
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def fold_ics_line(line):
+    """Split a content line into 75-octet chunks joined by CRLF + space"""
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    chunks = []
+    current = ''
+    for char in line:
+        limit = 75 if not chunks else 74
+        if len((current + char).encode('utf-8')) > limit:
+            chunks.append(current)
+            current = char
+        else:
+            current += char
+    chunks.append(current)
+    return '\r\n '.join(chunks)
+
+def ics_datetime(value):
+    # Floating local time: clients show it as studio wall-clock time
+    return value.strftime('%Y%m%dT%H%M%S')
+
+@functools.lru_cache(maxsize=4096)
+def render_vevent(class_id, name, instructor, date_time, duration, location):
+    """
+    One VEVENT, cached by its content so rebuilding a feed only renders classes that changed.
+    The UID is the class, so a class moved or renamed updates in place in the user's calendar.
+    """
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:class-{class_id}@yoga-booking",
+        f"DTSTAMP:{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}",
+        f"DTSTART:{ics_datetime(date_time)}",
+        f"DTEND:{ics_datetime(date_time + timedelta(minutes=duration))}",
+        f"SUMMARY:{ics_escape(name)}",
+        f"DESCRIPTION:{ics_escape(f'Teacher: {instructor}')}",
+        f"LOCATION:{ics_escape(location)}",
+        'END:VEVENT'
+    ]
+    return '\r\n'.join(fold_ics_line(line) for line in lines)
+
+def render_calendar(title, events):
+    """A VCALENDAR document from rendered VEVENTs"""
+    max_age = app.config['CALENDAR_MAX_AGE']
+    header = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Yoga Booking System//Calendar//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f"X-WR-CALNAME:{ics_escape(title)}",
+        f"X-WR-TIMEZONE:{app.config['CALENDAR_TIMEZONE']}",
+        # Polling hints: ask clients not to refresh more often than we'd serve a new feed
+        f"REFRESH-INTERVAL;VALUE=DURATION:PT{max(1, max_age // 60)}M",
+        f"X-PUBLISHED-TTL:PT{max(1, max_age // 60)}M"
+    ]
+    body = '\r\n'.join([fold_ics_line(line) for line in header] + list(events) + ['END:VCALENDAR'])
+    return (body + '\r\n').encode('utf-8')
+
+class CalendarFeedCache:
+    """
+    Rendered feeds keyed by 'studio' or a user id. Each feed remembers the versions it was built from:
+    the schedule version moves when any class changes, a user's version when their bookings do.
+    A feed is reused until one of its versions moves, and stale builds are never stored.
+    Users' link revisions are kept here too, so a poll that ends in 304 never touches the database.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._schedule_version = 0
+        self._user_versions = {}
+        self._revisions = collections.OrderedDict()
+        self._revision_generation = 0
+        self._lock = threading.Lock()
+
+    def version(self, key):
+        return self._schedule_version, 0 if key == 'studio' else self._user_versions.get(key, 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.version(key):
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def build(self, key, render):
+        """Render a feed and cache it with its ETag; concurrent builds of the same version are shared"""
+        version = self.version(key)
+
+        def run():
+            body = render()
+            feed = (CachedPayload(body, 'text/calendar'), hashlib.sha1(body).hexdigest()[:20])
+            with self._lock:
+                if self.version(key) == version:
+                    self._entries[key] = (version, feed)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return feed
+
+        return single_flight.do(('calendar', key, version), run)
+
+    def invalidate(self, key=None):
+        """A user id: that user's bookings changed. None: the schedule changed, every feed is stale"""
+        with self._lock:
+            if key is None:
+                self._schedule_version += 1
+            else:
+                self._user_versions[key] = self._user_versions.get(key, 0) + 1
+
+    def revision(self, user_id, load):
+        """A user's link revision, loaded once and kept until forget_revision(user_id)"""
+        with self._lock:
+            if user_id in self._revisions:
+                self._revisions.move_to_end(user_id)
+                return self._revisions[user_id]
+            generation = self._revision_generation
+        revision = load(user_id)
+        with self._lock:
+            # A revoke that landed while loading wins over what we read
+            if self._revision_generation == generation:
+                self._revisions[user_id] = revision
+                while len(self._revisions) > self.max_entries:
+                    self._revisions.popitem(last=False)
+        return revision
+
+    def forget_revision(self, user_id=None):
+        """A user id: that user's links were revoked. None: forget every revision"""
+        with self._lock:
+            self._revision_generation += 1
+            if user_id is None:
+                self._revisions.clear()
+            else:
+                self._revisions.pop(user_id, None)
+
+calendar_feeds = CalendarFeedCache(app.config['CALENDAR_CACHE_SIZE'])
+invalidation_bus.subscribe('calendar', calendar_feeds.invalidate)
+invalidation_bus.subscribe('calendar-link', calendar_feeds.forget_revision)
+
+def render_studio_calendar():
+    events = [render_vevent(row[0], row[1], row[2], row[3], row[4], row[7])
+              for row in YogaClass.get_future_active_rows()]
+    return render_calendar(app.config['CALENDAR_NAME'], events)
+
+def render_user_calendar(user_id):
+    events = [render_vevent(row[2], row[5], row[6], row[7], row[8], row[9])
+              for row in Booking.get_user_active_booking_rows(user_id)]
+    return render_calendar(f"{app.config['CALENDAR_NAME']} - my bookings", events)
+
+def calendar_serializer():
+    return URLSafeSerializer(app.config['SECRET_KEY'], salt='calendar-feed')
+
+def calendar_revision(user_id):
+    """
+    Current revision of a user's feed links, or None if there's no such user; links signed with an
+    older revision are revoked. Read through calendar_feeds.revision(), which caches it.
+    """
+    with db_connection() as conn:
+        with db_cursor(conn) as cursor:
+            cursor.execute(convert_query("""
+            SELECT COALESCE(K.revision, 0)
+            FROM Users U
+            LEFT JOIN CalendarKeys K ON K.user_id = U.id
+            WHERE U.id = ?
+            """), (user_id,))
+            row = cursor.fetchone()
+    return row[0] if row else None
+
+def revoke_calendar_links(cursor, user_id):
+    """
+    Bump the user's link revision inside the caller's transaction.
+    After committing, the caller publishes 'calendar-link' with the user id so every worker drops its cached revision.
+    """
+    params = (user_id, user_id) if DB_CONFIG['type'] == 'sqlserver' else (user_id,)
+    cursor.execute(SQL_QUERIES['bump_calendar_revision'], params)
+
+def calendar_feed_response(key, render, private):
+    """Serve a cached feed, answering 304 when the client already has this version"""
+    feed = calendar_feeds.get(key) or calendar_feeds.build(key, render)
+    payload, etag = feed
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = payload.to_response()
+    # Weak: the same feed may be sent gzip- or brotli-encoded
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = f"{'private' if private else 'public'}, max-age={app.config['CALENDAR_MAX_AGE']}"
+    return response
+
+# --------------------------------------
+# Occupancy analytics
+# --------------------------------------
 
-    @classmethod
-    def get_by_id(cls, booking_id):
-        """Get a booking by ID"""
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                SELECT id, user_id, class_id, booking_date, status 
-                FROM Bookings 
-                WHERE id = ?
-                """), (booking_id,))
-                row = cursor.fetchone()
+class OccupancyRollup:
+    """
+    Keeps the ClassOccupancy (one row per class) and DailyOccupancy (day x instructor x location)
+    summary tables up to date, so reports never scan Bookings.
+    Booking and class changes only mark the class dirty in memory; a background thread recomputes
+    the dirty classes in one batch every flush_interval seconds, off the request path, and backs off
+    while the database is busy (a locked SQLite file) instead of piling up writers.
+    catch_up() recomputes every class from the watermark on, covering changes made by workers that
+    died before flushing; classes older than the settle window are final and leave the window.
+    It runs from the maintenance sweep, one process at a time (a lease row in RollupWatermarks).
+    """
 
-        if row:
-            return cls(
-                id=row[0],
-                user_id=row[1],
-                class_id=row[2],
-                booking_date=row[3],  # Already converted to datetime
-                status=row[4]
-            )
-        return None
+    WATERMARK = 'occupancy'
+    LEASE = 'occupancy-lease'
+    LEASE_SECONDS = 900  # A process that dies mid catch-up blocks the next one for at most this long
+    BATCH_SIZE = 500
+    MAX_BACKOFF = 32  # Times flush_interval
+
+    def __init__(self, flush_interval, settle):
+        self.flush_interval = flush_interval
+        self.settle = settle
+        self.last_flush = None
+        self._dirty = set()
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
 
-    @classmethod
-    def get_user_active_bookings(cls, user_id):
-        """Get all active bookings for a user"""
+    def mark(self, *class_ids):
+        """Note classes whose bookings or details changed"""
+        with self._lock:
+            self._dirty.update(class_id for class_id in class_ids if class_id is not None)
+
+    def flush(self):
+        """Recompute the classes marked since the last flush; returns how many"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
         try:
-            with db_connection_with_retry() as conn:
+            self.refresh(dirty)
+        except Exception as e:
+            # Keep them for the next round, which comes later the more rounds have failed
+            self.mark(*dirty)
+            self._failures += 1
+            logger.warning(f"Occupancy rollup failed for {len(dirty)} classes, retrying in "
+                           f"{self._next_wait():.0f}s: {str(e)[:80]}")
+            return 0
+        self._failures = 0
+        self.last_flush = datetime.now()
+        return len(dirty)
+
+    def _next_wait(self):
+        return self.flush_interval * min(2 ** self._failures, self.MAX_BACKOFF)
+
+    def refresh(self, class_ids, batch_size=None, pause=0):
+        """
+        Recompute ClassOccupancy for these classes and DailyOccupancy for every day they touch.
+        Each batch is its own transaction; pause sleeps between batches so requests get the database.
+        """
+        class_ids = sorted(class_ids)
+        batch_size = batch_size or self.BATCH_SIZE
+        for start in range(0, len(class_ids), batch_size):
+            if start and pause:
+                time.sleep(pause)
+            batch = class_ids[start:start + batch_size]
+            marks = ', '.join(['?'] * len(batch))
+            with db_connection() as conn:
                 with db_cursor(conn) as cursor:
-                    # Build database-specific query
-                    if DB_CONFIG['type'] == 'sqlite':
-                        query = """
-                        SELECT 
-                            B.id, B.user_id, B.class_id, B.booking_date, B.status,
-                            YC.name, YC.instructor, YC.date_time, YC.duration, YC.location
-                        FROM Bookings B
-                        JOIN YogaClasses YC ON B.class_id = YC.id
-                        WHERE B.user_id = ? AND B.status = 'active' AND YC.date_time > datetime('now')
-                        ORDER BY YC.date_time
-                        """
-                    else:
-                        query = """
-                        SELECT 
-                            B.id, B.user_id, B.class_id, B.booking_date, B.status,
-                            YC.name, YC.instructor, YC.date_time, YC.duration, YC.location
-                        FROM Bookings B
-                        JOIN YogaClasses YC ON B.class_id = YC.id
-                        WHERE B.user_id = ? AND B.status = 'active' AND YC.date_time > CURRENT_TIMESTAMP
-                        ORDER BY YC.date_time
-                        """
-
-                    cursor.execute(convert_query(query), (user_id,))
-                    rows = cursor.fetchall()
+                    cursor.execute(convert_query(f"""
+                    SELECT YC.id, YC.date_time, YC.instructor, YC.location, YC.capacity, YC.status,
+                        COUNT(CASE WHEN B.status = 'active' THEN 1 ELSE NULL END),
+                        COUNT(CASE WHEN B.status = 'cancelled' THEN 1 ELSE NULL END)
+                    FROM YogaClasses YC
+                    LEFT JOIN Bookings B ON B.class_id = YC.id
+                    WHERE YC.id IN ({marks})
+                    GROUP BY YC.id, YC.date_time, YC.instructor, YC.location, YC.capacity, YC.status
+                    """), batch)
+                    rows = [(row[0], row[1].strftime('%Y-%m-%d'), row[2], row[3], row[4], row[5] or 'active', row[6], row[7])
+                            for row in cursor.fetchall()]
+
+                    # A class that moved also changes the day it left
+                    cursor.execute(convert_query(f"SELECT DISTINCT class_day FROM ClassOccupancy WHERE class_id IN ({marks})"),
+                                   batch)
+                    days = {row[0] for row in cursor.fetchall()} | {row[1] for row in rows}
+
+                    cursor.execute(convert_query(f"DELETE FROM ClassOccupancy WHERE class_id IN ({marks})"), batch)
+                    if rows:
+                        cursor.executemany(convert_query("""
+                        INSERT INTO ClassOccupancy
+                            (class_id, class_day, instructor, location, capacity, class_status, booked, cancelled)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        """), rows)
+                    self._rebuild_days(cursor, sorted(days))
+                    conn.commit()
 
-                    bookings = []
-                    for row in rows:
-                        # No datetime conversion needed - already datetime objects!
-                        date_time = row[7]  # YC.date_time
-                        duration = row[8]   # YC.duration
-
-                        formatted_date_time = None
-                        if date_time:
-                            end_time = date_time + timedelta(minutes=duration)
-                            start_str = date_time.strftime('%d/%m/%Y %H:%M')
-                            end_str = end_time.strftime('%H:%M')
-                            formatted_date_time = f"{start_str}-{end_str}"
-
-                        # Google Maps URL
-                        location = row[9]  # YC.location
-                        google_maps_url = None
-                        if location:
-                            encoded_location = location.replace(' ', '+')
-                            google_maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
-
-                        booking_dict = {
-                            'booking-id': row[0],     # B.id
-                            'class-id': row[2],       # B.class_id
-                            'class': row[5],          # YC.name
-                            'teacher': row[6],        # YC.instructor
-                            'date and time': formatted_date_time,
-                            'booking-status': row[4], # B.status
-                            'location': location,
-                            'location_url': google_maps_url
-                        }
-                        bookings.append(booking_dict)
-
-                return bookings
-        except Exception as e:
-            print(f"Error in get_user_active_bookings: {str(e)}")
-            return []
+    @staticmethod
+    def _rebuild_days(cursor, days):
+        for start in range(0, len(days), OccupancyRollup.BATCH_SIZE):
+            batch = days[start:start + OccupancyRollup.BATCH_SIZE]
+            marks = ', '.join(['?'] * len(batch))
+            cursor.execute(convert_query(f"DELETE FROM DailyOccupancy WHERE day IN ({marks})"), batch)
+            cursor.execute(convert_query(f"""
+            INSERT INTO DailyOccupancy
+                (day, instructor, location, classes, cancelled_classes, capacity, booked, cancelled)
+            SELECT class_day, instructor, location,
+                SUM(CASE WHEN class_status <> 'cancelled' THEN 1 ELSE 0 END),
+                SUM(CASE WHEN class_status = 'cancelled' THEN 1 ELSE 0 END),
+                SUM(CASE WHEN class_status <> 'cancelled' THEN capacity ELSE 0 END),
+                SUM(booked),
+                SUM(cancelled)
+            FROM ClassOccupancy
+            WHERE class_day IN ({marks})
+            GROUP BY class_day, instructor, location
+            """), batch)
+
+    def catch_up(self, batch_size=None, pause=0):
+        """
+        Recompute every class at or after the watermark, then move the watermark up; returns how many.
+        Returns 0 without doing anything while another process holds the lease.
+        """
+        if not acquire_lease(self.LEASE, self.LEASE_SECONDS):
+            return 0
+        try:
+            return self._catch_up(batch_size, pause)
+        finally:
+            release_lease(self.LEASE)
 
-    @classmethod
-    def create_booking(cls, user_id, class_id):
-        """Create a new booking"""
-        booking = cls(
-            user_id=user_id,
-            class_id=class_id,
-            status='active'
-        )
+    def _catch_up(self, batch_size, pause):
+        with db_connection() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query("SELECT watermark FROM RollupWatermarks WHERE name = ?"), (self.WATERMARK,))
+                row = cursor.fetchone()
+                watermark = row[0] if row else None
+                # Without a watermark this is the first run: backfill everything
+                if watermark is None:
+                    cursor.execute("SELECT id FROM YogaClasses")
+                else:
+                    cursor.execute(convert_query("SELECT id FROM YogaClasses WHERE date_time >= ?"), (watermark,))
+                class_ids = [row[0] for row in cursor.fetchall()]
 
-        booking_id = booking.save()
-        return booking_id
+        started = datetime.now()
+        self.refresh(class_ids, batch_size, pause)
+        new_watermark = started - self.settle
+        if watermark is None or new_watermark > watermark:
+            with db_connection() as conn:
+                with db_cursor(conn) as cursor:
+                    cursor.execute(convert_query("DELETE FROM RollupWatermarks WHERE name = ?"), (self.WATERMARK,))
+                    cursor.execute(convert_query("INSERT INTO RollupWatermarks (name, watermark) VALUES (?, ?)"),
+                                   (self.WATERMARK, new_watermark))
+                    conn.commit()
+        self.last_flush = started
+        return len(class_ids)
+
+    def query(self, start_day=None, end_day=None):
+        """DailyOccupancy rows between two 'YYYY-MM-DD' days (inclusive)"""
+        clauses, params = [], []
+        if start_day:
+            clauses.append("day >= ?")
+            params.append(start_day)
+        if end_day:
+            clauses.append("day <= ?")
+            params.append(end_day)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                cursor.execute(convert_query(f"""
+                SELECT day, instructor, location, classes, cancelled_classes, capacity, booked, cancelled
+                FROM DailyOccupancy {where}
+                ORDER BY day
+                """), params)
+                return cursor.fetchall()
+
+    def start(self):
+        """Flush this worker's marks periodically; the catch-up is left to the maintenance sweep"""
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.wait(self._next_wait()):
+                self.flush()
+
+        if self.flush_interval > 0:
+            threading.Thread(target=run, name='occupancy-rollup', daemon=True).start()
+
+    def stop(self):
+        self._stop_event.set()
+
+occupancy_rollup = OccupancyRollup(
+    flush_interval=app.config['ROLLUP_FLUSH_INTERVAL'],
+    settle=timedelta(days=app.config['ROLLUP_SETTLE_DAYS'])
+)
+
+STATS_GROUPS = {
+    'day': lambda row: row[0],
+    'month': lambda row: row[0][:7],
+    'instructor': lambda row: row[1],
+    'location': lambda row: row[2]
+}
+
+def summarize_occupancy(rows, group_by):
+    """Fold DailyOccupancy rows into one line per group with fill and cancellation rates"""
+    groups = collections.OrderedDict()
+    for row in rows:
+        key = tuple(STATS_GROUPS[name](row) for name in group_by)
+        totals = groups.setdefault(key, [0, 0, 0, 0, 0])
+        for index, value in enumerate(row[3:8]):
+            totals[index] += value or 0
+
+    summary = []
+    for key, (classes, cancelled_classes, capacity, booked, cancelled) in groups.items():
+        entry = dict(zip(group_by, key))
+        entry.update({
+            'classes': classes,
+            'cancelled_classes': cancelled_classes,
+            'capacity': capacity,
+            'bookings': booked,
+            'cancellations': cancelled,
+            'fill_rate': round(booked / capacity, 3) if capacity else None,
+            'cancellation_rate': round(cancelled / (booked + cancelled), 3) if booked + cancelled else None
+        })
+        summary.append(entry)
+    return summary
 
 # --------------------------------------
 # Route Definitions
 # --------------------------------------
 
 @app.route('/users', methods=['POST'])
+@rate_limited('signup')
 def create_user():
     data = request.get_json()
 
@@ -1424,6 +4918,8 @@ def create_user():
             'message': 'User created! Please check your email to verify your account.',
             'id': new_user.id
         }), 201
+    except PasswordHashingBusy:
+        return password_hashing_busy_response()
     except Exception as e:
         return jsonify({'error': f'Could not create user: {str(e)}'}), 400
 
@@ -1432,10 +4928,6 @@ def send_verification_email(user):
     """
     Send verification email via Resend
     """
-    # Set API key
-    resend.api_key = os.getenv("RESEND_API_KEY")
-    print(resend.api_key)
-
     # Use environment variable for base URL if set, otherwise use request URL
     base_url = os.getenv("BASE_URL", request.host_url)
     if not base_url.endswith('/'):
@@ -1579,53 +5071,165 @@ def send_verification_email(user):
             ]
         }
 
-        email_response = resend.Emails.send(params)
+        if app.config['EMAIL_BACKEND'] == 'console':
+            logger.info(f"Verification email for {user.email} not sent (console backend): {verification_link}")
+            record_email('verification', 'skipped', 0.0)
+            return True
+
+        import resend
+        resend.api_key = os.getenv("RESEND_API_KEY")
 
-        print(f"------- RESEND EMAIL SENT -------")
-        print(f"To: {user.email}")
-        print(f"Subject: 🧘‍♀️ Welcome {user.name}! Please verify your email")
-        print(f"Email ID: {email_response.get('id', 'N/A')}")
-        print(f"Verification link: {verification_link}")
-        print(f"------- EMAIL SENT SUCCESSFULLY -------")
+        send_start = time.perf_counter()
+        try:
+            email_response = resend.Emails.send(params)
+        except Exception:
+            record_email('verification', 'failed', time.perf_counter() - send_start)
+            raise
+        record_email('verification', 'sent', time.perf_counter() - send_start)
+
+        logger.info("Verification email sent", extra={
+            'to': user.email,
+            'email_id': email_response.get('id', 'N/A')
+        })
 
         return True
 
     except Exception as e:
-        print(f"❌ Resend error: {str(e)}")
+        logger.error(f"❌ Resend error: {str(e)}")
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.get_user_by_id(int(user_id))
+# --------------------------------------
+# Server-rendered page templates
+# --------------------------------------
 
-@app.route('/verify/<token>', methods=['GET'])
-def verify_email(token):
-    user = User.get_user_by_token(token)
-
-    if not user:
-        return render_template_string("""
-            <h1>Invalid verification link</h1>
-            <p>The verification link is invalid or has expired.</p>
-            <p><a href="/">Return to homepage</a></p>
-        """)
-
-    # No datetime conversion needed - token_expiry is already a datetime object!
-    if user.token_expiry and user.token_expiry < datetime.utcnow():
-        return render_template_string("""
-            <h1>Expired verification link</h1>
-            <p>The verification link has expired. Please request a new one.</p>
-            <p><a href="/resend-verification?email={{user.email}}">Resend verification email</a></p>
-            <p><a href="/">Return to homepage</a></p>
-        """)
-
-    user.update_verification_status()
-
-    return render_template_string("""
+# Inline pages served by the verification and password reset links.
+# File-backed templates are stored as ('file', path) and read once at load time.
+PAGE_TEMPLATES = {
+    'verify_invalid': """
+        <h1>Invalid verification link</h1>
+        <p>The verification link is invalid or has expired.</p>
+        <p><a href="/">Return to homepage</a></p>
+    """,
+    'verify_expired': """
+        <h1>Expired verification link</h1>
+        <p>The verification link has expired. Please request a new one.</p>
+        <form method="post" action="/resend-verification">
+            <input type="hidden" name="token" value="{{ token }}">
+            <button type="submit">Resend verification email</button>
+        </form>
+        <p><a href="/">Return to homepage</a></p>
+    """,
+    'verify_success': """
         <h1>Email verified successfully!</h1>
         <p>Your email has been verified. You can now log in to your account.</p>
         <p><a href="/">Return to homepage</a></p>
-    """)
+    """,
+    'reset_invalid': """
+        <h1>Invalid or Expired Link</h1>
+        <p>The password reset link is invalid or has already been used/expired.</p>
+        <p><a href="/">Return to homepage</a></p>
+    """,
+    'reset_expired': """
+        <h1>Link Expired</h1>
+        <p>The password reset link has expired. Please request a new one.</p>
+        <p><a href="/request-password-reset">Request New Password Reset Link</a></p>
+    """,
+    'reset_error': """
+        <h1>Error</h1>
+        <p>An unexpected error occurred. Please try again later.</p>
+        <p><a href="/">Return to homepage</a></p>
+    """,
+    'reset_form': ('file', 'static/reset_password.html'),
+}
+
+class TemplateRegistry:
+    """
+    Compiles the server-rendered pages once and keeps the compiled templates in memory,
+    so a click on a verification or reset link never re-parses Jinja source.
+    """
+
+    def __init__(self, jinja_env, sources):
+        self.jinja_env = jinja_env
+        self.sources = sources
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _read_source(self, source):
+        """Resolve a template source, reading file-backed templates from disk"""
+        if isinstance(source, tuple) and source[0] == 'file':
+            with open(os.path.join(root_dir(), source[1]), encoding='utf-8') as f:
+                return f.read()
+        return source
+
+    def _compile(self, name):
+        return self.jinja_env.from_string(self._read_source(self.sources[name]))
+
+    def load(self):
+        """Compile every registered template (startup warm-up)"""
+        start_time = time.time()
+        compiled = {}
+        for name in self.sources:
+            try:
+                compiled[name] = self._compile(name)
+            except Exception as e:
+                logger.error(f"Template '{name}' failed to compile: {e}")
+        with self._lock:
+            self._templates.update(compiled)
+        logger.info(f"Compiled {len(compiled)} page templates in {(time.time() - start_time) * 1000:.1f}ms")
+        return len(compiled)
+
+    def get(self, name):
+        """Get a compiled template, compiling it on first use if warm-up missed it"""
+        template = self._templates.get(name)
+        if template is None:
+            with self._lock:
+                template = self._templates.get(name)
+                if template is None:
+                    template = self._compile(name)
+                    self._templates[name] = template
+        return template
+
+    def render(self, name, **context):
+        """Render a compiled template within the current Flask request context"""
+        return render_template(self.get(name), **context)
+
+template_registry = TemplateRegistry(app.jinja_env, PAGE_TEMPLATES)
+
+@app.route('/verify/<token>', methods=['GET'])
+def verify_email(token):
+    # Signature and expiry are checked before any database work (legacy unsigned links aside)
+    claims = AuthToken.resolve(token, AuthToken.PURPOSE_VERIFY)
+    if not claims:
+        return template_registry.render('verify_invalid')
+
+    user_id, expires_at = claims
+    if expires_at < datetime.utcnow():
+        # No lookup here: the user is only loaded if they ask for a new link
+        return template_registry.render('verify_expired', token=token)
+
+    # Consume the token and mark the user verified in one transaction
+    try:
+        with db_connection_with_retry() as conn:
+            with db_cursor(conn) as cursor:
+                result = AuthToken.consume(cursor, token, AuthToken.PURPOSE_VERIFY)
+                if result:
+                    # Use TRUE for PostgreSQL, 1 for others
+                    is_verified_value = True if DB_CONFIG['type'] == 'postgresql' else 1
+                    cursor.execute(convert_query("UPDATE Users SET is_verified = ? WHERE id = ?"),
+                                   (is_verified_value, result[0]))
+                conn.commit()
+    except Exception as e:
+        logger.error(f"Error in verify_email: {str(e)}")
+        result = None
+
+    # Already used, or replaced by a newer verification email
+    if not result:
+        return template_registry.render('verify_invalid')
+    invalidation_bus.publish('user', result[0])
+
+    return template_registry.render('verify_success')
 
 @app.route('/login', methods=['POST'])
+@rate_limited('login')
 def login():
     """
     Enhanced login route with database resume awareness.
@@ -1634,7 +5238,7 @@ def login():
 
     try:
         login_start = time.time()
-        print(f"Login attempt for: {data['email']}")
+        logger.info("Login attempt", extra={'email': data['email'], 'sample': app.config['LOG_SAMPLE_RATE']})
 
         # Try to get user with resume retry logic
         user = User.get_user_by_email(data['email'])
@@ -1643,7 +5247,7 @@ def login():
 
         # Provide different messages based on timing
         if login_time > 15:
-            print(f"Extended login time: {login_time:.1f}s (likely database resume)")
+            logger.warning(f"Extended login time: {login_time:.1f}s (likely database resume)")
 
         if not user:
             return jsonify({'error': 'Invalid email or password'}), 401
@@ -1654,6 +5258,8 @@ def login():
         if not user.is_verified:
             return jsonify({'error': 'Please verify your email before logging in', 'unverified': True}), 401
 
+        user.rehash_password_if_needed(data['password'])
+
         session.permanent = True
         login_user(user)
 
@@ -1664,6 +5270,8 @@ def login():
 
         return jsonify(response_data), 200
 
+    except PasswordHashingBusy:
+        return password_hashing_busy_response()
     except Exception as e:
         error_msg = str(e).lower()
 
@@ -1674,7 +5282,7 @@ def login():
                 'retry_suggested': True
             }), 503
 
-        print(f"Login error: {str(e)}")
+        logger.error(f"Login error: {str(e)}")
         return jsonify({'error': 'Login service temporarily unavailable. Please try again.'}), 503
 
 @app.route('/logout', methods=['POST'])
@@ -1700,21 +5308,34 @@ def get_users():
     return jsonify(users)
 
 # Yoga class routes - Updated to use OO YogaClass
+def class_from_payload(data):
+    """
+    Build a YogaClass from an API payload; raises KeyError/ValueError on bad input.
+    Status is left as None when the payload has none, so an update keeps the stored one.
+    """
+    date_format = "%d/%m/%Y %H:%M"
+    status = data.get('status')
+    if status is not None and status not in YogaClass.STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(YogaClass.STATUSES)}")
+    return YogaClass(
+        id=data.get('id'),
+        name=data['name'],
+        instructor=data['instructor'],
+        date_time=datetime.strptime(data['date_time'], date_format),
+        duration=data.get('duration', 75),
+        capacity=data['capacity'],
+        status=status,
+        location=data.get('location')
+    )
+
 @app.route('/classes', methods=['POST'])
 def create_class():
     data = request.get_json()
 
     try:
         # Create a new YogaClass instance
-        date_format = "%d/%m/%Y %H:%M"
-        yoga_class = YogaClass(
-            name=data['name'],
-            instructor=data['instructor'],
-            date_time=datetime.strptime(data['date_time'], date_format),
-            duration=data.get('duration', 75),
-            capacity=data['capacity'],
-            location=data.get('location')
-        )
+        yoga_class = class_from_payload(dict(data, id=None))
+        yoga_class.status = yoga_class.status or 'active'
 
         # Save it to the database
         class_id = yoga_class.save()
@@ -1723,9 +5344,125 @@ def create_class():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/classes/bulk', methods=['POST'])
+def bulk_save_classes():
+    """
+    Create or update many classes at once (items with an 'id' are updates).
+    Every item is validated first; then all are written in one transaction, or none are.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty JSON array of classes'}), 400
+    if len(items) > app.config['BULK_CLASSES_MAX']:
+        return jsonify({'error': f"At most {app.config['BULK_CLASSES_MAX']} classes per request"}), 413
+
+    classes = []
+    errors = []
+    now = datetime.now()
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Each class must be a JSON object")
+            yoga_class = class_from_payload(item)
+            if yoga_class.id is not None:
+                if isinstance(yoga_class.id, bool) or not str(yoga_class.id).isdigit():
+                    raise ValueError("id must be a positive integer")
+                yoga_class.id = int(yoga_class.id)
+            if yoga_class.date_time < now:
+                raise ValueError("Cannot create a class in the past")
+            if int(yoga_class.capacity) < 1 or int(yoga_class.duration) < 1:
+                raise ValueError("capacity and duration must be positive")
+            if not yoga_class.location:
+                raise ValueError("location is required")
+            classes.append(yoga_class)
+        except KeyError as e:
+            errors.append({'index': index, 'error': f"Missing field {e}"})
+        except (TypeError, ValueError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        return jsonify({'error': 'Validation failed, nothing was saved', 'errors': errors}), 400
+
+    # Counted first: saving gives the new classes their ids
+    updated = sum(1 for yoga_class in classes if yoga_class.id is not None)
+    try:
+        ids = YogaClass.save_many(classes)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    created = len(ids) - updated
+    return jsonify({
+        'message': 'Classes saved!',
+        'ids': ids,
+        'created': created,
+        'updated': updated
+    }), 201 if created else 200
+
+def build_catalog_payload():
+    return CachedPayload(jsonify(YogaClass.get_future_active_classes()).get_data(), 'application/json')
+
 @app.route('/classes', methods=['GET'])
 def get_classes():
-    return jsonify(YogaClass.get_future_active_classes())
+    payload, state = catalog_cache.get()
+    if state == 'stale':
+        catalog_cache.refresh_async(build_catalog_payload)
+    elif state == 'miss':
+        payload = catalog_cache.load(build_catalog_payload)
+    return payload.to_response()
+
+@app.route('/classes/stream', methods=['GET'])
+def stream_classes():
+    """
+    Server-Sent Events feed of seat availability changes.
+    Served by seat_stream.py's event loop when SEAT_STREAM_URL is set; here only as a capped fallback.
+    """
+    stream_url = app.config['SEAT_STREAM_URL']
+    if stream_url:
+        return redirect(f"{stream_url.rstrip('/')}/classes/stream", code=307)
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_id = None
+    keepalive = app.config['SEAT_STREAM_KEEPALIVE']
+
+    # Subscribe before the response starts so a full worker can still answer with a status code
+    current_id = seat_events.subscribe()
+    if current_id is None:
+        response = jsonify({'error': 'Too many open seat streams, retry later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def generate(last_id):
+        if last_id is None:
+            last_id = current_id
+        # Tell the browser how long to wait before reconnecting
+        yield "retry: 5000\n\n"
+        while True:
+            events, missed = seat_events.wait_for_events(last_id, keepalive)
+            if seat_events.closed:
+                return
+            if missed:
+                # Deltas were dropped from the buffer, the client should re-fetch /classes
+                yield "event: resync\ndata: {}\n\n"
+                if not events:
+                    # The cursor came from another worker or process; restart from here
+                    last_id = seat_events.last_id
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event_id, message in events:
+                yield message
+            last_id = events[-1][0]
+
+    response = Response(generate(last_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Also runs when the client goes away before the generator was ever started
+    response.call_on_close(seat_events.unsubscribe)
+    return response
 
 @app.route('/classes/<int:class_id>', methods=['DELETE'])
 def delete_class(class_id):
@@ -1747,6 +5484,70 @@ def delete_class(class_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def parse_series_date(value):
+    return datetime.strptime(value, '%d/%m/%Y').date()
+
+@app.route('/classes/series', methods=['POST'])
+def create_class_series():
+    """Define a weekly recurring class and create its classes for the upcoming horizon"""
+    data = request.get_json()
+
+    try:
+        weekdays = data['weekdays']
+        if isinstance(weekdays, str):
+            weekdays = weekdays.split(',')
+        series = ClassSeries(
+            name=data['name'],
+            instructor=data['instructor'],
+            weekdays=[code.strip().upper() for code in weekdays],
+            start_time=data['start_time'],
+            duration=data.get('duration', 75),
+            capacity=data['capacity'],
+            location=data.get('location'),
+            starts_on=parse_series_date(data['starts_on']) if data.get('starts_on') else date.today(),
+            until_on=parse_series_date(data['until_on']) if data.get('until_on') else None,
+            interval_weeks=int(data.get('interval_weeks', 1)),
+            exceptions={parse_series_date(value) for value in data.get('exceptions', [])}
+        )
+        series_id = series.save()
+        created = series.materialize(timedelta(days=app.config['CLASS_SERIES_HORIZON_DAYS']))
+
+        return jsonify({'message': 'Class series created!', 'id': series_id, 'classes_created': created}), 201
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/classes/series', methods=['GET'])
+def get_class_series():
+    return jsonify([series.to_dict() for series in ClassSeries.get_all()])
+
+@app.route('/classes/series/<int:series_id>/exceptions', methods=['POST'])
+def add_class_series_exception(series_id):
+    """Skip one date of a series (holiday, teacher away)"""
+    series = ClassSeries.get_by_id(series_id)
+    if not series:
+        return jsonify({'error': 'Series not found'}), 404
+
+    try:
+        day = parse_series_date(request.get_json()['date'])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+    cancelled = series.add_exception(day)
+    return jsonify({'message': 'Date skipped', 'cancelled_classes': cancelled}), 200
+
+@app.route('/classes/series/<int:series_id>', methods=['DELETE'])
+def end_class_series(series_id):
+    """End a series and cancel its future classes"""
+    series = ClassSeries.get_by_id(series_id)
+    if not series:
+        return jsonify({'error': 'Series not found'}), 404
+
+    try:
+        cancelled = series.end()
+        return jsonify({'message': 'Class series ended', 'cancelled_classes': cancelled}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Booking routes
 @app.route('/bookings', methods=['POST'])
 @login_required
@@ -1785,6 +5586,152 @@ def cancel_booking(booking_id):
 def get_bookings():
     return jsonify(Booking.get_user_active_bookings(current_user.id))
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """
+    Occupancy report from the rollup tables, e.g. /stats?group_by=month,instructor&from=01/01/2026.
+    Never touches Bookings or YogaClasses.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    group_by = [name.strip() for name in request.args.get('group_by', 'month').split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in STATS_GROUPS]
+    if unknown or not group_by:
+        return jsonify({'error': f"group_by must be a list of {', '.join(STATS_GROUPS)}"}), 400
+    try:
+        start_day, end_day = (
+            datetime.strptime(request.args[name], '%d/%m/%Y').strftime('%Y-%m-%d') if request.args.get(name) else None
+            for name in ('from', 'to')
+        )
+    except ValueError:
+        return jsonify({'error': 'from and to must be dd/mm/YYYY'}), 400
+
+    rows = occupancy_rollup.query(start_day, end_day)
+    last_flush = occupancy_rollup.last_flush
+    return jsonify({
+        'group_by': group_by,
+        'rows': summarize_occupancy(rows, group_by),
+        'refreshed_at': last_flush.strftime('%d/%m/%Y %H:%M:%S') if last_flush else None
+    })
+
+@app.route('/calendar/studio.ics', methods=['GET'])
+def studio_calendar():
+    """Public schedule as an iCalendar feed"""
+    return calendar_feed_response('studio', render_studio_calendar, private=False)
+
+@app.route('/calendar/<token>.ics', methods=['GET'])
+def user_calendar(token):
+    """
+    A user's upcoming bookings as an iCalendar feed; the token in the URL is the credential.
+    The revision check and the feed both come from memory, so a 304 costs no query.
+    """
+    try:
+        claims = calendar_serializer().loads(token)
+        user_id = int(claims['u'])
+    except (BadSignature, KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Calendar not found'}), 404
+    revision = calendar_feeds.revision(user_id, calendar_revision)
+    if revision is None or claims.get('r') != revision:
+        return jsonify({'error': 'Calendar not found'}), 404
+    return calendar_feed_response(user_id, lambda: render_user_calendar(user_id), private=True)
+
+@app.route('/calendar/token', methods=['GET'])
+@login_required
+def get_calendar_link():
+    """Subscription URL of the current user's booking calendar"""
+    token = calendar_serializer().dumps({'u': current_user.id,
+                                         'r': calendar_feeds.revision(current_user.id, calendar_revision)})
+    return jsonify({
+        'url': url_for('user_calendar', token=token, _external=True),
+        'studio_url': url_for('studio_calendar', _external=True)
+    })
+
+@app.route('/calendar/token', methods=['DELETE'])
+@login_required
+def revoke_calendar_link():
+    """Revoke every feed link handed out so far and return a new one"""
+    with db_connection_with_retry() as conn:
+        with db_cursor(conn) as cursor:
+            revoke_calendar_links(cursor, current_user.id)
+            conn.commit()
+    invalidation_bus.publish('calendar-link', current_user.id)
+    return get_calendar_link()
+
+@metrics.gauge_collector
+def collect_runtime_gauges():
+    """Pool, hashing and live-stream gauges read at scrape time"""
+    gauges = []
+    pool_stats = connection_pool.get_pool_stats()
+    labels = {'backend': DB_CONFIG['type']}
+    gauges.append(('db_pool_idle_connections', 'Idle connections in the pool', labels, pool_stats['pool_size']))
+    gauges.append(('db_pool_open_connections', 'Connections opened by the pool', labels, pool_stats['created_connections']))
+    gauges.append(('db_pool_in_use_connections', 'Connections currently borrowed', labels, pool_stats.get('in_use')))
+    gauges.append(('db_pool_max_connections', 'Configured pool limit', labels, pool_stats['max_pool_size']))
+    gauges.append(('db_pool_closed', '1 when the pool has been closed', labels, int(pool_stats['is_closed'])))
+    if 'validations' in pool_stats:
+        gauges.append(('db_pool_validations', 'Validation probes run on pooled connections', labels,
+                       pool_stats['validations']))
+        gauges.append(('db_pool_recycled', 'Connections retired for exceeding their max lifetime', labels,
+                       pool_stats['recycled']))
+    keepalive_stats = pool_keepalive.get_stats()
+    gauges.append(('db_keepalive_interval_seconds', 'Idle time before the next keepalive ping', labels,
+                   keepalive_stats['interval']))
+    gauges.append(('db_keepalive_pings', 'Keepalive pings sent by this worker', labels, keepalive_stats['pings']))
+    gauges.append(('db_keepalive_cold_pings', 'Keepalive pings that found the database cold', labels,
+                   keepalive_stats['cold_pings']))
+
+    hasher_stats = password_hasher.get_stats()
+    gauges.append(('password_hash_in_flight', 'Password hashing jobs queued or running', {}, hasher_stats['in_flight']))
+
+    gauges.append(('seat_stream_subscribers', 'Open /classes/stream connections', {},
+                   seat_events.get_stats()['subscribers']))
+    gauges.append(('app_import_seconds', 'Time spent importing app.py in this worker', {}, IMPORT_SECONDS))
+    gauges.append(('log_queue_depth', 'Log records waiting for the writer thread', {}, log_queue.qsize()))
+    gauges.append(('log_records_dropped', 'Log records dropped because the queue was full', {}, log_handler.dropped))
+    for key, count in rate_limiter.get_stats()['rejected'].items():
+        endpoint, scope = key.split(':', 1)
+        gauges.append(('rate_limit_rejected', 'Requests rejected by the rate limiter',
+                       {'endpoint': endpoint, 'scope': scope}, count))
+    return gauges
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this worker"""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests. No I/O."""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: pool is open and the background probe (or the pool's own traffic) found the database answering"""
+    pool_stats = connection_pool.get_pool_stats()
+    status = health_probe.get_status()
+    if health_probe.interval <= 0:
+        # Probing disabled: readiness only reflects the pool
+        status['database_ok'] = True
+        status['probe'] = 'disabled'
+    ready = status['database_ok'] and not pool_stats.get('is_closed') and not shutdown.draining
+    return jsonify({
+        'status': 'draining' if shutdown.draining else ('ready' if ready else 'unavailable'),
+        'database': status,
+        'pool': pool_stats
+    }), 200 if ready else 503
+
+@app.route('/debug/queries', methods=['GET'])
+def get_query_report():
+    """Per-route statement counts collected by the query profiler"""
+    if not query_profiler.enabled:
+        return jsonify({'error': 'Query profiler is disabled (set QUERY_PROFILER=true)'}), 404
+    return jsonify(query_profiler.report())
+
 @app.route('/api/check-session', methods=['GET'])
 @login_required
 def check_session():
@@ -1794,17 +5741,20 @@ def check_session():
         return jsonify({'authenticated': False, 'message': 'Session expired'}), 401
 
 @app.route('/resend-verification', methods=['POST'])
+@rate_limited('resend_verification')
 def resend_verification():
-    """Resend verification email to user"""
-    data = request.get_json()
+    """Resend verification email to user, found by email or by an expired verification link"""
+    # JSON from the app, or the form on the expired-link page
+    data = request.get_json(silent=True) or request.form
     email = data.get('email')
+    claims = AuthToken.resolve(data.get('token') or '', AuthToken.PURPOSE_VERIFY)
 
-    if not email:
+    if not email and not claims:
         return jsonify({'error': 'Email is required'}), 400
 
     try:
-        # Find the user by email
-        user = User.get_user_by_email(email)
+        # Find the user by email, or by the user id signed into the old link
+        user = User.get_user_by_email(email) if email else User.get_user_by_id(claims[0])
 
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -1824,10 +5774,11 @@ def resend_verification():
         }), 200
 
     except Exception as e:
-        print(f"Error in resend_verification: {str(e)}")
+        logger.error(f"Error in resend_verification: {str(e)}")
         return jsonify({'error': 'Failed to resend verification email. Please try again later.'}), 500
 
 @app.route('/request-password-reset', methods=['POST'])
+@rate_limited('password_reset')
 def request_password_reset():
     data = request.get_json()
     email = data.get('email')
@@ -1843,19 +5794,8 @@ def request_password_reset():
             # Don't reveal whether user exists for security
             return jsonify({'message': 'If an account exists with this email, a password reset link has been sent'}), 200
 
-        # Generate a password reset token
-        reset_token = secrets.token_urlsafe(32)
-        token_expiry = datetime.utcnow() + timedelta(hours=1)  # 1 hour expiry for password reset
-
-        # Store the token in the database
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                UPDATE Users 
-                SET verification_token = ?, token_expiry = ?
-                WHERE id = ?
-                """), (reset_token, token_expiry, user.id))
-                conn.commit()
+        # Generate a password reset token (1 hour expiry), leaving any pending verification alone
+        reset_token, token_expiry = AuthToken.issue(user.id, AuthToken.PURPOSE_PASSWORD_RESET, timedelta(hours=1))
 
         # Send password reset email
         send_password_reset_email(user, reset_token)
@@ -1865,7 +5805,7 @@ def request_password_reset():
         }), 200
 
     except Exception as e:
-        print(f"Error in request_password_reset: {str(e)}")
+        logger.error(f"Error in request_password_reset: {str(e)}")
         return jsonify({'error': 'Failed to process password reset request'}), 500
 
 @app.route('/reset-password/<token>', methods=['POST'])
@@ -1877,82 +5817,63 @@ def reset_password(token):
         return jsonify({'error': 'New password is required'}), 400
 
     try:
-        # Find user by reset token (using verification_token column)
+        # Signature and expiry first, so bogus tokens never cost a query or a password hash
+        claims = AuthToken.resolve(token, AuthToken.PURPOSE_PASSWORD_RESET)
+        if not claims:
+            return jsonify({'error': 'Invalid or expired reset token'}), 400
+        if claims[1] < datetime.utcnow():
+            return jsonify({'error': 'Reset token has expired'}), 400
+
+        # Hash without holding a database connection
+        password_hash = password_hasher.hash(new_password)
+
+        # Consume the token and update the password in one transaction
         with db_connection_with_retry() as conn:
             with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                SELECT id, token_expiry 
-                FROM Users 
-                WHERE verification_token = ?
-                """), (token,))
-                row = cursor.fetchone()
-
-                if not row:
+                result = AuthToken.consume(cursor, token, AuthToken.PURPOSE_PASSWORD_RESET)
+                if not result:
                     return jsonify({'error': 'Invalid or expired reset token'}), 400
 
-                user_id = row[0]
-                expiry = row[1]
-
-                # Check if token is expired
-                if expiry < datetime.utcnow():
-                    return jsonify({'error': 'Reset token has expired'}), 400
-
-                # Update password and clear token
-                password_hash = generate_password_hash(new_password, method='pbkdf2:sha256')
+                user_id = result[0]
                 cursor.execute(convert_query("""
                 UPDATE Users 
-                SET password_hash = ?, verification_token = NULL, token_expiry = NULL
+                SET password_hash = ?
                 WHERE id = ?
                 """), (password_hash, user_id))
+                # A password reset also shuts out calendar links that may have leaked
+                revoke_calendar_links(cursor, user_id)
                 conn.commit()
+        invalidation_bus.publish('user', user_id)
+        invalidation_bus.publish('calendar-link', user_id)
 
         return jsonify({'message': 'Password reset successfully'}), 200
 
+    except PasswordHashingBusy:
+        return password_hashing_busy_response()
     except Exception as e:
-        print(f"Error in reset_password: {str(e)}")
+        logger.error(f"Error in reset_password: {str(e)}")
         return jsonify({'error': 'Failed to reset password'}), 500
 
 @app.route('/reset-password/<token>', methods=['GET'])
 def show_password_reset_form(token):
-    # First, validate the token to ensure it's still active and belongs to a user
+    # Validate the signed token; no database work until the form is submitted (legacy unsigned links aside)
     try:
-        with db_connection_with_retry() as conn:
-            with db_cursor(conn) as cursor:
-                cursor.execute(convert_query("""
-                SELECT id, token_expiry
-                FROM Users
-                WHERE verification_token = ?
-                """), (token,))
-                row = cursor.fetchone()
+        claims = AuthToken.resolve(token, AuthToken.PURPOSE_PASSWORD_RESET)
+
+        if not claims:
+            return template_registry.render('reset_invalid')
+
+        if claims[1] < datetime.utcnow():
+            return template_registry.render('reset_expired')
 
-                if not row:
-                    return render_template_string("""
-                        <h1>Invalid or Expired Link</h1>
-                        <p>The password reset link is invalid or has already been used/expired.</p>
-                        <p><a href="/">Return to homepage</a></p>
-                    """)
-
-                expiry = row[1]
-                if expiry < datetime.utcnow():
-                    return render_template_string("""
-                        <h1>Link Expired</h1>
-                        <p>The password reset link has expired. Please request a new one.</p>
-                        <p><a href="/request-password-reset">Request New Password Reset Link</a></p>
-                    """)
         # If token is valid and not expired, render the form
-        return render_template_string(get_file("static/reset_password.html"), token=token)
+        return template_registry.render('reset_form', token=token)
     except Exception as e:
-        print(f"Error serving password reset form: {str(e)}")
-        return render_template_string("""
-            <h1>Error</h1>
-            <p>An unexpected error occurred. Please try again later.</p>
-            <p><a href="/">Return to homepage</a></p>
-        """)
+        logger.error(f"Error serving password reset form: {str(e)}")
+        return template_registry.render('reset_error')
 
 def send_password_reset_email(user, reset_token):
     """Send password reset email via Resend"""
-    resend.api_key = os.getenv("RESEND_API_KEY")
-
     # Use environment variable for base URL if set, otherwise use request URL
     base_url = os.getenv("BASE_URL", request.host_url)
     if not base_url.endswith('/'):
@@ -2061,17 +5982,37 @@ def send_password_reset_email(user, reset_token):
             ]
         }
 
-        resend.Emails.send(params)
-        print(f"Password reset email sent to {user.email}")
+        if app.config['EMAIL_BACKEND'] == 'console':
+            logger.info(f"Password reset email for {user.email} not sent (console backend): {reset_link}")
+            record_email('password_reset', 'skipped', 0.0)
+            return True
+
+        import resend
+        resend.api_key = os.getenv("RESEND_API_KEY")
+
+        send_start = time.perf_counter()
+        try:
+            resend.Emails.send(params)
+        except Exception:
+            record_email('password_reset', 'failed', time.perf_counter() - send_start)
+            raise
+        record_email('password_reset', 'sent', time.perf_counter() - send_start)
+        logger.info(f"Password reset email sent to {user.email}")
         return True
 
     except Exception as e:
-        print(f"Error sending password reset email: {str(e)}")
+        logger.error(f"Error sending password reset email: {str(e)}")
         return False
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get_user_by_id(int(user_id))
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.get_user_by_id(user_id)
+        if user is not None:
+            user_cache.set(user)
+    return user
 
 # [Keep all your existing static file serving code...]
 def root_dir():  # pragma: no cover
@@ -2100,29 +6041,212 @@ def get_resource(path):  # pragma: no cover
     complete_path = os.path.join(root_dir(), "static", path)
     ext = os.path.splitext(path)[1]
     mimetype = mimetypes.get(ext, "text/html")
+
+    # Serve from memory while the file is unchanged on disk
+    try:
+        mtime = os.path.getmtime(complete_path)
+    except OSError:
+        mtime = None
+    cached = static_asset_cache.get(complete_path)
+    if mtime is not None and cached and cached[0] == mtime:
+        return cached[1].to_response()
+
     content = get_file(complete_path)
-    return Response(content, mimetype=mimetype)
+    if mtime is None:
+        return Response(content, mimetype=mimetype)
+
+    payload = CachedPayload(content.encode('utf-8'), mimetype)
+    static_asset_cache[complete_path] = (mtime, payload)
+    return payload.to_response()
+
+
+def start_maintenance_job(interval):
+    """Run the maintenance sweep periodically in a background thread"""
+    stop_event = threading.Event()
+
+    def run():
+        # Spread workers out so they don't all sweep at the same moment
+        while not stop_event.wait(interval + random.uniform(0, interval / 10)):
+            try:
+                report = run_maintenance()
+                if (report['unverified_users_removed'] or report['expired_tokens_purged']
+                        or report['legacy_tokens_cleared'] or report['series_classes_created']):
+                    logger.info(f"Maintenance sweep: {report}")
+            except Exception as e:
+                logger.error(f"Maintenance sweep failed: {str(e)[:80]}")
+
+    threading.Thread(target=run, name='maintenance', daemon=True).start()
+    return stop_event
+
+maintenance_stop = None
+_app_lock = threading.Lock()
+_app_created = False
+_services_pid = None
+
+def start_worker_services():
+    """
+    Start the background threads of this process: log writer, maintenance sweep, health probe, DB keepalive
+    and occupancy rollup.
+    Threads don't survive fork, so a preloading gunicorn master calls this from post_fork in each worker.
+    Does nothing when this process already runs them.
+    """
+    global maintenance_stop, _services_pid
+    with _app_lock:
+        if _services_pid == os.getpid():
+            return
+        _services_pid = os.getpid()
+        ensure_log_listener()
+        invalidation_bus.start()
+        if app.config['MAINTENANCE_INTERVAL'] > 0:
+            maintenance_stop = start_maintenance_job(app.config['MAINTENANCE_INTERVAL'])
+        if app.config['HEALTH_PROBE_INTERVAL'] > 0:
+            health_probe.start()
+        pool_keepalive.start()
+        occupancy_rollup.start()
+
+# --------------------------------------
+# Graceful shutdown
+# --------------------------------------
+
+class ShutdownCoordinator:
+    """
+    Tracks in-flight requests and runs the shutdown sequence once per process:
+    stop taking traffic, let running requests and borrowed connections finish up to a deadline,
+    flush background queues, then close the pool.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self._inflight = 0
+        self._idle = threading.Condition()
+        self._finished_pid = None
+
+    def request_started(self):
+        with self._idle:
+            self._inflight += 1
+
+    def request_finished(self):
+        with self._idle:
+            self._inflight -= 1
+            self._idle.notify_all()
 
+    def begin(self):
+        """
+        Start draining: /readyz fails so the load balancer stops routing here, keep-alive
+        connections are closed after their current response and live seat streams end.
+        Safe to call from a signal handler.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        # Not inline: a signal handler must not wait on locks request threads may hold
+        threading.Thread(target=seat_events.close, name='drain-streams', daemon=True).start()
+
+    def run(self, timeout=None):
+        """Drain and close this process's resources; later calls are no-ops"""
+        if self._finished_pid == os.getpid():
+            return
+        self._finished_pid = os.getpid()
+        timeout = app.config['SHUTDOWN_DRAIN_TIMEOUT'] if timeout is None else timeout
+        deadline = time.time() + timeout
+        self.begin()
+
+        if maintenance_stop is not None:
+            maintenance_stop.set()
+        health_probe.stop()
+        pool_keepalive.stop()
+        occupancy_rollup.stop()
+        invalidation_bus.stop()
+
+        with self._idle:
+            requests_done = self._idle.wait_for(lambda: self._inflight <= 0, max(0, deadline - time.time()))
+        connections_back = connection_pool.wait_until_idle(max(0, deadline - time.time()))
+        if not (requests_done and connections_back):
+            logger.warning(f"Shutdown deadline of {timeout:.0f}s passed with {self._inflight} requests "
+                           f"and {connection_pool.get_pool_stats()['borrowed']} connections still busy")
+
+        password_hasher.close()
+        # Changes made by the requests that just finished
+        occupancy_rollup.flush()
+        connection_pool.close_all()
+        logger.info("Shutdown complete")
+        # Last, so the records above make it out too
+        stop_log_listener()
+
+shutdown = ShutdownCoordinator()
+
+@app.before_request
+def track_inflight_request():
+    shutdown.request_started()
+    g.inflight_tracked = True
+
+@app.teardown_request
+def untrack_inflight_request(error):
+    if g.pop('inflight_tracked', False):
+        shutdown.request_finished()
+
+@app.after_request
+def close_connection_when_draining(response):
+    if shutdown.draining:
+        response.headers['Connection'] = 'close'
+    return response
+
+def stop_worker_services():
+    """Drain and stop this process (gunicorn worker_exit, interpreter exit)"""
+    # Only where start_worker_services ran: a plain `import app` (scripts, the preloading master)
+    # has nothing to drain and must not log at exit
+    if _services_pid != os.getpid():
+        return
+    shutdown.run()
+
+def create_app(start_services=True):
+    """
+    Application factory: importing this module only defines the app, this starts it.
+    Compiles page templates, optionally creates the schema and starts the background jobs.
+    Safe to call more than once; gunicorn runs it via `gunicorn 'app:create_app()'`.
+    A preloading master passes start_services=False and leaves the threads to its workers.
+    """
+    global _app_created
+    with _app_lock:
+        if not _app_created:
+            _app_created = True
+
+            import_ms = IMPORT_SECONDS * 1000
+            if import_ms > app.config['IMPORT_TIME_BUDGET_MS']:
+                logger.warning(f"Importing app.py took {import_ms:.0f}ms (budget {app.config['IMPORT_TIME_BUDGET_MS']}ms)")
+
+            if app.config['INIT_DB_ON_START']:
+                init_db()
+
+            # Compile server-rendered pages up front so the first link click doesn't pay for it
+            template_registry.load()
+
+    if start_services:
+        start_worker_services()
+    return app
 
 # Cleanup function for graceful shutdown
 @app.teardown_appcontext
 def close_db(error):
     pass
 
-# Register a function to close the pool on app shutdown
-import atexit
-atexit.register(connection_pool.close_all)
+# Drain and close the pool on app shutdown
+atexit.register(stop_worker_services)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 if __name__ == '__main__':
     try:
-        # Start the database keepalive service (disabled for Render/PostgreSQL)
-        print("Starting Yoga Booking System...")
-        # start_database_keepalive()  # Not needed with PostgreSQL
+        logger.info("Starting Yoga Booking System...")
+
+        # Local runs keep the old convenience of creating the schema on start
+        init_db()
 
         # Start your Flask app
-        app.run(host='0.0.0.0', debug=True, port=8000)
+        # The Werkzeug debugger allows code execution from the browser, so it's opt-in
+        debug = os.getenv('FLASK_DEBUG', 'false').lower() in ('1', 'true')
+        create_app().run(host='0.0.0.0', debug=debug, port=8000)
     finally:
         # Clean shutdown
-        print("Shutting down services...")
-        # stop_database_keepalive()  # Not needed with PostgreSQL
-        connection_pool.close_all()
\ No newline at end of file
+        logger.info("Shutting down services...")
+        stop_worker_services()
\ No newline at end of file
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Load Testing Benchmark
+Boots the app against a throwaway local database, drives a realistic traffic mix with
+concurrent simulated users and writes throughput and latency percentiles per endpoint to JSON.
+
+Usage:
+    python benchmark.py                                   # SQLite, 20 users, 60 seconds
+    python benchmark.py --users 50 --duration 120
+    python benchmark.py --database-url postgresql://localhost/yoga_bench
+    python benchmark.py --compare baseline.json           # Show changes against an earlier run
+    python benchmark.py --target http://127.0.0.1:8000    # Use an already running server
+    python benchmark.py --import-budget-ms 300            # Fail when importing app.py gets slower
+"""
+
+import argparse
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+# Share of actions in the traffic mix (weights, not percentages)
+DEFAULT_MIX = {
+    'browse': 50,
+    'login': 15,
+    'book': 15,
+    'cancel': 10,
+    'signup': 10,
+}
+
+BENCH_PASSWORD = 'bench-password-123'
+
+
+def free_port():
+    """Find a free local TCP port for the server"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def build_app_env(args, db_path):
+    """Environment for the app under test"""
+    env = dict(os.environ)
+    env.update({
+        'CORS_SECRET_KEY': secrets.token_hex(16),  # Shared by all workers so sessions work
+        'EMAIL_BACKEND': 'console',
+        'RATE_LIMIT_ENABLED': 'false',  # Every simulated user comes from 127.0.0.1
+        'MAINTENANCE_INTERVAL': '0',
+    })
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+        env.pop('DB_USE_LOCAL', None)
+    else:
+        env.pop('DATABASE_URL', None)
+        env['DB_USE_LOCAL'] = 'true'
+        env['LOCAL_DB_PATH'] = db_path
+    return env
+
+
+def seed_database(args, env):
+    """Create verified users and future classes directly through the app's own data layer"""
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as yoga_app
+    from werkzeug.security import generate_password_hash
+
+    # Importing the app no longer touches the database; create the schema explicitly
+    if not yoga_app.init_db():
+        raise RuntimeError("Could not initialize the benchmark database")
+
+    rng = random.Random(args.seed)
+    # Hash once; PBKDF2 per seeded user would dominate set-up time
+    password_hash = generate_password_hash(BENCH_PASSWORD, yoga_app.password_hasher.method)
+    is_verified_value = True if yoga_app.DB_CONFIG['type'] == 'postgresql' else 1
+    run_id = secrets.token_hex(4)
+
+    users = [('Bench', f'User{i}', f'bench-{run_id}-{i}@example.com', password_hash, is_verified_value)
+             for i in range(args.seed_users)]
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+    classes = []
+    for i in range(args.seed_classes):
+        date_time = start + timedelta(days=rng.randint(0, 60), hours=rng.choice([7, 9, 12, 18, 19, 20]),
+                                      minutes=rng.choice([0, 15, 30, 45]) + i % 15)
+        classes.append((f'Bench Class {i}', rng.choice(['Jantine', 'Sarah', 'Mike']), date_time,
+                        rng.choice([60, 75, 90]), args.class_capacity, 'active',
+                        rng.choice(['Studio A, Main Street 123', 'Studio B, Main Street 123'])))
+
+    with yoga_app.db_connection() as conn:
+        with yoga_app.db_cursor(conn) as cursor:
+            cursor.executemany(yoga_app.convert_query("""
+            INSERT INTO Users (name, surname, email, password_hash, is_verified)
+            VALUES (?, ?, ?, ?, ?)
+            """), users)
+            cursor.executemany(yoga_app.convert_query("""
+            INSERT INTO YogaClasses (name, instructor, date_time, duration, capacity, status, location)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """), classes)
+            conn.commit()
+
+    print(f"Seeded {len(users)} verified users and {len(classes)} classes")
+    return [user[2] for user in users]
+
+
+def measure_import_time(env, runs=3):
+    """Best-of-N time to import app.py in a fresh interpreter (what every worker pays at boot)"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', 'import app; print("IMPORT_SECONDS", app.IMPORT_SECONDS)'],
+                                         cwd=app_dir, env=env, stderr=subprocess.DEVNULL)
+        # Tagged, so anything else the app prints on stdout can't be mistaken for the timing
+        line = next(line for line in output.decode().splitlines() if line.startswith('IMPORT_SECONDS '))
+        timings.append(float(line.split()[1]) * 1000)
+    return round(min(timings), 1)
+
+
+def start_server(args, env, port):
+    """Boot the app under gunicorn (or Flask's threaded server when gunicorn isn't available)"""
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    log_file = open(os.path.join(tempfile.gettempdir(), 'benchmark_server.log'), 'w')
+
+    if shutil.which('gunicorn') and not args.dev_server:
+        command = ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+                   '--threads', str(args.threads), '--worker-class', 'gthread', 'app:create_app()']
+    else:
+        command = [sys.executable, '-c',
+                   f"from app import create_app; create_app().run(host='127.0.0.1', port={port}, threaded=True, debug=False)"]
+
+    print(f"Starting server: {' '.join(command)}")
+    process = subprocess.Popen(command, cwd=app_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early, see {log_file.name}")
+        try:
+            if requests.get(f'{base_url}/classes', timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError(f"Server did not become ready in 60s, see {log_file.name}")
+
+
+class Recorder:
+    """Collects latency samples per endpoint from all simulated users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, duration, status):
+        with self._lock:
+            entry = self.samples.setdefault(endpoint, {'latencies': [], 'statuses': {}, 'errors': 0})
+            entry['latencies'].append(duration)
+            entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+            if status == 'error' or (isinstance(status, int) and status >= 500):
+                entry['errors'] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        all_latencies = []
+        total_errors = 0
+        for endpoint, entry in sorted(self.samples.items()):
+            latencies = sorted(entry['latencies'])
+            all_latencies.extend(latencies)
+            total_errors += entry['errors']
+            endpoints[endpoint] = summarize(latencies, elapsed, entry['errors'], entry['statuses'])
+        return endpoints, summarize(sorted(all_latencies), elapsed, total_errors, {})
+
+
+def summarize(latencies, elapsed, errors, statuses):
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+    if statuses:
+        result['statuses'] = statuses
+    return result
+
+
+class SimulatedUser(threading.Thread):
+    """One visitor: logs in, then browses, books, cancels and occasionally signs up new accounts"""
+
+    def __init__(self, index, base_url, email, mix, recorder, stop_at, seed, think_time):
+        super().__init__(name=f'bench-user-{index}', daemon=True)
+        self.base_url = base_url
+        self.email = email
+        self.recorder = recorder
+        self.stop_at = stop_at
+        self.think_time = think_time
+        self.rng = random.Random(seed * 1000 + index)
+        self.actions = list(mix.keys())
+        self.weights = list(mix.values())
+        self.session = requests.Session()
+        self.class_ids = []
+        self.signups = 0
+        self.index = index
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+            self.recorder.record(endpoint, time.perf_counter() - start, response.status_code)
+            return response
+        except requests.RequestException:
+            self.recorder.record(endpoint, time.perf_counter() - start, 'error')
+            return None
+
+    def browse(self):
+        response = self.request('GET /classes', 'GET', '/classes')
+        if response is not None and response.ok:
+            self.class_ids = [item['class-id'] for item in response.json()]
+
+    def login(self):
+        self.request('POST /login', 'POST', '/login', json={'email': self.email, 'password': BENCH_PASSWORD})
+
+    def book(self):
+        if not self.class_ids:
+            self.browse()
+        if self.class_ids:
+            self.request('POST /bookings', 'POST', '/bookings', json={'class_id': self.rng.choice(self.class_ids)})
+
+    def cancel(self):
+        response = self.request('GET /bookings', 'GET', '/bookings')
+        if response is None or not response.ok:
+            return
+        bookings = response.json()
+        if bookings:
+            booking_id = self.rng.choice(bookings)['booking-id']
+            self.request('PUT /bookings/<id>/cancel', 'PUT', f'/bookings/{booking_id}/cancel')
+
+    def signup(self):
+        self.signups += 1
+        self.request('POST /users', 'POST', '/users', json={
+            'name': 'Load',
+            'surname': 'Test',
+            'email': f'signup-{secrets.token_hex(4)}-{self.index}-{self.signups}@example.com',
+            'password': BENCH_PASSWORD
+        })
+
+    def run(self):
+        self.login()
+        while time.time() < self.stop_at:
+            action = self.rng.choices(self.actions, weights=self.weights)[0]
+            getattr(self, action)()
+            if self.think_time:
+                time.sleep(self.rng.uniform(0, self.think_time * 2))
+
+
+def run_benchmark(args, base_url, emails):
+    recorder = Recorder()
+    stop_at = time.time() + args.duration
+    users = [SimulatedUser(i, base_url, emails[i % len(emails)], DEFAULT_MIX, recorder, stop_at,
+                           args.seed, args.think_time)
+             for i in range(args.users)]
+
+    print(f"Running {args.users} simulated users for {args.duration}s against {base_url}...")
+    start = time.time()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.time() - start
+
+    endpoints, total = recorder.summary(elapsed)
+    return {
+        'meta': {
+            'started_at': datetime.utcfromtimestamp(start).isoformat() + 'Z',
+            'elapsed_seconds': round(elapsed, 2),
+            'users': args.users,
+            'duration': args.duration,
+            'think_time': args.think_time,
+            'seed': args.seed,
+            'mix': DEFAULT_MIX,
+            'database': 'postgresql' if args.database_url else ('external' if args.target else 'sqlite'),
+            'git_commit': git_commit(),
+        },
+        'endpoints': endpoints,
+        'total': total,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_report(results, baseline=None):
+    print("\n" + "=" * 92)
+    print(f"{'Endpoint':<28}{'Requests':>10}{'Errors':>8}{'RPS':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  p95 vs baseline")
+    print("=" * 92)
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+    for endpoint, stats in rows:
+        delta = ''
+        if baseline:
+            previous = baseline['total'] if endpoint == 'TOTAL' else baseline.get('endpoints', {}).get(endpoint)
+            if previous and previous.get('p95_ms') and stats.get('p95_ms'):
+                change = (stats['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+                delta = f"{change:+.1f}%"
+        print(f"{endpoint:<28}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>10}"
+              f"{stats['p50_ms'] or '-':>10}{stats['p95_ms'] or '-':>10}{stats['p99_ms'] or '-':>10}  {delta}")
+    print("=" * 92)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the yoga booking API')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent simulated users')
+    parser.add_argument('--duration', type=int, default=60, help='Test length in seconds')
+    parser.add_argument('--think-time', type=float, default=0.5, help='Average pause between actions (seconds)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for a reproducible traffic mix')
+    parser.add_argument('--seed-users', type=int, default=200, help='Verified users to create before the run')
+    parser.add_argument('--seed-classes', type=int, default=50, help='Future classes to create before the run')
+    parser.add_argument('--class-capacity', type=int, default=500, help='Capacity of each seeded class')
+    parser.add_argument('--database-url', help='Local PostgreSQL URL (default: a temporary SQLite file)')
+    parser.add_argument('--target', help='Benchmark an already running server instead of booting one')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--dev-server', action='store_true', help="Use Flask's server instead of gunicorn")
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON results')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--import-budget-ms', type=float, help='Exit non-zero when importing app.py takes longer')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='yoga-bench-')
+    db_path = os.path.join(work_dir, 'benchmark.db')
+    process = None
+    import_ms = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip('/')
+            emails = [f'bench-user-{i}@example.com' for i in range(max(1, args.seed_users))]
+            print("Using an external server; logins only succeed for users that already exist there")
+        else:
+            env = build_app_env(args, db_path)
+            import_ms = measure_import_time(env)
+            print(f"Importing app.py takes {import_ms}ms")
+            emails = seed_database(args, env)
+            process, base_url = start_server(args, env, free_port())
+
+        results = run_benchmark(args, base_url, emails)
+        results['meta']['import_ms'] = import_ms
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    print(f"\nResults written to {args.output}")
+
+    if args.import_budget_ms and import_ms is not None and import_ms > args.import_budget_ms:
+        print(f"Import time {import_ms}ms is over the {args.import_budget_ms:g}ms budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Gunicorn settings.
+The app is imported once in the master (preload) and forked into the workers; every worker then
+builds its own database pool and starts its own background threads.
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+"""
+
+import os
+import signal
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+worker_class = 'gthread'
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# How long a worker gets to finish in-flight requests after SIGTERM before it is killed
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+# Threads are started per worker in post_fork, not in the master
+wsgi_app = 'app:create_app(start_services=False)'
+
+
+def when_ready(server):
+    """Master is about to fork: make sure it holds no database connections the workers would inherit"""
+    if server.cfg.preload_app:
+        from app import connection_pool
+        connection_pool.reset()
+
+
+def post_fork(server, worker):
+    """Fresh process: start the log writer, maintenance sweep, health probe, DB keepalive and rollups in this worker"""
+    from app import start_worker_services
+    start_worker_services()
+
+
+def post_worker_init(worker):
+    """Start draining the moment the worker is told to stop, not after its request loop ends"""
+    from app import shutdown
+    stop_worker = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        shutdown.begin()
+        stop_worker(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    """Worker is going away: wait for borrowed connections, flush queues and close its own pool"""
+    from app import stop_worker_services
+    stop_worker_services()
@@ -7,6 +7,12 @@ Like having a toolbox for your workshop database - helps you set up, reset, and
 import sqlite3
 import os
 import sys
+import io
+import csv
+import time
+import random
+import argparse
+import itertools
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
 import secrets
@@ -192,6 +198,207 @@ def check_database_exists():
         print(f" Database does not exist: {LOCAL_DB_PATH}")
         return False
 
+def init_app_database():
+    """Create or upgrade the schema of the app's configured database (SQLite, PostgreSQL or SQL Server)"""
+    # Imported here so the other commands don't need the app's environment
+    from app import init_db
+
+    if not init_db():
+        print("Database initialization failed")
+        sys.exit(1)
+    print("Database schema is up to date")
+
+def sweep_database(action=None):
+    """Remove expired tokens and stale unverified accounts from the app's configured database"""
+    # Imported here so the other commands don't need the app's environment
+    from app import run_maintenance
+
+    print("Running maintenance sweep...")
+    report = run_maintenance(action)
+    print(f"  Unverified users removed ({report['unverified_users_action']}): {report['unverified_users_removed']}")
+    print(f"  Expired tokens purged: {report['expired_tokens_purged']}")
+    print(f"  Legacy tokens cleared: {report['legacy_tokens_cleared']}")
+    print(f"  Cache invalidation messages purged: {report['cache_invalidations_purged']}")
+    print(f"  Recurring classes created: {report['series_classes_created']}")
+    print(f"  Classes refreshed in occupancy rollups: {report['occupancy_classes_refreshed']}")
+    print(f"Sweep finished in {report['duration']}s")
+    return report
+
+FIRST_NAMES = ['Anna', 'Sophie', 'Emma', 'Julia', 'Lotte', 'Sarah', 'Eva', 'Lisa', 'Noor', 'Fleur',
+               'Daan', 'Lucas', 'Sem', 'Thomas', 'Mike', 'Ruben', 'Lars', 'Jesse', 'Tim', 'Bram']
+SURNAMES = ['de Jong', 'Jansen', 'de Vries', 'van den Berg', 'van Dijk', 'Bakker', 'Janssen', 'Visser',
+            'Smit', 'Meijer', 'de Boer', 'Mulder', 'de Groot', 'Bos', 'Vos', 'Peters', 'Hendriks', 'Dekker']
+CLASS_TYPES = ['Morning Vinyasa Flow', 'Evening Yin Yoga', 'Weekend Power Yoga', 'Restorative Yoga',
+               'Hatha Basics', 'Ashtanga Led Class', 'Prenatal Yoga', 'Yoga Nidra']
+INSTRUCTORS = ['Jantine', 'Sarah', 'Mike', 'Eva', 'Daan']
+LOCATIONS = ['Studio A, Main Street 123', 'Studio B, Main Street 123', 'Outdoor Pavilion, Park Avenue 45']
+# (hour, minute, relative popularity) - evenings fill up, lunch classes don't
+TIME_SLOTS = [(7, 0, 0.8), (9, 0, 1.0), (12, 15, 0.5), (17, 30, 1.2), (18, 45, 1.5), (20, 0, 1.1)]
+
+def _batched(rows, batch_size):
+    """Split any iterable into lists of batch_size rows without materializing it"""
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def _bulk_insert(yoga_app, conn, table, columns, rows, batch_size):
+    """
+    Insert rows with the fastest batched path of the configured backend:
+    COPY on PostgreSQL, fast_executemany on SQL Server, executemany in one transaction per batch on SQLite.
+    """
+    db_type = yoga_app.DB_CONFIG['type']
+    cursor = conn.cursor()
+    column_list = ', '.join(columns)
+    placeholders = ', '.join('?' * len(columns))
+    if db_type == 'sqlserver':
+        cursor.fast_executemany = True
+
+    start_time = time.time()
+    inserted = 0
+    for batch in _batched(rows, batch_size):
+        if db_type == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            cursor.executemany(f"INSERT INTO {table} ({column_list}) VALUES ({placeholders})", batch)
+        conn.commit()
+        inserted += len(batch)
+        if inserted % (batch_size * 20) == 0:
+            print(f"  {table}: {inserted:,} rows ({inserted / (time.time() - start_time):,.0f}/s)")
+
+    cursor.close()
+    elapsed = time.time() - start_time
+    print(f"  {table}: {inserted:,} rows in {elapsed:.1f}s")
+    return inserted
+
+def _ids_after(conn, table, last_id):
+    """Ids inserted after last_id, in insertion order"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id FROM {table} WHERE id > {int(last_id)} ORDER BY id")
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+def _max_id(conn, table):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    last_id = cursor.fetchone()[0]
+    cursor.close()
+    return last_id
+
+def generate_dataset(users=200000, classes=20000, bookings=5000000, years=3, seed=42, batch_size=10000):
+    """
+    Bulk-create a production-sized, reproducible dataset in the app's configured database.
+    Classes are spread over the past `years` and the next 90 days; bookings favour popular time slots,
+    are made a few days ahead of class and include cancellations.
+    """
+    # Imported here so the other commands don't need the app's environment
+    import app as yoga_app
+
+    if not yoga_app.init_db():
+        print("Database initialization failed")
+        return None
+
+    rng = random.Random(seed)
+    db_type = yoga_app.DB_CONFIG['type']
+    verified, unverified = (True, False) if db_type == 'postgresql' else (1, 0)
+    # One hash for everybody (password: password123); PBKDF2 per row would take hours
+    password_hash = generate_password_hash('password123', yoga_app.password_hasher.method)
+    now = datetime.now().replace(microsecond=0)
+
+    print(f"Generating {users:,} users, {classes:,} classes and ~{bookings:,} bookings "
+          f"in {db_type} (seed {seed})...")
+    start_time = time.time()
+
+    with yoga_app.db_connection() as conn:
+        if db_type == 'sqlite':
+            # Throwaway data: skip fsyncs while loading
+            conn.execute("PRAGMA synchronous = OFF")
+
+        cursor = conn.cursor()
+        cursor.execute(yoga_app.convert_query("SELECT COUNT(*) FROM Users WHERE email = ?"),
+                       (f"user.s{seed}u0@example.com",))
+        if cursor.fetchone()[0]:
+            cursor.close()
+            print(f"A dataset with seed {seed} already exists; use another --seed or reset the database first.")
+            return None
+        cursor.close()
+
+        # Users
+        last_user_id = _max_id(conn, 'Users')
+        user_rows = (
+            (rng.choice(FIRST_NAMES), rng.choice(SURNAMES), f"user.s{seed}u{i}@example.com", password_hash,
+             verified if rng.random() < 0.92 else unverified)
+            for i in range(users)
+        )
+        _bulk_insert(yoga_app, conn, 'Users', ('name', 'surname', 'email', 'password_hash', 'is_verified'),
+                     user_rows, batch_size)
+        user_ids = _ids_after(conn, 'Users', last_user_id)
+
+        # Classes
+        span_start = now - timedelta(days=365 * years)
+        span_days = 365 * years + 90
+        class_plan = []
+        for _ in range(classes):
+            hour, minute, popularity = rng.choice(TIME_SLOTS)
+            day = span_start + timedelta(days=rng.randrange(span_days))
+            date_time = day.replace(hour=hour, minute=minute, second=0)
+            popularity *= rng.lognormvariate(0, 0.35)
+            if date_time.weekday() >= 5:
+                popularity *= 1.3
+            status = 'cancelled' if rng.random() < 0.03 else 'active'
+            class_plan.append([rng.choice(CLASS_TYPES), rng.choice(INSTRUCTORS), date_time,
+                               rng.choice([60, 75, 75, 90]), rng.choice([8, 10, 12, 15, 20]), status,
+                               rng.choice(LOCATIONS), popularity])
+
+        # Share the booking total out by popularity, and make room for every active booking
+        total_popularity = sum(plan[7] for plan in class_plan) or 1
+        for plan in class_plan:
+            plan[7] = min(len(user_ids), round(bookings * plan[7] / total_popularity))
+            plan[4] = max(plan[4], round(plan[7] * 0.9))
+
+        last_class_id = _max_id(conn, 'YogaClasses')
+        class_rows = ((name, instructor, date_time.isoformat(' '), duration, capacity, status, location)
+                      for name, instructor, date_time, duration, capacity, status, location, _ in class_plan)
+        _bulk_insert(yoga_app, conn, 'YogaClasses',
+                     ('name', 'instructor', 'date_time', 'duration', 'capacity', 'status', 'location'),
+                     class_rows, batch_size)
+        class_ids = _ids_after(conn, 'YogaClasses', last_class_id)
+
+        # Bookings, generated lazily so millions of rows never sit in memory
+        def booking_rows():
+            for class_id, plan in zip(class_ids, class_plan):
+                date_time, capacity, class_status, count = plan[2], plan[4], plan[5], plan[7]
+                cancel_rate = 0.12 if date_time < now else 0.07
+                active = 0
+                for user_id in rng.sample(user_ids, count):
+                    booked_at = min(date_time - timedelta(hours=rng.expovariate(1 / 96) + 1), now)
+                    if class_status == 'cancelled' or active >= capacity or rng.random() < cancel_rate:
+                        status = 'cancelled'
+                    else:
+                        status = 'active'
+                        active += 1
+                    yield (user_id, class_id, booked_at.isoformat(' ', timespec='seconds'), status)
+
+        booking_count = _bulk_insert(yoga_app, conn, 'Bookings', ('user_id', 'class_id', 'booking_date', 'status'),
+                                     booking_rows(), batch_size)
+
+        # Fresh statistics so query plans reflect the new volumes
+        if db_type in ('sqlite', 'postgresql'):
+            cursor = conn.cursor()
+            cursor.execute("ANALYZE")
+            conn.commit()
+            cursor.close()
+
+    print(f"Generated {len(user_ids):,} users, {len(class_ids):,} classes and {booking_count:,} bookings "
+          f"in {time.time() - start_time:.1f}s")
+    return {'users': len(user_ids), 'classes': len(class_ids), 'bookings': booking_count}
+
 def main():
     """Main function to handle command line arguments"""
     if len(sys.argv) < 2:
@@ -199,20 +406,26 @@ def main():
         print("Usage: python manage_db.py <command>")
         print("\nAvailable commands:")
         print("  setup       - Create tables (safe to run multiple times)")
+        print("  init        - Create or upgrade the schema of the app's configured database (run before starting workers)")
         print("  reset       - Delete database and recreate with sample data")
         print("  sample      - Add sample data to existing database")
         print("  show        - Display all database contents")
         print("  check       - Check if database exists")
+        print("  sweep       - Remove expired tokens and stale unverified users (add 'archive' to keep a copy)")
+        print("  generate    - Bulk-create a large synthetic dataset for performance testing (see generate --help)")
         print("\nExamples:")
         print("  python manage_db.py setup")
         print("  python manage_db.py reset")
         print("  python manage_db.py show")
+        print("  python manage_db.py generate --users 200000 --classes 20000 --bookings 5000000 --seed 42")
         return
 
     command = sys.argv[1].lower()
 
     if command == 'setup':
         create_tables()
+    elif command == 'init':
+        init_app_database()
     elif command == 'reset':
         reset_database()
         add_sample_data()
@@ -228,6 +441,20 @@ def main():
             print("Database doesn't exist. Run 'setup' first.")
     elif command == 'check':
         check_database_exists()
+    elif command == 'sweep':
+        sweep_database(sys.argv[2].lower() if len(sys.argv) > 2 else None)
+    elif command == 'generate':
+        parser = argparse.ArgumentParser(prog='manage_db.py generate',
+                                         description='Bulk-create synthetic data in the configured database')
+        parser.add_argument('--users', type=int, default=200000)
+        parser.add_argument('--classes', type=int, default=20000)
+        parser.add_argument('--bookings', type=int, default=5000000)
+        parser.add_argument('--years', type=int, default=3, help='Years of class history to spread classes over')
+        parser.add_argument('--seed', type=int, default=42, help='Same seed, same data')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        options = parser.parse_args(sys.argv[2:])
+        generate_dataset(options.users, options.classes, options.bookings, options.years,
+                         options.seed, options.batch_size)
     else:
         print(f"Unknown command: {command}")
         print("Run without arguments to see available commands.")
@@ -0,0 +1,211 @@
+"""
+Live seat availability stream served from a single asyncio event loop.
+
+The web app's /classes/stream holds one gunicorn thread per open stream. Run this process next to it
+and point SEAT_STREAM_URL at it: the app then redirects /classes/stream here, where every stream is
+a socket on one event loop instead of a thread.
+
+Seat changes arrive the same way they reach the web workers: through the 'catalog' topic of the
+invalidation bus, into this process's SeatEventHub. One relay thread waits on the hub and hands each
+batch to the loop, which writes the already formatted events to every client.
+
+    python seat_stream.py          # listens on SEAT_STREAM_PORT, else PORT, else 8001
+"""
+import asyncio
+import logging
+import os
+import signal
+import threading
+
+from app import app, create_app, ensure_log_listener, invalidation_bus, seat_events
+
+logger = logging.getLogger('yoga_booking.seat_stream')
+
+# Outgoing bytes a client may leave unread before it is dropped (it reconnects and resyncs)
+MAX_CLIENT_BUFFER = 64 * 1024
+REQUEST_TIMEOUT = 10
+
+
+class SeatStreamClient:
+    """One open stream: the socket writer and the id of the last event it was sent"""
+
+    def __init__(self, writer, last_id):
+        self.writer = writer
+        self.last_id = last_id
+
+    def send(self, data):
+        """Queue data on the socket without blocking; drop the client when it stops reading"""
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            transport.abort()
+            return
+        self.writer.write(data.encode())
+
+
+class SeatStreamServer:
+    """
+    Minimal HTTP/1.1 server for GET /classes/stream.
+    Only the event loop touches the client set, so broadcasting needs no locks.
+    """
+
+    def __init__(self, max_clients, keepalive):
+        self.max_clients = max_clients
+        self.keepalive = keepalive
+        self.clients = set()
+        self.loop = None
+
+    def broadcast(self, events, missed):
+        """Runs on the loop: write a batch from the hub to every client that hasn't seen it"""
+        for client in list(self.clients):
+            if missed:
+                client.send("event: resync\ndata: {}\n\n")
+            self._send_events(client, events)
+
+    def _send_events(self, client, events):
+        for event_id, message in events:
+            if event_id > client.last_id:
+                client.send(message)
+                client.last_id = event_id
+
+    def _relay(self):
+        """
+        Thread: wait on the hub and pass every new batch to the loop.
+        Registering as a hub subscriber makes publish_seat_change look up seat counts in this process.
+        """
+        last_id = seat_events.subscribe()
+        while not seat_events.closed:
+            events, missed = seat_events.wait_for_events(last_id, self.keepalive)
+            if missed and not events:
+                last_id = seat_events.last_id
+            if events:
+                last_id = events[-1][0]
+            if events or missed:
+                self.loop.call_soon_threadsafe(self.broadcast, events, missed)
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for client in list(self.clients):
+                client.send(": keepalive\n\n")
+
+    async def _respond(self, writer, status, body, extra_headers=()):
+        headers = [f"HTTP/1.1 {status}", 'Content-Type: application/json',
+                   f"Content-Length: {len(body)}", 'Access-Control-Allow-Origin: *',
+                   'Connection: close', *extra_headers]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n' + body).encode())
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        lines = head.decode('latin-1').split('\r\n')
+        method, target = (lines[0].split(' ') + ['', ''])[:2]
+        path = target.split('?', 1)[0]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        client = None
+        try:
+            if method != 'GET' or path not in ('/classes/stream', '/healthz'):
+                await self._respond(writer, '404 Not Found', '{"error":"Not found"}')
+                return
+            if path == '/healthz':
+                await self._respond(writer, '200 OK', '{"status":"healthy","streams":%d}' % len(self.clients))
+                return
+            if len(self.clients) >= self.max_clients:
+                await self._respond(writer, '503 Service Unavailable',
+                                    '{"error":"Too many open seat streams, retry later"}', ('Retry-After: 30',))
+                return
+
+            try:
+                last_id = int(headers.get('last-event-id', ''))
+            except ValueError:
+                last_id = None
+            writer.write(('HTTP/1.1 200 OK\r\n'
+                          'Content-Type: text/event-stream\r\n'
+                          'Cache-Control: no-cache\r\n'
+                          'X-Accel-Buffering: no\r\n'
+                          'Access-Control-Allow-Origin: *\r\n'
+                          'Connection: close\r\n\r\n'
+                          # Tell the browser how long to wait before reconnecting
+                          'retry: 5000\n\n').encode())
+
+            client = SeatStreamClient(writer, seat_events.last_id)
+            self.clients.add(client)
+            if last_id is not None:
+                # Replay what the client missed; the hub lock is only held for a copy of the buffer
+                events, missed = seat_events.wait_for_events(last_id, 0)
+                if missed:
+                    client.send("event: resync\ndata: {}\n\n")
+                else:
+                    client.last_id = last_id
+                    self._send_events(client, events)
+
+            # The client never sends anything else; EOF means it went away
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(sig, stop.set)
+
+        threading.Thread(target=self._relay, name='seat-stream-relay', daemon=True).start()
+        keepalive = asyncio.create_task(self._keepalive())
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        logger.info(f"Seat stream listening on {host}:{port}, up to {self.max_clients} streams")
+
+        async with server:
+            await stop.wait()
+            # Before leaving the block: closing the server waits for open connections on newer Pythons
+            keepalive.cancel()
+            seat_events.close()
+            open_streams = len(self.clients)
+            for client in list(self.clients):
+                client.writer.close()
+            # Let the handlers see EOF and finish before the loop cancels them
+            await asyncio.sleep(0.1)
+        logger.info(f"Seat stream stopped, closed {open_streams} streams")
+
+
+def raise_file_limit(wanted):
+    """Every stream is an open socket; lift the soft descriptor limit as far as the hard limit allows"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+def main():
+    # No maintenance, probes or rollups here: only the bus that carries seat changes
+    create_app(start_services=False)
+    ensure_log_listener()
+    invalidation_bus.start()
+
+    max_clients = app.config['SEAT_STREAM_MAX_CLIENTS']
+    raise_file_limit(max_clients + 256)
+    port = int(os.getenv('SEAT_STREAM_PORT') or os.getenv('PORT') or '8001')
+    server = SeatStreamServer(max_clients, app.config['SEAT_STREAM_KEEPALIVE'])
+    asyncio.run(server.serve('0.0.0.0', port))
+
+
+if __name__ == '__main__':
+    main()